@@ -25,6 +25,7 @@ from .token import CustomToken  # Add this import at the top
 class OrganizationListCreateView(generics.ListCreateAPIView):
     queryset = Organization.objects.all()
     serializer_class = OrganizationSerializer
+    ordering = ['id']
 
 
 class OrganizationDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -310,13 +311,16 @@ class UserListView(generics.ListAPIView):
     permission_classes = (IsAuthenticated,)
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
+    ordering = ['id']
 
     def list(self, request, *args, **kwargs):
         try:
-            users = self.get_queryset()
+            users = self.get_queryset().only(
+                'id', 'email', 'first_name', 'last_name', 'phone_number', 'user_type', 'profile_picture')
+            page = self.paginate_queryset(users)
             data = []
 
-            for user in users:
+            for user in users if page is None else page:
                 # Build the profile picture URL only if it exists
                 profile_picture_url = None
                 if user.profile_picture and hasattr(user.profile_picture, 'url'):
@@ -333,7 +337,9 @@ class UserListView(generics.ListAPIView):
                     'profile_picture': profile_picture_url
                 })
 
-            return Response(data)
+            if page is None:
+                return Response(data)
+            return self.get_paginated_response(data)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
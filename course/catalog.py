@@ -0,0 +1,162 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Count
+
+from .models import Chapter, Class, Lesson, Question, Subject, Video
+
+CATALOG_VERSION_KEY = 'course:catalog:version'
+# Models whose rows appear in the tree, by their names and icons or in the counts
+CATALOG_MODELS = (Class, Subject, Chapter, Lesson, Video, Question)
+# Branch query parameters, from the top of the tree down, with the list holding their children
+LEVELS = [('class', 'subjects'), ('subject', 'chapters'), ('chapter', 'lessons'), ('lesson', None)]
+
+
+def catalog_version():
+    """Random token that changes every time a catalog model is saved or deleted"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # A lost version must never bring back a tree built before it was lost
+        cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def invalidate_catalog():
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _node(row, children=None):
+    node = {
+        'id': row['id'],
+        'name': row['name'],
+        'slug': row['slug'],
+        'icon': default_storage.url(row['icon']) if row['icon'] else None,
+        'counts': {'lessons': 0, 'videos': 0, 'questions': 0},
+    }
+    if children:
+        node[children] = []
+    return node
+
+
+def build_catalog():
+    """Every class with its subjects, chapters and lessons, and their counts.
+
+    Six queries whatever the size of the catalog, one per level and one
+    per counted model. The counts of a node add up those of its lessons.
+    """
+    fields = ('id', 'name', 'slug', 'icon')
+    videos = dict(Video.objects.filter(lesson_name__isnull=False).values('lesson_name_id').annotate(
+        count=Count('id')).values_list('lesson_name_id', 'count'))
+    questions = dict(Question.objects.values('lesson_id').annotate(
+        count=Count('id')).values_list('lesson_id', 'count'))
+
+    classes = {row['id']: _node(row, 'subjects') for row in Class.objects.order_by('id').values(*fields)}
+    subjects = {}
+    for row in Subject.objects.order_by('id').values(*fields, 'class_name_id'):
+        subjects[row['id']] = _node(row, 'chapters')
+        classes[row['class_name_id']]['subjects'].append(subjects[row['id']])
+    chapters = {}
+    for row in Chapter.objects.order_by('id').values(*fields, 'subject_name_id'):
+        chapters[row['id']] = _node(row, 'lessons')
+        subjects[row['subject_name_id']]['chapters'].append(chapters[row['id']])
+
+    for row in Lesson.objects.order_by('id').values(
+            *fields, 'chapter_name_id', 'chapter_name__subject_name_id', 'chapter_name__subject_name__class_name_id'):
+        lesson = _node(row)
+        lesson['counts'] = {
+            'lessons': 1,
+            'videos': videos.get(row['id'], 0),
+            'questions': questions.get(row['id'], 0),
+        }
+        chapters[row['chapter_name_id']]['lessons'].append(lesson)
+        for parent in (chapters[row['chapter_name_id']],
+                       subjects[row['chapter_name__subject_name_id']],
+                       classes[row['chapter_name__subject_name__class_name_id']]):
+            for name, count in lesson['counts'].items():
+                parent['counts'][name] += count
+    return list(classes.values())
+
+
+def get_catalog():
+    """The catalog tree and its version, built once per version and then read from the cache"""
+    version = catalog_version()
+    key = f'course:catalog:{version}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_catalog()
+        cache.set(key, tree, settings.CATALOG_CACHE_TIMEOUT)
+    return tree, version
+
+
+def find_branch(tree, level, slug):
+    """The node of a level with the slug, or None"""
+    nodes = tree
+    for name, children in LEVELS:
+        for node in nodes:
+            if name == level and node['slug'] == slug:
+                return node
+        if children is None:
+            return None
+        nodes = [child for node in nodes for child in node[children]]
+    return None
+
+
+def with_absolute_icons(node, request):
+    """Copy of a node and its children with icon URLs made absolute for the request"""
+    node = {**node, 'icon': request.build_absolute_uri(node['icon']) if node['icon'] else None}
+    for _, children in LEVELS:
+        if children and children in node:
+            node[children] = [with_absolute_icons(child, request) for child in node[children]]
+    return node
+
+
+# Catalog nodes of this process keyed by their slug path, rebuilt when the version moves on
+_slug_paths = (None, {})
+
+
+def build_slug_paths(tree):
+    """Every node of the tree keyed by the slugs from its class down to it"""
+    nodes = {}
+
+    def walk(children, depth, path):
+        level, child_key = LEVELS[depth]
+        for node in children:
+            if not node['slug']:
+                continue
+            node_path = path + (node['slug'],)
+            nodes[node_path] = (level, node)
+            if child_key:
+                walk(node[child_key], depth + 1, node_path)
+
+    walk(tree, 0, ())
+    return nodes
+
+
+def resolve_path(slugs):
+    """The nodes from the class down to the one at a slug path, and the catalog version.
+
+    Lookups go through an in-memory map of slug paths, which is rebuilt
+    from the cached tree only when a course edit moved the catalog version
+    on, so resolving a path normally costs a single cache read. The nodes
+    are None when a slug is unknown or not below the one before it.
+    """
+    global _slug_paths
+    version, nodes = _slug_paths
+    if version != catalog_version():
+        tree, version = get_catalog()
+        nodes = build_slug_paths(tree)
+        # Swapped in one assignment, other threads see the old map or the new one
+        _slug_paths = (version, nodes)
+
+    slugs = tuple(slugs)
+    if not slugs or len(slugs) > len(LEVELS) or slugs not in nodes:
+        return None, version
+    return [nodes[slugs[:depth]] for depth in range(1, len(slugs) + 1)], version
+
+
+def without_children(node):
+    """Copy of a node without the list of its children"""
+    return {key: value for key, value in node.items() if key not in {children for _, children in LEVELS}}
@@ -0,0 +1,134 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+
+from .models import LearningMaterial, Lesson, Question, QuestionOption, Video
+
+# Fields of the detail holding storage URLs, made absolute per request
+FILE_FIELDS = {'videos': ('video_file', 'video_thumbnail'), 'learning_materials': ('file',)}
+
+LESSON_PREFETCH = ['video_set', 'materials', 'questions__options']
+
+# Field holding the lesson of each model a lesson detail is built from
+DETAIL_LESSON_FIELDS = {
+    Lesson: 'id',
+    Video: 'lesson_name_id',
+    LearningMaterial: 'lesson_id',
+    Question: 'lesson_id',
+    QuestionOption: 'question__lesson_id',
+}
+
+
+def _version_key(lesson_id):
+    return f'course:lesson:{lesson_id}:detail:version'
+
+
+def lesson_detail_version(lesson_id):
+    """Random token that changes every time the lesson or something in its detail is saved or deleted"""
+    key = _version_key(lesson_id)
+    version = cache.get(key)
+    if version is None:
+        # A lost version must never bring back a detail built before it was lost
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_lesson_details(lesson_ids):
+    cache.set_many({_version_key(lesson_id): uuid.uuid4().hex for lesson_id in lesson_ids}, None)
+
+
+def _file_url(field):
+    return field.url if field else None
+
+
+def build_lesson_detail(lesson):
+    """A lesson with its videos, learning materials and questions with their options.
+
+    Four queries whatever the number of questions, one per related model,
+    fewer when the lesson already had them prefetched.
+    """
+    prefetch_related_objects([lesson], *LESSON_PREFETCH)
+
+    videos = []
+    total_duration = 0
+    for video in lesson.video_set.all():
+        if video.video_duration:
+            total_duration += video.video_duration
+        videos.append({
+            'id': video.id,
+            'name': video.name,
+            'slug': getattr(video, 'slug', None),
+            'video_url': video.video_url,
+            'video_file': _file_url(video.video_file),
+            'video_duration': video.video_duration,
+            'video_thumbnail': _file_url(video.video_thumbnail),
+            'created_at': video.created_at,
+            'updated_at': video.updated_at,
+        })
+
+    return {
+        'id': lesson.id,
+        'chapter_name': lesson.chapter_name_id,
+        'name': lesson.name,
+        'slug': lesson.slug,
+        'description': lesson.description,
+        'icon': _file_url(lesson.icon),
+        'created_at': lesson.created_at,
+        'updated_at': lesson.updated_at,
+        'videos': videos,
+        'total_video_duration': total_duration,
+        'learning_materials': [{
+            'id': material.id,
+            'title': material.title,
+            'material_type': material.material_type,
+            'description': material.description,
+            'file': _file_url(material.file),
+            'game_url': material.game_url,
+            'created_at': material.created_at,
+            'updated_at': material.updated_at,
+        } for material in lesson.materials.all()],
+        'questions': [{
+            'id': question.id,
+            'question_text': question.question_text,
+            'explanation': question.explanation,
+            'options': [{
+                'id': option.id,
+                'option': option.option,
+                'is_correct': option.is_correct,
+                'explanation': option.explanation,
+            } for option in question.options.all()],
+        } for question in lesson.questions.all()],
+    }
+
+
+def get_lesson_detail(lesson, use_cache=True):
+    """The detail of a lesson, cached per lesson and detail version when use_cache is set.
+
+    Edits to the lesson, its videos, materials, questions or options move
+    its own version on, so a cached detail never outlives a change to it
+    while edits elsewhere in the course leave it cached. A
+    LESSON_DETAIL_CACHE_TIMEOUT of 0 turns the cache off.
+    """
+    timeout = settings.LESSON_DETAIL_CACHE_TIMEOUT
+    if not (use_cache and timeout):
+        return build_lesson_detail(lesson)
+    key = f'course:lesson:{lesson.id}:detail:{lesson_detail_version(lesson.id)}'
+    detail = cache.get(key)
+    if detail is None:
+        detail = build_lesson_detail(lesson)
+        cache.set(key, detail, timeout)
+    return detail
+
+
+def with_absolute_urls(detail, request):
+    """Copy of a lesson detail with its file URLs made absolute for the request"""
+    def absolute(url):
+        return request.build_absolute_uri(url) if url else None
+
+    detail = {**detail, 'icon': absolute(detail['icon'])}
+    for name, fields in FILE_FIELDS.items():
+        detail[name] = [{**item, **{field: absolute(item[field]) for field in fields}} for item in detail[name]]
+    return detail
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from course.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of lessons, questions, learning materials and blogs"
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the search index ({count} documents)"))
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE VIRTUAL TABLE course_search USING fts5(
+                    kind UNINDEXED, object_id UNINDEXED, lesson_id UNINDEXED, title, body,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+                """,
+                """
+                INSERT INTO course_search (kind, object_id, lesson_id, title, body)
+                SELECT 'lesson', id, id, name, COALESCE(description, '') FROM course_lesson
+                UNION ALL
+                SELECT 'question', id, lesson_id, question_text, COALESCE(explanation, '') FROM course_question
+                UNION ALL
+                SELECT 'material', id, lesson_id, COALESCE(title, ''), COALESCE(description, '')
+                FROM course_learningmaterial
+                UNION ALL
+                SELECT 'blog', id, NULL, title, TRIM(COALESCE(meta_description, '') || ' ' || description)
+                FROM blog_blog
+                """,
+            ],
+            reverse_sql='DROP TABLE course_search',
+        ),
+    ]
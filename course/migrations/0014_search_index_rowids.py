@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-17 21:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0013_search_index'),
+    ]
+
+    operations = [
+        # Documents are now addressed by a rowid of object_id * 8 + the code of their kind
+        migrations.RunSQL(
+            sql=[
+                'CREATE TEMP TABLE course_search_documents AS SELECT kind, object_id, lesson_id, title, body FROM course_search',
+                'DELETE FROM course_search',
+                """
+                INSERT INTO course_search (rowid, kind, object_id, lesson_id, title, body)
+                SELECT object_id * 8 + CASE kind
+                    WHEN 'lesson' THEN 0 WHEN 'question' THEN 1 WHEN 'material' THEN 2 ELSE 3 END,
+                    kind, object_id, lesson_id, title, body
+                FROM course_search_documents
+                """,
+                'DROP TABLE course_search_documents',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,153 @@
+from html import escape
+from itertools import islice
+
+from django.db import connection, transaction
+
+from blog.models import Blog
+from .models import LearningMaterial, Lesson, Question
+
+SEARCH_TABLE = 'course_search'
+# Column weights for ranking, a match in a title counts ten times one in a body
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+# Rows read and inserted at a time while rebuilding the index
+REBUILD_BATCH_SIZE = 2000
+# Control characters marking matches in snippets, stripped from the indexed text
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+
+def _lesson_document(lesson):
+    return lesson.id, lesson.name, lesson.description
+
+
+def _question_document(question):
+    return question.lesson_id, question.question_text, question.explanation
+
+
+def _material_document(material):
+    return material.lesson_id, material.title, material.description
+
+
+def _blog_document(blog):
+    return None, blog.title, ' '.join(filter(None, [blog.meta_description, blog.description]))
+
+
+# Kind of each searchable model, with the (lesson id, title, body) of its instances
+KINDS = {
+    'lesson': (Lesson, _lesson_document),
+    'question': (Question, _question_document),
+    'material': (LearningMaterial, _material_document),
+    'blog': (Blog, _blog_document),
+}
+MODEL_KINDS = {model: kind for kind, (model, _) in KINDS.items()}
+# Each document's rowid is object_id * ROWID_KINDS + the code of its kind, so
+# a document is found through the FTS5 rowid rather than by scanning the
+# UNINDEXED kind and object_id columns
+KIND_CODES = {'lesson': 0, 'question': 1, 'material': 2, 'blog': 3}
+ROWID_KINDS = 8
+
+
+def document_rowid(kind, object_id):
+    return object_id * ROWID_KINDS + KIND_CODES[kind]
+
+
+def _row(kind, object_id, lesson_id, title, body):
+    """Index row of a document, without the characters reserved for match markers"""
+    def text(value):
+        return (value or '').replace(MATCH_START, '').replace(MATCH_END, '')
+    return document_rowid(kind, object_id), kind, object_id, lesson_id, text(title), text(body)
+
+
+def index_object(instance):
+    """Add or replace an instance in the search index, in the caller's transaction"""
+    kind = MODEL_KINDS[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [document_rowid(kind, instance.pk)])
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, lesson_id, title, body) VALUES (%s, %s, %s, %s, %s, %s)',
+            _row(kind, instance.pk, *KINDS[kind][1](instance)))
+
+
+def remove_object(instance):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [document_rowid(MODEL_KINDS[type(instance)], instance.pk)])
+
+
+def rebuild_search_index():
+    """Index every lesson, question, learning material and blog from scratch. Returns the number indexed"""
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        for kind, (model, document) in KINDS.items():
+            instances = model.objects.iterator(chunk_size=REBUILD_BATCH_SIZE)
+            # One batch in memory at a time, however large the table
+            while batch := list(islice(instances, REBUILD_BATCH_SIZE)):
+                cursor.executemany(
+                    f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, lesson_id, title, body) '
+                    f'VALUES (%s, %s, %s, %s, %s, %s)',
+                    [_row(kind, instance.pk, *document(instance)) for instance in batch])
+                count += len(batch)
+        # Merge the segments written above so queries read one b-tree
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def highlight(snippet):
+    """HTML of a snippet, its text escaped and its matches wrapped in <mark>"""
+    return escape(snippet or '').replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def match_expression(query):
+    """FTS5 expression matching documents holding every word of a query, the last one as a prefix.
+
+    Each word is quoted so that user input never reaches the FTS5 query
+    syntax. None when the query has no words.
+    """
+    words = query.split()
+    if not words:
+        return None
+    terms = ['"{}"'.format(word.replace('"', '""')) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(query, kinds=None, limit=20):
+    """Best matches of a query across lessons, questions, materials and blogs, with snippets.
+
+    One ranked lookup on the FTS5 index, plus one query each for the
+    lesson and blog slugs the results link to.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    kinds = [kind for kind in KINDS if kind in kinds] if kinds else list(KINDS)
+    placeholders = ', '.join(['%s'] * len(kinds))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT kind, object_id, lesson_id, title,
+                   snippet({SEARCH_TABLE}, -1, %s, %s, '…', 12),
+                   bm25({SEARCH_TABLE}, 0, 0, 0, %s, %s) AS rank
+            FROM {SEARCH_TABLE}
+            WHERE {SEARCH_TABLE} MATCH %s AND kind IN ({placeholders})
+            ORDER BY rank
+            LIMIT %s
+            """,
+            [MATCH_START, MATCH_END, TITLE_WEIGHT, BODY_WEIGHT, expression, *kinds, limit])
+        rows = cursor.fetchall()
+
+    lesson_slugs = dict(Lesson.objects.filter(
+        id__in={row[2] for row in rows if row[2]}).values_list('id', 'slug'))
+    blog_slugs = dict(Blog.objects.filter(
+        id__in=[row[1] for row in rows if row[0] == 'blog']).values_list('id', 'slug'))
+    return [{
+        'kind': kind,
+        'id': object_id,
+        'title': title,
+        'snippet': highlight(snippet),
+        'lesson': lesson_id,
+        'slug': blog_slugs.get(object_id) if kind == 'blog' else lesson_slugs.get(lesson_id),
+        # bm25 scores are negative, better matches lower
+        'score': -rank,
+    } for kind, object_id, lesson_id, title, snippet, rank in rows]
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .catalog import CATALOG_MODELS, invalidate_catalog
+from .lesson_detail import DETAIL_LESSON_FIELDS, invalidate_lesson_details
+from .models import Lesson, Question, QuestionOption
+from .search import MODEL_KINDS, index_object, remove_object
+
+
+def course_model_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(invalidate_catalog)
+
+
+# Reviews, options and materials are not in the tree and leave it cached
+for model in CATALOG_MODELS:
+    post_save.connect(course_model_changed, sender=model, dispatch_uid=f'catalog-save-{model._meta.model_name}')
+    post_delete.connect(course_model_changed, sender=model, dispatch_uid=f'catalog-delete-{model._meta.model_name}')
+
+
+def _lesson_id(sender, instance):
+    """Lesson whose detail an instance appears in, as the instance has it now"""
+    if sender is Lesson:
+        return instance.pk
+    if sender is QuestionOption:
+        return Question.objects.filter(id=instance.question_id).values_list('lesson_id', flat=True).first()
+    return getattr(instance, DETAIL_LESSON_FIELDS[sender])
+
+
+def _invalidate_on_commit(lesson_ids):
+    lesson_ids = lesson_ids - {None}
+    if lesson_ids:
+        transaction.on_commit(lambda: invalidate_lesson_details(lesson_ids))
+
+
+def detail_content_saving(sender, instance, raw=False, **kwargs):
+    # A row moved to another lesson leaves the detail of the one it was in stale too
+    if not raw and instance.pk is not None and sender is not Lesson:
+        instance._stored_lesson_id = sender.objects.filter(pk=instance.pk).values_list(
+            DETAIL_LESSON_FIELDS[sender], flat=True).first()
+
+
+def detail_content_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidate_on_commit({getattr(instance, '_stored_lesson_id', None), _lesson_id(sender, instance)})
+
+
+def detail_content_deleted(sender, instance, **kwargs):
+    # An option deleted along with its question finds no lesson, the question's own delete covers it
+    _invalidate_on_commit({_lesson_id(sender, instance)})
+
+
+# Each lesson detail is cached under a version of its own
+for model in DETAIL_LESSON_FIELDS:
+    pre_save.connect(detail_content_saving, sender=model, dispatch_uid=f'detail-presave-{model._meta.model_name}')
+    post_save.connect(detail_content_saved, sender=model, dispatch_uid=f'detail-save-{model._meta.model_name}')
+    post_delete.connect(detail_content_deleted, sender=model, dispatch_uid=f'detail-delete-{model._meta.model_name}')
+
+
+def searchable_saved(sender, instance, **kwargs):
+    index_object(instance)
+
+
+def searchable_deleted(sender, instance, **kwargs):
+    remove_object(instance)
+
+
+# The search index lives in the same database, it is written in the transaction of the change
+for model in MODEL_KINDS:
+    post_save.connect(searchable_saved, sender=model, dispatch_uid=f'search-save-{model._meta.label_lower}')
+    post_delete.connect(searchable_deleted, sender=model, dispatch_uid=f'search-delete-{model._meta.label_lower}')
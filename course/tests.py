@@ -1,3 +1,270 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from account.models import CustomUser
+
+from .catalog import get_catalog, resolve_path
+from .lesson_detail import get_lesson_detail
+from .search import SEARCH_TABLE, document_rowid, rebuild_search_index, search
+from .models import (
+    Chapter, Class, LearningMaterial, Lesson, LessonReview, Question, QuestionOption, Subject, Video,
+)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LessonDetailQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        class_obj = Class.objects.create(name='Class 8')
+        subject = Subject.objects.create(class_name=class_obj, name='Science')
+        chapter = Chapter.objects.create(subject_name=subject, name='Light')
+        self.lesson = Lesson.objects.create(chapter_name=chapter, name='Reflection')
+
+    def add_content(self, count):
+        for n in range(count):
+            Video.objects.create(lesson_name=self.lesson, name=f'Video {n}', video_duration=60)
+            LearningMaterial.objects.create(lesson=self.lesson, title=f'Notes {n}', material_type='Notes')
+            question = Question.objects.create(lesson=self.lesson, question_text=f'Question {n}')
+            for m in range(4):
+                QuestionOption.objects.create(question=question, option=f'Option {m}', is_correct=m == 0)
+
+    def detail_queries(self):
+        lesson = Lesson.objects.get(id=self.lesson.id)
+        with self.assertNumQueries(4):
+            return get_lesson_detail(lesson, use_cache=False)
+
+    def test_query_count_does_not_grow_with_content(self):
+        self.add_content(1)
+        self.assertEqual(len(self.detail_queries()['questions']), 1)
+        self.add_content(30)
+        detail = self.detail_queries()
+        self.assertEqual(len(detail['questions']), 31)
+        self.assertEqual(detail['total_video_duration'], 31 * 60)
+
+    def test_cached_detail_needs_no_queries_until_an_edit(self):
+        self.add_content(2)
+        lesson = Lesson.objects.get(id=self.lesson.id)
+        get_lesson_detail(lesson)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_lesson_detail(lesson)['questions']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_content(1)
+        self.assertEqual(len(get_lesson_detail(Lesson.objects.get(id=self.lesson.id))['questions']), 3)
+
+    def cached_detail(self, lesson):
+        # A fresh instance each time, a lesson keeps what it had prefetched
+        return get_lesson_detail(Lesson.objects.get(id=lesson.id))
+
+    def test_edits_to_another_lesson_keep_the_detail_cached(self):
+        self.add_content(1)
+        self.cached_detail(self.lesson)
+        lesson = Lesson.objects.get(id=self.lesson.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Lesson.objects.create(chapter_name=self.lesson.chapter_name, name='Refraction')
+            Question.objects.create(lesson=other, question_text='Why does a straw look bent?')
+        with self.assertNumQueries(0):
+            get_lesson_detail(lesson)
+
+    def test_option_edits_and_moved_questions_refresh_the_detail(self):
+        self.add_content(1)
+        other = Lesson.objects.create(chapter_name=self.lesson.chapter_name, name='Refraction')
+        self.cached_detail(self.lesson)
+        self.cached_detail(other)
+
+        option = QuestionOption.objects.filter(question__lesson=self.lesson).first()
+        option.option = 'Edited'
+        with self.captureOnCommitCallbacks(execute=True):
+            option.save()
+        options = self.cached_detail(self.lesson)['questions'][0]['options']
+        self.assertIn('Edited', [item['option'] for item in options])
+
+        question = Question.objects.get(lesson=self.lesson)
+        question.lesson = other
+        with self.captureOnCommitCallbacks(execute=True):
+            question.save()
+        self.assertEqual(self.cached_detail(self.lesson)['questions'], [])
+        self.assertEqual(len(self.cached_detail(other)['questions']), 1)
+
+
+class ValidateAnswerViewTests(TestCase):
+    def setUp(self):
+        class_obj = Class.objects.create(name='Class 8')
+        subject = Subject.objects.create(class_name=class_obj, name='Science')
+        chapter = Chapter.objects.create(subject_name=subject, name='Light')
+        lesson = Lesson.objects.create(chapter_name=chapter, name='Reflection')
+        self.question = Question.objects.create(lesson=lesson, question_text='Which way does light bounce?')
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user(
+            username='learner', email='learner@example.com', password='secret'))
+
+    def validate(self, option):
+        return self.client.post('/api/validate-answer/', {'question_id': self.question.id, 'option_id': option.id},
+                                format='json')
+
+    @mock.patch('course.views.schedule_review')
+    @mock.patch('course.views.record_answer')
+    def test_answer_is_recorded_with_its_result(self, record_answer, schedule_review):
+        QuestionOption.objects.create(question=self.question, option='Back', is_correct=True)
+        wrong = QuestionOption.objects.create(question=self.question, option='Through', is_correct=False)
+        response = self.validate(wrong)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_correct'])
+        record_answer.assert_called_once()
+        schedule_review.assert_called_once_with(response.wsgi_request.user.id, self.question.id, False)
+
+    @mock.patch('course.views.schedule_review')
+    @mock.patch('course.views.record_answer')
+    def test_question_without_a_correct_option_records_nothing(self, record_answer, schedule_review):
+        wrong = QuestionOption.objects.create(question=self.question, option='Through', is_correct=False)
+        self.assertEqual(self.validate(wrong).status_code, 500)
+        record_answer.assert_not_called()
+        schedule_review.assert_not_called()
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        class_obj = Class.objects.create(name='Class 8')
+        subject = Subject.objects.create(class_name=class_obj, name='Science')
+        chapter = Chapter.objects.create(subject_name=subject, name='Light')
+        self.lesson = Lesson.objects.create(chapter_name=chapter, name='Reflection')
+
+    def test_snippet_escapes_the_indexed_text(self):
+        Question.objects.create(lesson=self.lesson, question_text='Angles',
+                                explanation='<img src=x onerror=alert(1)> mirrors reflect \x02light\x03')
+        [result] = search('mirrors', kinds=['question'])
+        self.assertIn('&lt;img src=x onerror=alert(1)&gt;', result['snippet'])
+        self.assertIn('<mark>mirrors</mark>', result['snippet'])
+        self.assertEqual(result['snippet'].count('<mark>'), 1)
+
+    def test_edits_replace_the_document_by_rowid(self):
+        question = Question.objects.create(lesson=self.lesson, question_text='Mirror angles')
+        question.question_text = 'Mirror images'
+        question.save()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid, title FROM {SEARCH_TABLE} WHERE kind = 'question'")
+            self.assertEqual(cursor.fetchall(), [(document_rowid('question', question.id), 'Mirror images')])
+        question.delete()
+        self.assertEqual(search('mirror'), [])
+
+    def test_rebuild_indexes_every_batch(self):
+        for n in range(5):
+            Question.objects.create(lesson=self.lesson, question_text=f'Mirror question {n}')
+        with mock.patch('course.search.REBUILD_BATCH_SIZE', 2):
+            self.assertEqual(rebuild_search_index(), 6)
+        self.assertEqual(len(search('mirror', kinds=['question'])), 5)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        class_obj = Class.objects.create(name='Class 8')
+        subject = Subject.objects.create(class_name=class_obj, name='Science')
+        self.chapter = Chapter.objects.create(subject_name=subject, name='Light')
+        self.lesson = Lesson.objects.create(chapter_name=self.chapter, name='Reflection')
+        other = Lesson.objects.create(chapter_name=self.chapter, name='Refraction')
+        Video.objects.create(lesson_name=self.lesson, name='Mirrors', video_duration=60)
+        for lesson in (self.lesson, other):
+            self.question = Question.objects.create(lesson=lesson, question_text=f'{lesson.name} question')
+        self.client = APIClient()
+
+    def test_tree_nests_the_levels_and_adds_up_the_counts(self):
+        response = self.client.get('/api/catalog/')
+        self.assertEqual(response.status_code, 200)
+        [class_node] = response.data
+        self.assertEqual(class_node['counts'], {'lessons': 2, 'videos': 1, 'questions': 2})
+        chapter = class_node['subjects'][0]['chapters'][0]
+        self.assertEqual([lesson['slug'] for lesson in chapter['lessons']], ['reflection', 'refraction'])
+        self.assertEqual(chapter['lessons'][0]['counts'], {'lessons': 1, 'videos': 1, 'questions': 1})
+
+    def test_branch_is_picked_by_one_slug(self):
+        response = self.client.get('/api/catalog/', {'chapter': 'light'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Light')
+        self.assertEqual(len(response.data['lessons']), 2)
+        self.assertEqual(self.client.get('/api/catalog/', {'chapter': 'sound'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/catalog/', {'class': 'class-8', 'chapter': 'light'}).status_code, 400)
+
+    def test_unchanged_tree_is_not_modified(self):
+        etag = self.client.get('/api/catalog/')['ETag']
+        response = self.client.get('/api/catalog/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_tree_edits_replace_the_cached_tree(self):
+        tree, version = get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.create(lesson=self.lesson, question_text='Another question')
+        tree, new_version = get_catalog()
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(tree[0]['counts']['questions'], 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chapter.name = 'Light and shadow'
+            self.chapter.save()
+        self.assertEqual(get_catalog()[0][0]['subjects'][0]['chapters'][0]['name'], 'Light and shadow')
+
+    def test_edits_outside_the_tree_keep_it_cached(self):
+        version = get_catalog()[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            LessonReview.objects.create(lesson=self.lesson, review_text='Clear', rating=5)
+            QuestionOption.objects.create(question=self.question, option='Back', is_correct=True)
+            LearningMaterial.objects.create(lesson=self.lesson, title='Notes', material_type='Notes')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_catalog()[1], version)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogPathTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        class_obj = Class.objects.create(name='Class 8')
+        subject = Subject.objects.create(class_name=class_obj, name='Science')
+        self.chapter = Chapter.objects.create(subject_name=subject, name='Light')
+        self.lesson = Lesson.objects.create(chapter_name=self.chapter, name='Reflection')
+        Lesson.objects.create(chapter_name=self.chapter, name='Refraction')
+        other_subject = Subject.objects.create(class_name=Class.objects.create(name='Class 9'), name='Maths')
+        Chapter.objects.create(subject_name=other_subject, name='Algebra')
+        self.client = APIClient()
+
+    def test_lesson_path_resolves_with_its_ancestors(self):
+        response = self.client.get('/api/catalog/path/class-8/science/light/reflection')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['level'], response.data['target']['id']), ('lesson', self.lesson.id))
+        self.assertEqual([(node['level'], node['slug']) for node in response.data['ancestors']],
+                         [('class', 'class-8'), ('subject', 'science'), ('chapter', 'light')])
+        self.assertNotIn('subjects', response.data['ancestors'][0])
+
+    def test_branch_lists_its_children_without_theirs(self):
+        response = self.client.get('/api/catalog/path/class-8/science/')
+        self.assertEqual(response.data['level'], 'subject')
+        self.assertEqual([chapter['slug'] for chapter in response.data['target']['chapters']], ['light'])
+        self.assertNotIn('lessons', response.data['target']['chapters'][0])
+
+    def test_unknown_and_misplaced_paths_are_not_found(self):
+        for path in ('class-8/history', 'class-8/algebra', 'class-9/science/light',
+                     'class-8/science/light/reflection/extra'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(f'/api/catalog/path/{path}').status_code, 404)
+
+    def test_paths_resolve_from_memory_until_an_edit(self):
+        resolve_path(['class-8'])
+        with self.assertNumQueries(0):
+            nodes, version = resolve_path(['class-8', 'science', 'light'])
+        self.assertEqual(nodes[-1][1]['id'], self.chapter.id)
+
+        etag = self.client.get('/api/catalog/path/class-8/science/light')['ETag']
+        self.assertEqual(self.client.get('/api/catalog/path/class-8/science/light',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chapter.name = 'Optics'
+            self.chapter.save()
+        self.assertIsNone(resolve_path(['class-8', 'science', 'light'])[0])
+        self.assertEqual(resolve_path(['class-8', 'science', 'optics'])[0][-1][1]['id'], self.chapter.id)
+        self.assertEqual(self.client.get('/api/catalog/path/class-8/science/optics',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
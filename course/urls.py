@@ -2,6 +2,11 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
+    # Catalog URLs
+    path('catalog/', views.CatalogTreeView.as_view(), name='catalog-tree'),
+    path('catalog/path/<path:slug_path>', views.CatalogPathView.as_view(), name='catalog-path'),
+    path('search/', views.SearchView.as_view(), name='search'),
+
     # Class URLs
     path('classes/', views.ClassListCreateView.as_view(), name='class-list-create'),
     path('classes/<slug:slug>/',
@@ -7,12 +7,19 @@ from .serializers import (
     VideoSerializer, LearningMaterialSerializer, QuestionSerializer, LessonReviewSerializer, QuestionOptionSerializer
 )
 from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
+from .catalog import LEVELS, find_branch, get_catalog, resolve_path, with_absolute_icons, without_children
+from .lesson_detail import get_lesson_detail, with_absolute_urls
+from .search import KINDS, search
+from game.answer_log import parse_latency, record_answer
+from game.playback import etag_matches
+from game.reviews import schedule_review
 import json
 
 
 class ClassListCreateView(generics.ListCreateAPIView):
     queryset = Class.objects.all()
     serializer_class = ClassSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -134,6 +141,7 @@ class ClassRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class SubjectListCreateView(generics.ListCreateAPIView):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -284,6 +292,7 @@ class SubjectRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class ChapterListCreateView(generics.ListCreateAPIView):
     queryset = Chapter.objects.all()
     serializer_class = ChapterSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -438,6 +447,8 @@ class LessonListCreateView(generics.ListCreateAPIView):
     filter_backends = [rest_filters.SearchFilter, rest_filters.OrderingFilter]
     search_fields = ['name', 'description', 'chapter_name__name']
     ordering_fields = ['-id', 'name', 'created_at']
+    # Cursor pagination needs an ordering when the client asks for none
+    ordering = ['-id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -538,8 +549,6 @@ class LessonListCreateView(generics.ListCreateAPIView):
             )
 
             # Process videos
-            created_videos = []
-            total_video_duration = 0
             for video_data in videos_data:
                 video_name = video_data.get('name')
                 video_url = video_data.get('video_url', None)
@@ -548,7 +557,7 @@ class LessonListCreateView(generics.ListCreateAPIView):
                 video_thumbnail = request.FILES.get('video_thumbnail', None)
 
                 if video_name:
-                    video = Video.objects.create(
+                    Video.objects.create(
                         lesson_name=lesson,
                         name=video_name,
                         video_url=video_url,
@@ -557,33 +566,7 @@ class LessonListCreateView(generics.ListCreateAPIView):
                         video_thumbnail=video_thumbnail
                     )
 
-                    video_file_url = None
-                    if video.video_file and hasattr(video.video_file, 'url'):
-                        video_file_url = request.build_absolute_uri(
-                            video.video_file.url)
-
-                    video_thumbnail_url = None
-                    if video.video_thumbnail and hasattr(video.video_thumbnail, 'url'):
-                        video_thumbnail_url = request.build_absolute_uri(
-                            video.video_thumbnail.url)
-
-                    created_videos.append({
-                        'id': video.id,
-                        'name': video.name,
-                        'slug': video.slug,
-                        'video_url': video.video_url,
-                        'video_file': video_file_url,
-                        'video_duration': video.video_duration,
-                        'video_thumbnail': video_thumbnail_url,
-                        'created_at': video.created_at,
-                        'updated_at': video.updated_at
-                    })
-
-                    if video.video_duration:
-                        total_video_duration += video.video_duration
-
             # Process learning materials
-            created_materials = []
             for material_data in learning_materials_data:
                 title = material_data.get('title')
                 material_type = material_data.get('material_type')
@@ -600,7 +583,7 @@ class LessonListCreateView(generics.ListCreateAPIView):
                             'error': f"Invalid material_type. Must be one of: {', '.join(valid_types)}"
                         }, status=status.HTTP_400_BAD_REQUEST)
 
-                    material = LearningMaterial.objects.create(
+                    LearningMaterial.objects.create(
                         lesson=lesson,
                         title=title,
                         material_type=material_type,
@@ -609,24 +592,7 @@ class LessonListCreateView(generics.ListCreateAPIView):
                         game_url=game_url
                     )
 
-                    file_url = None
-                    if material.file and hasattr(material.file, 'url'):
-                        file_url = request.build_absolute_uri(
-                            material.file.url)
-
-                    created_materials.append({
-                        'id': material.id,
-                        'title': material.title,
-                        'material_type': material.material_type,
-                        'description': material.description,
-                        'file': file_url,
-                        'game_url': material.game_url,
-                        'created_at': material.created_at,
-                        'updated_at': material.updated_at
-                    })
-
             # Process questions
-            created_questions = []
             for question_data in questions_data:
                 question_text = question_data.get('question_text')
                 explanation = question_data.get('explanation', '')
@@ -641,48 +607,19 @@ class LessonListCreateView(generics.ListCreateAPIView):
                     )
 
                     # Create options for this question
-                    options = []
                     for option_data in options_data:
-                        option = QuestionOption.objects.create(
+                        QuestionOption.objects.create(
                             question=question,
                             option=option_data.get('option'),
                             is_correct=option_data.get('is_correct', False),
                             explanation=option_data.get('explanation', '')
                         )
-                        options.append({
-                            'id': option.id,
-                            'option': option.option,
-                            'is_correct': option.is_correct,
-                            'explanation': option.explanation
-                        })
-
-                    created_questions.append({
-                        'id': question.id,
-                        'question_text': question.question_text,
-                        'explanation': question.explanation,
-                        'options': options
-                    })
-
-            # Build the icon URL if it exists
-            icon_url = None
-            if lesson.icon and hasattr(lesson.icon, 'url'):
-                icon_url = request.build_absolute_uri(lesson.icon.url)
 
             # Return the created object data
-            return Response({
-                'id': lesson.id,
-                'chapter_name': lesson.chapter_name.id,
-                'name': lesson.name,
-                'slug': lesson.slug,
-                'description': lesson.description,
-                'icon': icon_url,
-                'created_at': lesson.created_at,
-                'updated_at': lesson.updated_at,
-                'videos': created_videos,
-                'learning_materials': created_materials,
-                'questions': created_questions,
-                'total_video_duration': total_video_duration
-            }, status=status.HTTP_201_CREATED)
+            return Response(
+                with_absolute_urls(get_lesson_detail(lesson, use_cache=False), request),
+                status=status.HTTP_201_CREATED
+            )
 
         except Exception as e:
             return Response(
@@ -716,86 +653,7 @@ class LessonRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     def retrieve(self, request, *args, **kwargs):
         try:
             lesson = self.get_object()
-
-            # Build the icon URL if it exists
-            icon_url = None
-            if lesson.icon and hasattr(lesson.icon, 'url'):
-                icon_url = request.build_absolute_uri(lesson.icon.url)
-
-            # Get videos related to this lesson
-            videos = []
-            total_duration = 0
-            for video in Video.objects.filter(lesson_name=lesson):
-                video_file_url = None
-                if video.video_file and hasattr(video.video_file, 'url'):
-                    video_file_url = request.build_absolute_uri(
-                        video.video_file.url)
-
-                video_thumbnail_url = None
-                if video.video_thumbnail and hasattr(video.video_thumbnail, 'url'):
-                    video_thumbnail_url = request.build_absolute_uri(
-                        video.video_thumbnail.url)
-
-                if video.video_duration:
-                    total_duration += video.video_duration
-
-                videos.append({
-                    'id': video.id,
-                    'name': video.name,
-                    'slug': getattr(video, 'slug', None),
-                    'video_url': video.video_url,
-                    'video_file': video_file_url,
-                    'video_duration': video.video_duration,
-                    'video_thumbnail': video_thumbnail_url,
-                })
-
-            # Get learning materials
-            learning_materials = []
-            for material in lesson.materials.all():
-                file_url = None
-                if material.file and hasattr(material.file, 'url'):
-                    file_url = request.build_absolute_uri(material.file.url)
-
-                learning_materials.append({
-                    'id': material.id,
-                    'title': material.title,
-                    'material_type': material.material_type,
-                    'description': material.description,
-                    'file': file_url,
-                    'game_url': material.game_url,
-                })
-
-            # Get questions with their options
-            questions = []
-            for question in lesson.questions.all():
-                # Get options for this question
-                options = [{
-                    'id': option.id,
-                    'option': option.option,
-                    'is_correct': option.is_correct,
-                    'explanation': option.explanation
-                } for option in question.options.all()]
-
-                questions.append({
-                    'id': question.id,
-                    'question_text': question.question_text,
-                    'explanation': question.explanation,
-                    'options': options
-                })
-
-            # Return the lesson data with all related objects
-            return Response({
-                'id': lesson.id,
-                'chapter_name': lesson.chapter_name.id,
-                'name': lesson.name,
-                'slug': lesson.slug,
-                'description': lesson.description,
-                'icon': icon_url,
-                'videos': videos,
-                'total_video_duration': total_duration,
-                'learning_materials': learning_materials,
-                'questions': questions
-            })
+            return Response(with_absolute_urls(get_lesson_detail(lesson), request))
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -828,79 +686,7 @@ class LessonRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 
             lesson.save()
 
-            # Build the icon URL if it exists
-            icon_url = None
-            if lesson.icon and hasattr(lesson.icon, 'url'):
-                icon_url = request.build_absolute_uri(lesson.icon.url)
-
-            # Get videos related to this lesson
-            videos = []
-            for video in Video.objects.filter(lesson_name=lesson):
-                video_file_url = None
-                if video.video_file and hasattr(video.video_file, 'url'):
-                    video_file_url = request.build_absolute_uri(
-                        video.video_file.url)
-
-                videos.append({
-                    'id': video.id,
-                    'name': video.name,
-                    'slug': getattr(video, 'slug', None),
-                    'video_url': video.video_url,
-                    'video_file': video_file_url,
-                    'created_at': video.created_at,
-                    'updated_at': video.updated_at
-                })
-
-            # Get learning materials
-            learning_materials = []
-            for material in lesson.materials.all():
-                file_url = None
-                if material.file and hasattr(material.file, 'url'):
-                    file_url = request.build_absolute_uri(material.file.url)
-
-                learning_materials.append({
-                    'id': material.id,
-                    'title': material.title,
-                    'material_type': material.material_type,
-                    'description': material.description,
-                    'file': file_url,
-                    'game_url': material.game_url,
-                    'created_at': material.created_at,
-                    'updated_at': material.updated_at
-                })
-
-            # Get questions with their options
-            questions = []
-            for question in lesson.questions.all():
-                # Get options for this question
-                options = [{
-                    'id': option.id,
-                    'option': option.option,
-                    'is_correct': option.is_correct,
-                    'explanation': option.explanation
-                } for option in question.options.all()]
-
-                questions.append({
-                    'id': question.id,
-                    'question_text': question.question_text,
-                    'explanation': question.explanation,
-                    'options': options
-                })
-
-            # Return updated data with all related objects
-            return Response({
-                'id': lesson.id,
-                'chapter_name': lesson.chapter_name.id,
-                'name': lesson.name,
-                'slug': lesson.slug,
-                'description': lesson.description,
-                'icon': icon_url,
-                'created_at': lesson.created_at,
-                'updated_at': lesson.updated_at,
-                'videos': videos,
-                'learning_materials': learning_materials,
-                'questions': questions
-            })
+            return Response(with_absolute_urls(get_lesson_detail(lesson, use_cache=False), request))
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -919,6 +705,7 @@ class LessonRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class VideoListCreateView(generics.ListCreateAPIView):
     queryset = Video.objects.all()
     serializer_class = VideoSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -1075,6 +862,7 @@ class VideoRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class LearningMaterialListCreateView(generics.ListCreateAPIView):
     queryset = LearningMaterial.objects.all()
     serializer_class = LearningMaterialSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -1249,6 +1037,8 @@ class LearningMaterialRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAP
 class QuestionListCreateView(generics.ListCreateAPIView):
     queryset = Question.objects.all()
     serializer_class = QuestionSerializer
+    # Newest first, on the primary key rather than the unindexed created_at
+    ordering = ['-id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -1471,6 +1261,12 @@ class ValidateAnswerView(views.APIView):
             # Get correct option
             correct_option = question.options.get(is_correct=True)
 
+            record_answer(
+                request.user.id, selected_option.id, selected_option.is_correct,
+                question_id=question.id, lesson_id=question.lesson_id,
+                latency_ms=parse_latency(request.data.get('latency_ms')))
+            schedule_review(request.user.id, question.id, selected_option.is_correct)
+
             response_data = {
                 'is_correct': selected_option.is_correct,
                 'selected_option': {
@@ -1493,9 +1289,135 @@ class ValidateAnswerView(views.APIView):
             )
 
 
+class CatalogTreeView(views.APIView):
+    """Classes with their subjects, chapters and lessons, or one branch picked by ?class=, ?subject=, ?chapter= or ?lesson= slug"""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            branches = [(level, request.query_params[level]) for level, _ in LEVELS if request.query_params.get(level)]
+            if len(branches) > 1:
+                return Response(
+                    {"error": "Pick at most one of class, subject, chapter or lesson"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            tree, version = get_catalog()
+            if branches:
+                node = find_branch(tree, *branches[0])
+                if node is None:
+                    return Response(
+                        {"error": f"{branches[0][0].capitalize()} not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                data = with_absolute_icons(node, request)
+            else:
+                data = [with_absolute_icons(node, request) for node in tree]
+
+            # The version changes with any course edit, clients revalidate and get 304 until then
+            etag = f'"{version}"'
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response(data)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class CatalogPathView(views.APIView):
+    """The class, subject, chapter or lesson at a slug path like class-8/science/light/reflection, with its ancestors"""
+
+    def get(self, request, slug_path, *args, **kwargs):
+        try:
+            nodes, version = resolve_path(slug for slug in slug_path.strip('/').split('/'))
+            if nodes is None:
+                return Response(
+                    {"error": "Path not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            etag = f'"{version}"'
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                (level, target), ancestors = nodes[-1], nodes[:-1]
+                # The target lists its children, the ancestors only themselves
+                children = dict(LEVELS)[level]
+                shallow = without_children(target)
+                if children:
+                    shallow[children] = [without_children(child) for child in target[children]]
+                response = Response({
+                    'level': level,
+                    'target': with_absolute_icons(shallow, request),
+                    'ancestors': [
+                        {'level': ancestor_level, **with_absolute_icons(without_children(node), request)}
+                        for ancestor_level, node in ancestors
+                    ],
+                })
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class SearchView(views.APIView):
+    """Ranked full-text matches across lessons, questions, materials and blogs, for ?q= and an optional ?kind= list"""
+    max_limit = 50
+
+    def get(self, request, *args, **kwargs):
+        try:
+            query = request.query_params.get('q', '').strip()
+            if not query:
+                return Response(
+                    {"error": "q is required"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            kinds = [kind for kind in request.query_params.get('kind', '').split(',') if kind]
+            unknown = [kind for kind in kinds if kind not in KINDS]
+            if unknown:
+                return Response(
+                    {"error": f"Unknown kind: {', '.join(unknown)}. Must be among: {', '.join(KINDS)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            try:
+                limit = min(int(request.query_params.get('limit', 20)), self.max_limit)
+            except ValueError:
+                return Response(
+                    {"error": "limit must be a number"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if limit < 1:
+                return Response(
+                    {"error": "limit must be positive"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response({'query': query, 'results': search(query, kinds, limit)})
+
+        except Exception as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class LessonReviewListCreateView(generics.ListCreateAPIView):
     queryset = LessonReview.objects.all()
     serializer_class = LessonReviewSerializer
+    ordering = ['id']
     permission_classes = [IsAuthenticated]
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
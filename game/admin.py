@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.safestring import mark_safe
-from .models import Frame, GameObject, Dialogue, Quiz, QuizOption, Background, UserProgress
+from .models import Frame, GameObject, Dialogue, Quiz, QuizOption, Background, UserProgress, FrameSequence, FrameSequenceEntry, LessonAssetManifest, ImageDerivative, ImageDerivativeJob, FrameSpriteAtlas, ProgressEvent, LeaderboardEntry, CompletionRollup, AnswerEvent, ItemAnalysisRun, ItemStatistics, OptionStatistics, LessonFunnel, LessonFunnelStep, ReviewItem
 from unfold.admin import ModelAdmin, TabularInline
+from .progress import completed_frame_ids
 
 
 admin.site.register(Background, ModelAdmin)
@@ -80,6 +81,160 @@ class QuizOptionAdmin(ModelAdmin):
 
 @admin.register(UserProgress)
 class UserProgressAdmin(ModelAdmin):
-    list_display = ('user', 'lesson', 'current_frame', 'score')
+    list_display = ('user', 'lesson', 'current_frame', 'score', 'completed_count')
     list_filter = ('lesson',)
     search_fields = ('user__username', 'lesson__name')
+    # Completions live in the bitmap, the many-to-many is only a mirror for old readers
+    exclude = ('completed_frames',)
+    readonly_fields = ('completed_count', 'get_completed_frames')
+
+    def get_completed_frames(self, obj):
+        """Show the completed frames, in sequence order, from the bitmap"""
+        if obj.pk is None:
+            return "-"
+        return ", ".join(str(frame_id) for frame_id in completed_frame_ids(obj)) or "None"
+    get_completed_frames.short_description = "Completed Frames"
+
+
+class FrameSequenceEntryInline(TabularInline):
+    """Read-only view of the frames in a lesson sequence"""
+    model = FrameSequenceEntry
+    extra = 0
+    can_delete = False
+    fields = ('position', 'frame', 'previous_frame_id', 'next_frame_id')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(FrameSequence)
+class FrameSequenceAdmin(ModelAdmin):
+    list_display = ('lesson', 'frame_count', 'is_consistent',
+                    'matches_order', 'updated_at')
+    list_filter = ('is_consistent', 'matches_order')
+    search_fields = ('lesson__name',)
+    readonly_fields = ('lesson', 'frame_count', 'is_consistent', 'matches_order',
+                       'cycle_frames', 'orphan_frames', 'fork_frames', 'updated_at')
+
+    inlines = [FrameSequenceEntryInline]
+
+
+@admin.register(LessonAssetManifest)
+class LessonAssetManifestAdmin(ModelAdmin):
+    list_display = ('lesson', 'total_size', 'content_hash', 'updated_at')
+    search_fields = ('lesson__name',)
+    readonly_fields = ('lesson', 'assets', 'content_hash', 'total_size', 'updated_at')
+
+
+@admin.register(ImageDerivativeJob)
+class ImageDerivativeJobAdmin(ModelAdmin):
+    list_display = ('source', 'status', 'attempts', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('source',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(ImageDerivative)
+class ImageDerivativeAdmin(ModelAdmin):
+    list_display = ('source', 'width', 'height', 'size', 'created_at')
+    search_fields = ('source',)
+
+
+@admin.register(FrameSpriteAtlas)
+class FrameSpriteAtlasAdmin(ModelAdmin):
+    list_display = ('frame', 'status', 'width', 'height', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('regions', 'signature', 'updated_at')
+
+
+@admin.register(ProgressEvent)
+class ProgressEventAdmin(ModelAdmin):
+    list_display = ('event_id', 'user', 'event_type', 'lesson', 'created_at')
+    list_filter = ('event_type',)
+    search_fields = ('event_id', 'user__username')
+
+
+@admin.register(LeaderboardEntry)
+class LeaderboardEntryAdmin(ModelAdmin):
+    list_display = ('user', 'scope', 'scope_id', 'score', 'updated_at')
+    list_filter = ('scope',)
+    search_fields = ('user__username',)
+    readonly_fields = ('scope', 'scope_id', 'user', 'score', 'updated_at')
+
+
+@admin.register(CompletionRollup)
+class CompletionRollupAdmin(ModelAdmin):
+    list_display = ('user', 'scope', 'scope_id', 'completed_frames', 'total_frames', 'updated_at')
+    list_filter = ('scope',)
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'scope', 'scope_id', 'completed_frames', 'total_frames', 'updated_at')
+
+
+@admin.register(AnswerEvent)
+class AnswerEventAdmin(ModelAdmin):
+    list_display = ('user', 'question_id', 'quiz_id', 'option_id', 'is_correct', 'latency_ms', 'answered_at')
+    list_filter = ('is_correct', 'period')
+    search_fields = ('user__username',)
+
+    # The log is append-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class OptionStatisticsInline(TabularInline):
+    """Read-only share of learners per option"""
+    model = OptionStatistics
+    extra = 0
+    can_delete = False
+    fields = ('option_id', 'is_correct', 'learners', 'share', 'is_dead_distractor')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ItemStatistics)
+class ItemStatisticsAdmin(ModelAdmin):
+    list_display = ('kind', 'item_id', 'lesson_id', 'learners', 'difficulty', 'discrimination', 'dead_distractors')
+    list_filter = ('kind',)
+    search_fields = ('item_id', 'lesson_id')
+    readonly_fields = ('kind', 'item_id', 'lesson_id', 'learners', 'difficulty', 'discrimination',
+                       'dead_distractors', 'computed_at')
+    inlines = [OptionStatisticsInline]
+
+
+@admin.register(ItemAnalysisRun)
+class ItemAnalysisRunAdmin(ModelAdmin):
+    list_display = ('id', 'started_at', 'finished_at', 'last_event_id', 'lessons', 'items')
+    readonly_fields = ('started_at', 'finished_at', 'last_event_id', 'lessons', 'items')
+
+
+class LessonFunnelStepInline(TabularInline):
+    """Read-only reach and drop-off per frame"""
+    model = LessonFunnelStep
+    extra = 0
+    can_delete = False
+    fields = ('position', 'frame', 'reached', 'stopped', 'abandoned')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LessonFunnel)
+class LessonFunnelAdmin(ModelAdmin):
+    list_display = ('lesson', 'learners', 'finished', 'computed_at')
+    search_fields = ('lesson__name',)
+    readonly_fields = ('lesson', 'learners', 'finished', 'computed_at')
+    inlines = [LessonFunnelStepInline]
+
+
+@admin.register(ReviewItem)
+class ReviewItemAdmin(ModelAdmin):
+    list_display = ('user', 'question', 'due_at', 'interval_days', 'streak', 'lapses')
+    search_fields = ('user__username', 'question__question_text')
+    readonly_fields = ('last_answered_at',)
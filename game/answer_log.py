@@ -0,0 +1,134 @@
+import atexit
+import datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .models import AnswerEvent
+
+logger = logging.getLogger(__name__)
+
+
+def answer_period(moment):
+    """YYYYMM period, in UTC, an answer given at moment is stored under"""
+    moment = moment.astimezone(datetime.timezone.utc) if timezone.is_aware(moment) else moment
+    return moment.year * 100 + moment.month
+
+
+def parse_latency(value):
+    """Answer latency in milliseconds sent by a client, or None when missing or not usable"""
+    try:
+        latency = int(value)
+    except (TypeError, ValueError):
+        return None
+    return latency if latency >= 0 else None
+
+
+class AnswerLog:
+    """Collects answer events in memory and appends them with bulk inserts.
+
+    Validation only adds an event to a list. The events are written when
+    GAME_ANSWER_LOG_FLUSH_SIZE of them are waiting or
+    GAME_ANSWER_LOG_FLUSH_INTERVAL seconds after the first one, and when
+    the process exits, unless GAME_ANSWER_LOG_BACKGROUND_FLUSH is off and
+    only flush() writes. Events of a write the database refused are kept
+    for the next one, up to GAME_ANSWER_LOG_MAX_PENDING, while an event
+    that cannot be stored is logged and dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+        self._timer = None
+
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            if not settings.GAME_ANSWER_LOG_BACKGROUND_FLUSH:
+                return
+            flush_now = len(self._events) >= settings.GAME_ANSWER_LOG_FLUSH_SIZE
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(settings.GAME_ANSWER_LOG_FLUSH_INTERVAL, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            # Written off the request thread, validation never waits for the insert
+            threading.Thread(target=self._flush_in_thread, daemon=True).start()
+
+    def flush(self):
+        """Append everything waiting, putting it back if the database cannot be written"""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                events, self._events = self._events, []
+            if not events:
+                return
+            try:
+                with transaction.atomic():
+                    AnswerEvent.objects.bulk_create(events, batch_size=500)
+            except (DataError, IntegrityError):
+                # One bad event fails the whole insert, the others are written one at a time
+                self._append_each(events)
+            except Exception:
+                logger.exception("Appending %d answer events failed", len(events))
+                self._requeue(events)
+                raise
+
+    def _append_each(self, events):
+        for index, event in enumerate(events):
+            try:
+                with transaction.atomic():
+                    event.save(force_insert=True)
+            except (DataError, IntegrityError):
+                logger.exception("Dropping answer event of user %s for option %s", event.user_id, event.option_id)
+            except Exception:
+                logger.exception("Appending %d answer events failed", len(events) - index)
+                self._requeue(events[index:])
+                raise
+
+    def _requeue(self, events):
+        with self._lock:
+            self._events[:0] = events
+            # The oldest events go first when the database stays unavailable
+            del self._events[:-settings.GAME_ANSWER_LOG_MAX_PENDING]
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            # Already logged, the events wait for the next flush
+            pass
+        finally:
+            connections.close_all()
+
+
+def _flush_at_exit():
+    if settings.GAME_ANSWER_LOG_BACKGROUND_FLUSH:
+        answer_log.flush()
+
+
+answer_log = AnswerLog()
+atexit.register(_flush_at_exit)
+
+
+def record_answer(user_id, option_id, is_correct, question_id=None, quiz_id=None,
+                  lesson_id=None, latency_ms=None, answered_at=None):
+    """Queue an answer for the append-only answer log"""
+    answered_at = answered_at or timezone.now()
+    answer_log.add(AnswerEvent(
+        user_id=user_id,
+        question_id=question_id,
+        quiz_id=quiz_id,
+        option_id=option_id,
+        lesson_id=lesson_id,
+        is_correct=is_correct,
+        latency_ms=latency_ms,
+        answered_at=answered_at,
+        period=answer_period(answered_at),
+    ))
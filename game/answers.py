@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from . import bitmap
+from .models import Quiz, UserProgress
+from .leaderboards import schedule_leaderboard_points
+from .playback import lesson_content_version
+from .progress import mirror_completions, progress_buffer
+from .resume import invalidate_resume
+from .rollups import schedule_rollup_completions
+from .sequence import get_frame_positions
+
+# Concurrent answers of one learner make the conditional update miss, it is retried
+MAX_SCORE_ATTEMPTS = 5
+
+
+def _answer_key_key(quiz_id):
+    return f'game:quiz:{quiz_id}:answers'
+
+
+def get_answer_key(quiz_id):
+    """Frame, lesson and options of a quiz, or None when there is no such quiz.
+
+    The key is cached under the content version of the quiz's lesson, so
+    any edit of the lesson's quizzes or options replaces it.
+    """
+    key = _answer_key_key(quiz_id)
+    answers = cache.get(key)
+    if answers is not None and answers['version'] == lesson_content_version(answers['lesson']):
+        return answers
+
+    # One row per option, or a single row without option for a quiz that has none
+    rows = list(Quiz.objects.filter(id=quiz_id).values_list(
+        'frame_id', 'frame__lesson_id', 'options__id', 'options__is_correct', 'options__explanation'))
+    if not rows:
+        return None
+
+    frame_id, lesson_id = rows[0][:2]
+    answers = {
+        'frame': frame_id,
+        'lesson': lesson_id,
+        'version': None,
+        'options': {
+            option_id: {'is_correct': is_correct, 'explanation': explanation}
+            for _, _, option_id, is_correct, explanation in rows if option_id is not None
+        },
+    }
+    # Quizzes outside a lesson have no version to follow and are not cached
+    if lesson_id is not None:
+        answers['version'] = lesson_content_version(lesson_id)
+        cache.set(key, answers, settings.GAME_CONTENT_CACHE_TIMEOUT)
+    return answers
+
+
+def score_correct_answer(user, lesson_id, frame_id):
+    """Complete a quiz frame for a learner, adding a point only the first time.
+
+    Returns whether the answer was scored. Scoring is two queries, a read
+    of the learner's completion bitmap then an update of score and bitmap
+    that only applies while the bitmap is unchanged. A concurrent answer
+    makes the update miss and the read is repeated. The leaderboard and
+    rollup deltas follow once the caller's transaction commits.
+    """
+    position = get_frame_positions(lesson_id).get(frame_id)
+    if position is None:
+        return False
+    if settings.GAME_PROGRESS_WRITE_BEHIND:
+        return _buffer_correct_answer(user, lesson_id, frame_id, position)
+
+    for attempt in range(MAX_SCORE_ATTEMPTS):
+        progress = UserProgress.objects.filter(user=user, lesson_id=lesson_id).values(
+            'id', 'completed_bitmap').first()
+        if progress is None:
+            # The first answer creates the row already scored, creating it refreshes the learner's
+            # leaderboards and rollups in full so no delta follows
+            created_progress, created = UserProgress.objects.get_or_create(
+                user=user,
+                lesson_id=lesson_id,
+                defaults={
+                    'current_frame_id': frame_id,
+                    'score': 1,
+                    'completed_bitmap': bitmap.from_positions([position]),
+                    'completed_count': 1,
+                }
+            )
+            if created:
+                mirror_completions([(created_progress.id, frame_id)])
+                return True
+            continue
+
+        done = bitmap.to_bytes(progress['completed_bitmap'])
+        # Retries and repeat answers find the frame already completed
+        if bitmap.has_position(done, position):
+            return False
+
+        scored = UserProgress.objects.filter(id=progress['id'], completed_bitmap=done).update(
+            completed_bitmap=bitmap.add_positions(done, [position]),
+            completed_count=F('completed_count') + 1,
+            score=F('score') + 1,
+            current_frame_id=frame_id,
+            last_interaction=timezone.now()
+        )
+        if scored:
+            # Leaderboards and rollups move after the commit, the update above holds the write lock alone
+            schedule_leaderboard_points({(user.id, lesson_id): 1})
+            schedule_rollup_completions({(user.id, lesson_id): 1})
+            mirror_completions([(progress['id'], frame_id)])
+            invalidate_resume([user.id])
+            return True
+    return False
+
+
+def _buffer_correct_answer(user, lesson_id, frame_id, position):
+    """Write-behind scoring: one read here, the write happens with the next flush.
+
+    The first answer of a learner in a lesson creates the progress row at
+    once, so the learner's own reads find the lesson before the flush. The
+    flush checks completion again, so an answer reported as scored here
+    adds nothing if another process completed the frame first.
+    """
+    pending = progress_buffer.pending(user.id, lesson_id)
+    if pending and frame_id in pending['scored']:
+        return False
+    progress = UserProgress.objects.filter(user=user, lesson_id=lesson_id).values('completed_bitmap').first()
+    if progress is None:
+        UserProgress.objects.get_or_create(
+            user=user,
+            lesson_id=lesson_id,
+            defaults={'current_frame_id': frame_id, 'score': 0}
+        )
+    elif bitmap.has_position(progress['completed_bitmap'], position):
+        return False
+    progress_buffer.add(user.id, lesson_id, frame_id)
+    return True
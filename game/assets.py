@@ -0,0 +1,112 @@
+import hashlib
+import json
+
+from PIL import Image
+
+from course.models import Lesson
+from .models import Frame, LessonAssetManifest
+from .sequence import get_frame_sequence
+
+
+def _digest_file(storage, name):
+    """Size, SHA-256 and pixel dimensions of a stored file, or None if it is missing"""
+    if not storage.exists(name):
+        return None
+
+    sha256 = hashlib.sha256()
+    with storage.open(name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b''):
+            sha256.update(chunk)
+
+        # Not every upload is a raster image, dimensions are optional
+        width = height = None
+        try:
+            fh.seek(0)
+            with Image.open(fh) as image:
+                width, height = image.size
+        except Exception:
+            pass
+
+    return {
+        'size': storage.size(name),
+        'hash': sha256.hexdigest(),
+        'width': width,
+        'height': height,
+    }
+
+
+def rebuild_asset_manifest(lesson_id):
+    """Recompute the asset manifest of a lesson from its frames.
+
+    Files already digested in the previous manifest are reused when their
+    size has not changed, so only new or replaced uploads are read.
+    """
+    if not Lesson.objects.filter(id=lesson_id).exists():
+        return None
+
+    previous = LessonAssetManifest.objects.filter(lesson_id=lesson_id).first()
+    known = {asset['path']: asset for asset in previous.assets} if previous else {}
+
+    sequence = get_frame_sequence(lesson_id)
+    positions = dict(sequence.entries.values_list('frame_id', 'position'))
+    frames = sorted(
+        Frame.objects.filter(lesson_id=lesson_id)
+        .select_related('background').prefetch_related('game_objects'),
+        key=lambda f: positions.get(f.id, len(positions) + 1)
+    )
+
+    # Backgrounds come before objects of the same frame, they are drawn first
+    files = []
+    for frame in frames:
+        if frame.background and frame.background.image:
+            files.append(('background', frame.background.image, frame))
+        for obj in frame.game_objects.all():
+            if obj.image:
+                files.append(('object', obj.image, frame))
+
+    assets = {}
+    frame_ids = {}
+    for kind, file, frame in files:
+        if file.name in assets:
+            frame_ids[file.name].add(frame.id)
+            continue
+
+        cached = known.get(file.name)
+        if cached and file.storage.exists(file.name) and file.storage.size(file.name) == cached['size']:
+            digest = {key: cached[key] for key in ('size', 'hash', 'width', 'height')}
+        else:
+            digest = _digest_file(file.storage, file.name)
+        if digest is None:
+            continue
+
+        assets[file.name] = {
+            'path': file.name,
+            'url': file.url,
+            'kind': kind,
+            **digest,
+            'first_frame': frame.id,
+            'first_position': positions.get(frame.id),
+        }
+        frame_ids[file.name] = {frame.id}
+
+    asset_list = [
+        {**asset, 'frame_count': len(frame_ids[path])} for path, asset in assets.items()]
+
+    encoded = json.dumps(asset_list, sort_keys=True)
+    manifest, created = LessonAssetManifest.objects.update_or_create(
+        lesson_id=lesson_id,
+        defaults={
+            'assets': asset_list,
+            'content_hash': hashlib.sha256(encoded.encode()).hexdigest(),
+            'total_size': sum(asset['size'] for asset in asset_list),
+        }
+    )
+    return manifest
+
+
+def get_asset_manifest(lesson_id):
+    """Stored asset manifest of a lesson, built on first use"""
+    try:
+        return LessonAssetManifest.objects.get(lesson_id=lesson_id)
+    except LessonAssetManifest.DoesNotExist:
+        return rebuild_asset_manifest(lesson_id)
@@ -0,0 +1,192 @@
+import hashlib
+import io
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .images import MAX_ATTEMPTS
+from .models import FrameSpriteAtlas, GameObject
+from .playback import invalidate_lesson_content
+
+# Frames with fewer object images gain nothing from a sprite sheet
+MIN_SPRITES = 2
+PADDING = 2
+
+
+def _frame_sources(frame_ids=None, lesson_id=None):
+    """Object ids and image names of frames, by frame id"""
+    objects = GameObject.objects.exclude(image='').exclude(image__isnull=True)
+    if lesson_id is not None:
+        objects = objects.filter(frame__lesson_id=lesson_id)
+    if frame_ids is not None:
+        objects = objects.filter(frame_id__in=frame_ids)
+
+    sources = defaultdict(list)
+    for frame_id, object_id, name in objects.order_by('id').values_list('frame_id', 'id', 'image'):
+        sources[frame_id].append((object_id, name))
+    return sources
+
+
+def _signature(sources):
+    # Replaced uploads get a new storage name, so names are enough to detect changes
+    return hashlib.sha1(json.dumps(sources).encode()).hexdigest()
+
+
+def queue_frame_atlases(lesson_id):
+    """Mark the atlases of a lesson's frames whose object images changed for rebuilding.
+
+    Frames that no longer have enough object images lose their atlas.
+    """
+    sources = _frame_sources(lesson_id=lesson_id)
+    wanted = {frame_id: items for frame_id, items in sources.items() if len(items) >= MIN_SPRITES}
+    existing = {atlas.frame_id: atlas for atlas in FrameSpriteAtlas.objects.filter(frame__lesson_id=lesson_id)}
+
+    for frame_id, atlas in existing.items():
+        if frame_id not in wanted:
+            if atlas.image:
+                atlas.image.delete(save=False)
+            atlas.delete()
+
+    for frame_id, items in wanted.items():
+        atlas = existing.get(frame_id)
+        if atlas is None:
+            FrameSpriteAtlas.objects.create(frame_id=frame_id)
+        elif atlas.signature != _signature(items) and atlas.status != 'pending':
+            atlas.status = 'pending'
+            atlas.attempts = 0
+            atlas.save(update_fields=['status', 'attempts', 'updated_at'])
+
+
+def pack_sprites(sizes, max_width):
+    """Shelf-pack (width, height) boxes, tallest first.
+
+    Returns the top-left corner of each box, in input order, and the sheet size.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    sheet_width = max(max_width, max(width for width, height in sizes))
+    positions = [None] * len(sizes)
+    x = y = shelf_height = used_width = 0
+    for index in order:
+        width, height = sizes[index]
+        if x and x + width > sheet_width:
+            y += shelf_height + PADDING
+            x = shelf_height = 0
+        positions[index] = (x, y)
+        x += width + PADDING
+        used_width = max(used_width, x - PADDING)
+        shelf_height = max(shelf_height, height)
+    return positions, (used_width, y + shelf_height)
+
+
+def _load_sprite(name):
+    with default_storage.open(name, 'rb') as fh:
+        with Image.open(fh) as image:
+            return image.convert('RGBA')
+
+
+def _encode_sheet(sheet):
+    buffer = io.BytesIO()
+    sheet.save(buffer, 'WEBP', lossless=True)
+    return buffer.getvalue()
+
+
+def build_frame_atlas(atlas):
+    """Pack a frame's object images into its sprite sheet.
+
+    When every object is still there and only images of the same size were
+    replaced, those are pasted over their old regions and nothing moves.
+    """
+    items = _frame_sources(frame_ids=[atlas.frame_id]).get(atlas.frame_id, [])
+    if len(items) < MIN_SPRITES:
+        raise ValueError('Frame has too few object images for an atlas')
+    previous = atlas.regions or {}
+    changed = [(object_id, name) for object_id, name in items
+               if previous.get(str(object_id), {}).get('source') != name]
+    sprites = {object_id: _load_sprite(name) for object_id, name in changed}
+
+    in_place = bool(atlas.image) and set(previous) == {str(object_id) for object_id, name in items} \
+        and all(sprite.size == (previous[str(object_id)]['width'], previous[str(object_id)]['height'])
+                for object_id, sprite in sprites.items())
+
+    if in_place:
+        sheet = _load_sprite(atlas.image.name)
+        regions = dict(previous)
+        for object_id, name in changed:
+            region = regions[str(object_id)] = {**previous[str(object_id)], 'source': name}
+            box = (region['x'], region['y'], region['x'] + region['width'], region['y'] + region['height'])
+            sheet.paste(sprites[object_id], box)
+    else:
+        for object_id, name in items:
+            if object_id not in sprites:
+                sprites[object_id] = _load_sprite(name)
+        sizes = [sprites[object_id].size for object_id, name in items]
+        positions, sheet_size = pack_sprites(sizes, settings.GAME_ATLAS_MAX_WIDTH)
+        sheet = Image.new('RGBA', sheet_size, (0, 0, 0, 0))
+        regions = {}
+        for (object_id, name), (x, y), (width, height) in zip(items, positions, sizes):
+            sheet.paste(sprites[object_id], (x, y))
+            regions[str(object_id)] = {'x': x, 'y': y, 'width': width, 'height': height, 'source': name}
+
+    signature = _signature(items)
+    old_image = atlas.image.name if atlas.image else None
+    atlas.image.save(f'frame_{atlas.frame_id}_{signature[:12]}.webp',
+                     ContentFile(_encode_sheet(sheet)), save=False)
+    atlas.width, atlas.height = sheet.size
+    atlas.regions = regions
+    atlas.signature = signature
+    if old_image and old_image != atlas.image.name:
+        default_storage.delete(old_image)
+    return atlas
+
+
+def claim_next_atlas():
+    """Mark the oldest pending atlas as processing and return it, or None when none is pending"""
+    for atlas_id in FrameSpriteAtlas.objects.filter(status='pending').order_by(
+            'updated_at').values_list('id', flat=True)[:10]:
+        claimed = FrameSpriteAtlas.objects.filter(id=atlas_id, status='pending').update(
+            status='processing', updated_at=timezone.now())
+        if claimed:
+            return FrameSpriteAtlas.objects.select_related('frame').get(id=atlas_id)
+    return None
+
+
+def process_frame_atlas(atlas):
+    """Build a claimed atlas and make the lesson's playback bundle pick it up"""
+    try:
+        build_frame_atlas(atlas)
+    except Exception as e:
+        atlas.attempts += 1
+        atlas.error = str(e)
+        atlas.status = 'pending' if atlas.attempts < MAX_ATTEMPTS else 'failed'
+    else:
+        atlas.error = None
+        atlas.status = 'done'
+
+    with transaction.atomic():
+        # The frame lost its atlas while the sheet was built
+        if not FrameSpriteAtlas.objects.filter(id=atlas.id).exists():
+            if atlas.image:
+                atlas.image.delete(save=False)
+            return atlas
+        atlas.save()
+        # Objects changed while the sheet was built, it needs another pass
+        current = _frame_sources(frame_ids=[atlas.frame_id]).get(atlas.frame_id, [])
+        if atlas.status == 'done' and _signature(current) != atlas.signature:
+            FrameSpriteAtlas.objects.filter(id=atlas.id).update(status='pending', attempts=0)
+    if atlas.status == 'done' and atlas.frame.lesson_id:
+        invalidate_lesson_content(atlas.frame.lesson_id)
+    return atlas
+
+
+def requeue_stale_atlases(minutes=10):
+    """Put back atlases left processing by a worker that stopped"""
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return FrameSpriteAtlas.objects.filter(
+        status='processing', updated_at__lt=cutoff).update(status='pending')
@@ -0,0 +1,49 @@
+# Bitsets of completed frames, bit n - 1 stands for the frame at sequence position n
+
+
+def to_bytes(bitmap):
+    # Some database backends return binary fields as memoryview
+    return bytes(bitmap) if bitmap else b''
+
+
+def has_position(bitmap, position):
+    index = position - 1
+    bitmap = to_bytes(bitmap)
+    return index // 8 < len(bitmap) and bool(bitmap[index // 8] & (1 << index % 8))
+
+
+def add_positions(bitmap, positions):
+    """Bitmap with the given positions set as well"""
+    result = bytearray(to_bytes(bitmap))
+    for position in positions:
+        index = position - 1
+        if index // 8 >= len(result):
+            result.extend(bytes(index // 8 - len(result) + 1))
+        result[index // 8] |= 1 << index % 8
+    return bytes(result)
+
+
+def from_positions(positions):
+    return add_positions(b'', positions)
+
+
+def positions(bitmap):
+    """Set positions in ascending order"""
+    return [
+        index * 8 + bit + 1
+        for index, byte in enumerate(to_bytes(bitmap)) if byte
+        for bit in range(8) if byte & (1 << bit)
+    ]
+
+
+def count(bitmap):
+    return sum(bin(byte).count('1') for byte in to_bytes(bitmap))
+
+
+def highest_position(bitmap):
+    """Highest set position, 0 when none is set"""
+    bitmap = to_bytes(bitmap)
+    for index in range(len(bitmap) - 1, -1, -1):
+        if bitmap[index]:
+            return index * 8 + bitmap[index].bit_length()
+    return 0
@@ -0,0 +1,128 @@
+import csv
+import json
+
+from account.models import CustomUser
+from .models import UserProgress
+
+EXPORT_FIELDS = [
+    'cursor', 'user_id', 'username', 'email', 'first_name', 'last_name',
+    'lesson_id', 'lesson', 'chapter', 'subject', 'class', 'current_frame',
+    'completed_frames', 'total_frames', 'percent_complete', 'score', 'last_interaction',
+]
+FORMATS = ['csv', 'jsonl']
+
+# Learners fetched per query, their progress rows are streamed in chunks too
+USER_CHUNK_SIZE = 500
+PROGRESS_CHUNK_SIZE = 2000
+
+USER_VALUES = ['id', 'username', 'email', 'first_name', 'last_name']
+PROGRESS_VALUES = [
+    'id', 'user_id', 'lesson_id', 'lesson__name', 'lesson__chapter_name__name',
+    'lesson__chapter_name__subject_name__name', 'lesson__chapter_name__subject_name__class_name__name',
+    'lesson__frame_sequence__frame_count', 'current_frame_id', 'completed_count', 'score', 'last_interaction',
+]
+
+
+def parse_cursor(value):
+    """(user id, progress id) from a cursor column value, raises ValueError when malformed"""
+    user_id, progress_id = value.split(':')
+    user_id, progress_id = int(user_id), int(progress_id)
+    if user_id < 0 or progress_id < 0:
+        raise ValueError('Cursor ids must not be negative')
+    return user_id, progress_id
+
+
+def _row(user, progress=None):
+    row = {
+        'cursor': f"{user['id']}:{progress['id'] if progress else 0}",
+        'user_id': user['id'],
+        'username': user['username'],
+        'email': user['email'],
+        'first_name': user['first_name'],
+        'last_name': user['last_name'],
+    }
+    # A learner without progress still gets one row
+    if progress is None:
+        return {field: row.get(field) for field in EXPORT_FIELDS}
+    total = progress['lesson__frame_sequence__frame_count'] or 0
+    return {
+        **row,
+        'lesson_id': progress['lesson_id'],
+        'lesson': progress['lesson__name'],
+        'chapter': progress['lesson__chapter_name__name'],
+        'subject': progress['lesson__chapter_name__subject_name__name'],
+        'class': progress['lesson__chapter_name__subject_name__class_name__name'],
+        'current_frame': progress['current_frame_id'],
+        'completed_frames': progress['completed_count'],
+        'total_frames': total,
+        'percent_complete': round(100 * progress['completed_count'] / total, 1) if total else 0,
+        'score': progress['score'],
+        'last_interaction': progress['last_interaction'].isoformat() if progress['last_interaction'] else None,
+    }
+
+
+def _learner_rows(users, progress_after=0, empty_rows=True):
+    """Rows of a chunk of learners, in user id then progress id order"""
+    users_by_id = {user['id']: user for user in users}
+    pending = iter(users)
+    progress_rows = UserProgress.objects.filter(
+        user_id__in=list(users_by_id), id__gt=progress_after).order_by('user_id', 'id').values(*PROGRESS_VALUES)
+    current = None
+    for progress in progress_rows.iterator(chunk_size=PROGRESS_CHUNK_SIZE):
+        if current != progress['user_id']:
+            # Learners between the last one with progress and this one have none
+            for user in pending:
+                if user['id'] == progress['user_id']:
+                    break
+                if empty_rows:
+                    yield _row(user)
+            current = progress['user_id']
+        yield _row(users_by_id[current], progress)
+    if empty_rows:
+        for user in pending:
+            yield _row(user)
+
+
+def export_rows(organization_id, after=None):
+    """Progress rows of every learner of an organization, produced one at a time.
+
+    Learners are read in chunks by id and their progress is streamed, so
+    memory stays flat however large the organization is. Each row carries
+    a cursor, passing the last one received as after continues right
+    behind it.
+    """
+    user_after, progress_after = after or (0, 0)
+    learners = CustomUser.objects.filter(organization_id=organization_id).order_by('id')
+
+    # Finish the learner an interrupted export stopped in
+    if progress_after:
+        user = learners.filter(id=user_after).values(*USER_VALUES).first()
+        if user is not None:
+            yield from _learner_rows([user], progress_after, empty_rows=False)
+
+    while True:
+        users = list(learners.filter(id__gt=user_after).values(*USER_VALUES)[:USER_CHUNK_SIZE])
+        if not users:
+            return
+        yield from _learner_rows(users)
+        user_after = users[-1]['id']
+
+
+class _Echo:
+    """File-like object handing back what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(organization_id, export_format='csv', after=None):
+    """Encoded lines of an export, the CSV header only when starting from the beginning"""
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        if after is None:
+            yield writer.writerow(EXPORT_FIELDS)
+        for row in export_rows(organization_id, after):
+            yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+    else:
+        for row in export_rows(organization_id, after):
+            yield json.dumps(row) + '\n'
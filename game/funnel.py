@@ -0,0 +1,109 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from course.models import Lesson
+from . import bitmap
+from .models import LessonFunnel, LessonFunnelStep, UserProgress
+from .sequence import get_frame_positions, get_sequence_frame_ids
+
+
+def build_lesson_funnel(lesson_id):
+    """Count how far each learner got in a lesson, in one pass over its progress rows.
+
+    A learner's furthest frame is the later of their current frame and
+    the last frame they completed. Learners who completed every frame are
+    finished, the others stop at their furthest frame.
+    """
+    frame_ids = get_sequence_frame_ids(lesson_id)
+    positions = get_frame_positions(lesson_id)
+    now = timezone.now()
+    abandoned_before = now - datetime.timedelta(days=settings.GAME_FUNNEL_ABANDON_DAYS)
+
+    stopped = [0] * (len(frame_ids) + 1)
+    abandoned = [0] * (len(frame_ids) + 1)
+    learners = finished = 0
+    for current_frame_id, completed, completed_count, last_interaction in UserProgress.objects.filter(
+            lesson_id=lesson_id).values_list(
+            'current_frame_id', 'completed_bitmap', 'completed_count', 'last_interaction').iterator(chunk_size=2000):
+        learners += 1
+        if frame_ids and completed_count >= len(frame_ids):
+            finished += 1
+            continue
+        furthest = max(positions.get(current_frame_id, 0), bitmap.highest_position(completed))
+        furthest = min(furthest, len(frame_ids))
+        stopped[furthest] += 1
+        if last_interaction < abandoned_before:
+            abandoned[furthest] += 1
+
+    # Everyone stopping at a frame or after it reached it, so do the finished learners
+    steps = []
+    reached = finished
+    for position in range(len(frame_ids), 0, -1):
+        reached += stopped[position]
+        steps.append(LessonFunnelStep(
+            frame_id=frame_ids[position - 1], position=position, reached=reached,
+            stopped=stopped[position], abandoned=abandoned[position]))
+
+    with transaction.atomic():
+        funnel, _ = LessonFunnel.objects.update_or_create(
+            lesson_id=lesson_id,
+            defaults={'learners': learners, 'finished': finished, 'computed_at': now}
+        )
+        funnel.steps.all().delete()
+        for step in steps:
+            step.funnel = funnel
+        LessonFunnelStep.objects.bulk_create(steps[::-1])
+    return funnel
+
+
+def stale_funnel_lessons():
+    """Lessons whose funnel may have changed since it was computed.
+
+    That is lessons with progress and no funnel, progress written after
+    the funnel, learners who became inactive long enough to count as
+    abandoned, or a frame sequence rebuilt after the funnel.
+    """
+    abandon_after = datetime.timedelta(days=settings.GAME_FUNNEL_ABANDON_DAYS)
+    progress = UserProgress.objects.filter(lesson_id=OuterRef('pk'))
+    return Lesson.objects.filter(
+        Q(funnel__isnull=True, id__in=UserProgress.objects.values('lesson_id'))
+        | Exists(progress.filter(last_interaction__gt=OuterRef('funnel__computed_at')))
+        | Exists(progress.filter(
+            last_interaction__gt=OuterRef('funnel__computed_at') - abandon_after,
+            last_interaction__lte=timezone.now() - abandon_after))
+        | Q(frame_sequence__updated_at__gt=F('funnel__computed_at'))
+    ).values_list('id', flat=True)
+
+
+def refresh_lesson_funnels(full=False):
+    """Rebuild stale funnels, or every lesson's when full. Returns the number rebuilt"""
+    lesson_ids = Lesson.objects.values_list('id', flat=True) if full else stale_funnel_lessons()
+    count = 0
+    for lesson_id in list(lesson_ids):
+        build_lesson_funnel(lesson_id)
+        count += 1
+    return count
+
+
+def funnel_data(funnel):
+    return {
+        'lesson': funnel.lesson_id,
+        'learners': funnel.learners,
+        'finished': funnel.finished,
+        'computed_at': funnel.computed_at,
+        'steps': [
+            {
+                'position': step.position,
+                'frame': step.frame_id,
+                'reached': step.reached,
+                'stopped': step.stopped,
+                'abandoned': step.abandoned,
+                'reached_percent': round(100 * step.reached / funnel.learners, 1) if funnel.learners else 0,
+            }
+            for step in funnel.steps.all()
+        ],
+    }
@@ -0,0 +1,160 @@
+import io
+import math
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageDerivative, ImageDerivativeJob
+from .playback import build_file_url
+
+MAX_ATTEMPTS = 3
+
+
+def queue_image_derivatives(file):
+    """Ask the worker to (re)make the derivatives of an uploaded image"""
+    if not file or not file.name:
+        return None
+    job, created = ImageDerivativeJob.objects.update_or_create(
+        source=file.name,
+        defaults={'status': 'pending', 'attempts': 0, 'error': None}
+    )
+    return job
+
+
+def derivative_widths(source_width):
+    """Target widths for an image, never upscaling it"""
+    widths = sorted(settings.GAME_IMAGE_WIDTHS)
+    targets = [width for width in widths if width < source_width]
+    # Images narrower than the largest target are also recompressed at full width
+    if source_width <= widths[-1]:
+        targets.append(source_width)
+    return targets
+
+
+def _encode_webp(image, width):
+    height = max(1, round(image.height * width / image.width))
+    resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, 'WEBP', quality=settings.GAME_IMAGE_QUALITY, method=6)
+    return buffer.getvalue(), height
+
+
+def generate_image_derivatives(source):
+    """Replace the derivatives of a stored image with freshly resized WebP copies"""
+    with default_storage.open(source, 'rb') as fh:
+        with Image.open(fh) as opened:
+            image = ImageOps.exif_transpose(opened)
+            # WebP keeps transparency, everything else is flattened to RGB
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or \
+                (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    encoded = [(width, *_encode_webp(image, width)) for width in derivative_widths(image.width)]
+
+    with transaction.atomic():
+        for derivative in ImageDerivative.objects.filter(source=source):
+            derivative.image.delete(save=False)
+            derivative.delete()
+        derivatives = []
+        for width, content, height in encoded:
+            derivative = ImageDerivative(source=source, width=width, height=height, size=len(content))
+            derivative.image.save(f'{stem}_{width}w.webp', ContentFile(content), save=False)
+            derivative.save()
+            derivatives.append(derivative)
+    return derivatives
+
+
+def claim_next_job():
+    """Mark the oldest pending job as processing and return it, or None when the queue is empty.
+
+    The claim is a conditional update, so several workers never take the same job.
+    """
+    for job_id in ImageDerivativeJob.objects.filter(status='pending').order_by(
+            'created_at').values_list('id', flat=True)[:10]:
+        claimed = ImageDerivativeJob.objects.filter(id=job_id, status='pending').update(
+            status='processing', updated_at=timezone.now())
+        if claimed:
+            return ImageDerivativeJob.objects.get(id=job_id)
+    return None
+
+
+def process_image_job(job):
+    """Make the derivatives of a claimed job, retrying failed jobs a few times"""
+    try:
+        generate_image_derivatives(job.source)
+    except Exception as e:
+        job.attempts += 1
+        job.error = str(e)
+        job.status = 'pending' if job.attempts < MAX_ATTEMPTS else 'failed'
+    else:
+        job.error = None
+        job.status = 'done'
+    job.save(update_fields=['attempts', 'error', 'status', 'updated_at'])
+    return job
+
+
+def requeue_stale_jobs(minutes=10):
+    """Put back jobs left processing by a worker that stopped"""
+    cutoff = timezone.now() - timedelta(minutes=minutes)
+    return ImageDerivativeJob.objects.filter(
+        status='processing', updated_at__lt=cutoff).update(status='pending')
+
+
+def pick_image_derivative(derivatives, viewport_width):
+    """Smallest derivative at least as wide as the viewport, else the widest one"""
+    derivatives = sorted(derivatives, key=lambda d: d.width)
+    if not derivatives:
+        return None
+    for derivative in derivatives:
+        if derivative.width >= viewport_width:
+            return derivative
+    return derivatives[-1]
+
+
+def describe_image(request, file, target_width=None):
+    """Original URL of an image with its derivatives and the best one for a viewport.
+
+    Until the worker has made derivatives the original is returned as the best image.
+    """
+    derivatives = list(ImageDerivative.objects.filter(source=file.name))
+    job_status = ImageDerivativeJob.objects.filter(
+        source=file.name).values_list('status', flat=True).first()
+
+    best = None
+    if target_width is not None:
+        best = pick_image_derivative(derivatives, math.ceil(target_width))
+
+    return {
+        'original': build_file_url(request, file),
+        'status': job_status,
+        'image': build_file_url(request, best.image) if best else build_file_url(request, file),
+        'width': best.width if best else None,
+        'height': best.height if best else None,
+        'variants': [{
+            'url': build_file_url(request, derivative.image),
+            'width': derivative.width,
+            'height': derivative.height,
+            'size': derivative.size,
+        } for derivative in derivatives],
+    }
+
+
+def viewport_width(params):
+    """Width in device pixels asked for by the width and dpr query parameters, or None.
+
+    Raises ValueError when either is not a positive number.
+    """
+    width = params.get('width')
+    if width is None:
+        return None
+    width = float(width) * float(params.get('dpr', 1))
+    if not (width > 0 and math.isfinite(width)):
+        raise ValueError('width and dpr must be positive')
+    return width
@@ -0,0 +1,192 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from course.models import QuestionOption
+from .models import AnswerEvent, ItemAnalysisRun, ItemStatistics, OptionStatistics, Quiz
+
+# Column of AnswerEvent holding the item of each kind
+ITEM_FIELDS = {'question': 'question_id', 'quiz': 'quiz_id'}
+
+LESSON_BATCH_SIZE = 50
+
+
+def _lesson_filter(lesson_ids):
+    lesson_ids = list(lesson_ids)
+    condition = Q(lesson_id__in=[lesson_id for lesson_id in lesson_ids if lesson_id is not None])
+    # Quizzes outside any lesson are analysed as one group
+    if None in lesson_ids:
+        condition |= Q(lesson_id__isnull=True)
+    return condition
+
+
+def first_answers(lesson_ids, last_event_id):
+    """Each learner's first answer to every item of the lessons.
+
+    Later attempts are left out, a learner retrying until correct would
+    otherwise make every item look easy.
+    """
+    events = AnswerEvent.objects.filter(_lesson_filter(lesson_ids), id__lte=last_event_id)
+    firsts = Q()
+    for field in ITEM_FIELDS.values():
+        firsts |= Q(id__in=events.filter(**{f'{field}__isnull': False}).values(
+            'user_id', field).annotate(first=Min('id')).values('first'))
+    return AnswerEvent.objects.filter(firsts)
+
+
+def _item_key(question_id, quiz_id):
+    return ('question', question_id) if question_id is not None else ('quiz', quiz_id)
+
+
+def current_options(items):
+    """(option id, is_correct) of every option the items have now, by item key"""
+    options = defaultdict(list)
+    question_ids = [item_id for kind, item_id in items if kind == 'question']
+    for question_id, option_id, is_correct in QuestionOption.objects.filter(
+            question_id__in=question_ids).values_list('question_id', 'id', 'is_correct'):
+        options[('question', question_id)].append((option_id, is_correct))
+    quiz_ids = [item_id for kind, item_id in items if kind == 'quiz']
+    for quiz_id, option_id, is_correct in Quiz.options.through.objects.filter(
+            quiz_id__in=quiz_ids).values_list('quiz_id', 'quizoption_id', 'quizoption__is_correct'):
+        options[('quiz', quiz_id)].append((option_id, is_correct))
+    return options
+
+
+def _discrimination(n, sum_x, sum_xx, sum_y, sum_xy):
+    """Pearson correlation of binary correctness y with rest score x, or None when undefined"""
+    spread_x = n * sum_xx - sum_x * sum_x
+    spread_y = n * sum_y - sum_y * sum_y
+    if n < 2 or spread_x <= 0 or spread_y <= 0:
+        return None
+    return (n * sum_xy - sum_x * sum_y) / math.sqrt(spread_x * spread_y)
+
+
+def analyse_lessons(lesson_ids, last_event_id):
+    """Recompute the statistics of every item answered in the lessons, returns the number of items.
+
+    Option counts and learner totals are grouped in the database. The rest
+    score correlation needs each first answer next to its learner's total,
+    those rows are streamed once as plain tuples.
+    """
+    answers = first_answers(lesson_ids, last_event_id)
+
+    picks = defaultdict(dict)
+    lessons = {}
+    for question_id, quiz_id, lesson_id, option_id, learners in answers.values(
+            'question_id', 'quiz_id', 'lesson_id', 'option_id').annotate(
+            learners=Count('id')).values_list('question_id', 'quiz_id', 'lesson_id', 'option_id', 'learners'):
+        key = _item_key(question_id, quiz_id)
+        picks[key][option_id] = picks[key].get(option_id, 0) + learners
+        lessons[key] = lesson_id
+
+    # Learner totals over the lesson, each item is compared to the rest of them
+    totals = {
+        (user_id, lesson_id): (answered, correct)
+        for user_id, lesson_id, answered, correct in answers.values('user_id', 'lesson_id').annotate(
+            answered=Count('id'), correct=Count('id', filter=Q(is_correct=True))).values_list(
+            'user_id', 'lesson_id', 'answered', 'correct')
+    }
+    sums = defaultdict(lambda: [0, 0.0, 0.0, 0, 0.0])
+    correct_counts = defaultdict(int)
+    for user_id, lesson_id, question_id, quiz_id, is_correct in answers.values_list(
+            'user_id', 'lesson_id', 'question_id', 'quiz_id', 'is_correct').iterator(chunk_size=10000):
+        key = _item_key(question_id, quiz_id)
+        correct_counts[key] += is_correct
+        answered, correct = totals[(user_id, lesson_id)]
+        if answered < 2:
+            continue
+        rest = (correct - is_correct) / (answered - 1)
+        item_sums = sums[key]
+        item_sums[0] += 1
+        item_sums[1] += rest
+        item_sums[2] += rest * rest
+        item_sums[3] += is_correct
+        item_sums[4] += rest * is_correct
+
+    options = current_options(picks)
+    items = []
+    item_options = []
+    for key, option_picks in picks.items():
+        learners = sum(option_picks.values())
+        item = ItemStatistics(
+            kind=key[0],
+            item_id=key[1],
+            lesson_id=lessons[key],
+            learners=learners,
+            difficulty=correct_counts[key] / learners,
+            discrimination=_discrimination(*sums[key]) if key in sums else None,
+        )
+        rows = []
+        for option_id, is_correct in options.get(key, []):
+            chosen = option_picks.get(option_id, 0)
+            # Distractors are only judged once enough learners answered
+            dead = not is_correct and learners >= settings.GAME_ITEM_ANALYSIS_MIN_LEARNERS \
+                and chosen / learners < settings.GAME_ITEM_ANALYSIS_DISTRACTOR_SHARE
+            rows.append(OptionStatistics(
+                option_id=option_id, is_correct=is_correct, learners=chosen,
+                share=chosen / learners, is_dead_distractor=dead))
+        item.dead_distractors = sum(row.is_dead_distractor for row in rows)
+        items.append(item)
+        item_options.append(rows)
+
+    with transaction.atomic():
+        ItemStatistics.objects.filter(_lesson_filter(lesson_ids)).delete()
+        ItemStatistics.objects.bulk_create(items, batch_size=500)
+        for item, rows in zip(items, item_options):
+            for row in rows:
+                row.item = item
+        OptionStatistics.objects.bulk_create(
+            [row for rows in item_options for row in rows], batch_size=500)
+    return len(items)
+
+
+def run_item_analysis(full=False):
+    """Analyse the lessons answered since the last run, or every lesson when full.
+
+    A lesson is always recomputed as a whole, since a new answer changes
+    the learner's total that every item of the lesson is compared to.
+    """
+    previous = ItemAnalysisRun.objects.filter(finished_at__isnull=False).order_by('-id').first()
+    since = 0 if full or previous is None else previous.last_event_id
+    last_event_id = AnswerEvent.objects.aggregate(last=Max('id'))['last'] or 0
+    run = ItemAnalysisRun.objects.create(last_event_id=last_event_id)
+
+    lesson_ids = list(AnswerEvent.objects.filter(id__gt=since, id__lte=last_event_id).values_list(
+        'lesson_id', flat=True).distinct())
+    if full:
+        # Items whose answers were all pruned have nothing left to show
+        ItemStatistics.objects.exclude(_lesson_filter(lesson_ids)).delete()
+    for start in range(0, len(lesson_ids), LESSON_BATCH_SIZE):
+        run.items += analyse_lessons(lesson_ids[start:start + LESSON_BATCH_SIZE], last_event_id)
+
+    run.lessons = len(lesson_ids)
+    run.finished_at = timezone.now()
+    run.save()
+    return run
+
+
+def item_statistics_data(item):
+    return {
+        'kind': item.kind,
+        'item': item.item_id,
+        'lesson': item.lesson_id,
+        'learners': item.learners,
+        'difficulty': item.difficulty,
+        'discrimination': item.discrimination,
+        'dead_distractors': item.dead_distractors,
+        'computed_at': item.computed_at,
+        'options': [
+            {
+                'option': option.option_id,
+                'is_correct': option.is_correct,
+                'learners': option.learners,
+                'share': option.share,
+                'is_dead_distractor': option.is_dead_distractor,
+            }
+            for option in item.options.all()
+        ],
+    }
@@ -0,0 +1,295 @@
+import threading
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from account.models import CustomUser
+from .models import LeaderboardEntry, LeaderboardScore, UserProgress
+
+SCOPES = [choice[0] for choice in LeaderboardEntry.SCOPES]
+
+_pending = threading.local()
+
+
+def _pending_users():
+    if not hasattr(_pending, 'users'):
+        _pending.users = set()
+    return _pending.users
+
+
+def schedule_leaderboard_refresh(user_ids):
+    """Refresh the leaderboard entries of learners once the current transaction commits.
+
+    Several score changes of one learner inside a transaction are
+    collapsed into a single refresh.
+    """
+    for user_id in set(user_ids):
+        if user_id:
+            _pending_users().add(user_id)
+            transaction.on_commit(partial(_run_leaderboard_refresh, user_id))
+
+
+def _run_leaderboard_refresh(user_id):
+    if user_id in _pending_users():
+        _pending_users().discard(user_id)
+        refresh_learner_leaderboards(user_id)
+
+
+def learner_scores(user_id):
+    """Score a learner should have on each of their leaderboards, by (scope, scope_id)"""
+    organization_id = CustomUser.objects.filter(id=user_id).values_list('organization_id', flat=True).first()
+    scores = Counter()
+    for lesson_id, chapter_id, score in UserProgress.objects.filter(user_id=user_id).values_list(
+            'lesson_id', 'lesson__chapter_name_id', 'score'):
+        scores[('lesson', lesson_id)] = score
+        scores[('chapter', chapter_id)] += score
+        if organization_id:
+            scores[('organization', organization_id)] += score
+    return scores
+
+
+def _count_score(scope, scope_id, score, delta):
+    """Add delta learners to the score bucket of a leaderboard"""
+    buckets = LeaderboardScore.objects.filter(scope=scope, scope_id=scope_id, score=score)
+    if delta > 0 and not buckets.update(learners=F('learners') + delta):
+        LeaderboardScore.objects.create(scope=scope, scope_id=scope_id, score=score, learners=delta)
+    elif delta < 0:
+        buckets.update(learners=F('learners') + delta)
+        buckets.filter(learners__lte=0).delete()
+
+
+def refresh_learner_leaderboards(user_id):
+    """Bring a learner's entries in line with their progress rows.
+
+    Only the learner's own entries and the score buckets they move between
+    are written, the rest of each leaderboard is left alone.
+    """
+    with transaction.atomic():
+        scores = learner_scores(user_id)
+        entries = {(entry.scope, entry.scope_id): entry
+                   for entry in LeaderboardEntry.objects.filter(user_id=user_id)}
+
+        for key, entry in entries.items():
+            if key not in scores:
+                entry.delete()
+                _count_score(*key, entry.score, -1)
+            elif entry.score != scores[key]:
+                _count_score(*key, entry.score, -1)
+                _count_score(*key, scores[key], 1)
+                entry.score = scores[key]
+                entry.save(update_fields=['score', 'updated_at'])
+
+        added = [key for key in scores if key not in entries]
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(scope=scope, scope_id=scope_id, user_id=user_id, score=scores[(scope, scope_id)])
+            for scope, scope_id in added
+        ])
+        for key in added:
+            _count_score(*key, scores[key], 1)
+
+
+def _match(keys, fields):
+    """Filter matching any of the keys, tuples of values for fields"""
+    condition = Q(pk__in=[])
+    for key in keys:
+        condition |= Q(**dict(zip(fields, key)))
+    return condition
+
+
+def _by_delta(deltas):
+    """Keys of a Counter grouped by their value, so each group is one update"""
+    groups = {}
+    for key, delta in deltas.items():
+        if delta:
+            groups.setdefault(delta, []).append(key)
+    return groups
+
+
+def schedule_leaderboard_points(points):
+    """Add newly scored points to the leaderboards once the current transaction commits.
+
+    The points are added in a transaction of their own, so the scoring
+    write does not hold the database's write lock while the leaderboards
+    move. Points of a transaction that rolls back are never added.
+    """
+    points = {key: added for key, added in points.items() if added}
+    if points:
+        transaction.on_commit(partial(_run_leaderboard_points, points))
+
+
+def _run_leaderboard_points(points):
+    with transaction.atomic():
+        add_leaderboard_points(points)
+
+
+def add_leaderboard_points(points):
+    """Add newly scored points to learners' lesson, chapter and organization entries.
+
+    points maps (user_id, lesson_id) to the points just scored. Entries are
+    incremented in place and each learner moves from their old score bucket
+    to the new one, so a correct answer costs a handful of queries whatever
+    the size of the leaderboards. Call it in a transaction, usually through
+    schedule_leaderboard_points. Learners missing an entry get a full
+    refresh after the commit.
+    """
+    points = {key: added for key, added in points.items() if added}
+    if not points:
+        return
+    deltas = Counter()
+    for user_id, lesson_id, chapter_id, organization_id in UserProgress.objects.filter(
+            user_id__in={user_id for user_id, _ in points},
+            lesson_id__in={lesson_id for _, lesson_id in points}).values_list(
+            'user_id', 'lesson_id', 'lesson__chapter_name_id', 'user__organization_id'):
+        added = points.get((user_id, lesson_id))
+        if not added:
+            continue
+        deltas[('lesson', lesson_id, user_id)] += added
+        deltas[('chapter', chapter_id, user_id)] += added
+        if organization_id:
+            deltas[('organization', organization_id, user_id)] += added
+    if not deltas:
+        return
+
+    entry_fields = ('scope', 'scope_id', 'user_id')
+    now = timezone.now()
+    for delta, keys in _by_delta(deltas).items():
+        LeaderboardEntry.objects.filter(_match(keys, entry_fields)).update(
+            score=F('score') + delta, updated_at=now)
+    # Read after the update, so the new scores are those of this transaction
+    scores = {(scope, scope_id, user_id): score for scope, scope_id, user_id, score in LeaderboardEntry.objects.filter(
+        _match(deltas, entry_fields)).values_list(*entry_fields, 'score')}
+    schedule_leaderboard_refresh({user_id for scope, scope_id, user_id in deltas if (scope, scope_id, user_id) not in scores})
+
+    moves = Counter()
+    for (scope, scope_id, user_id), score in scores.items():
+        moves[(scope, scope_id, score - deltas[(scope, scope_id, user_id)])] -= 1
+        moves[(scope, scope_id, score)] += 1
+
+    score_fields = ('scope', 'scope_id', 'score')
+    buckets = LeaderboardScore.objects.all()
+    for delta, keys in _by_delta(moves).items():
+        matching = buckets.filter(_match(keys, score_fields))
+        if delta < 0:
+            matching.update(learners=F('learners') + delta)
+            matching.filter(learners__lte=0).delete()
+        elif matching.update(learners=F('learners') + delta) < len(keys):
+            existing = set(matching.values_list(*score_fields))
+            LeaderboardScore.objects.bulk_create([
+                LeaderboardScore(scope=scope, scope_id=scope_id, score=score, learners=delta)
+                for scope, scope_id, score in keys if (scope, scope_id, score) not in existing
+            ])
+
+
+def remove_learner(user_id):
+    """Take a learner off every leaderboard, before the user row is deleted"""
+    with transaction.atomic():
+        entries = list(LeaderboardEntry.objects.filter(user_id=user_id))
+        for entry in entries:
+            _count_score(entry.scope, entry.scope_id, entry.score, -1)
+        LeaderboardEntry.objects.filter(user_id=user_id).delete()
+
+
+def rebuild_leaderboards():
+    """Recompute every leaderboard from UserProgress, returns the number of entries"""
+    scores = Counter()
+    rows = UserProgress.objects.values_list(
+        'user_id', 'lesson_id', 'lesson__chapter_name_id', 'user__organization_id', 'score')
+    for user_id, lesson_id, chapter_id, organization_id, score in rows.iterator():
+        scores[('lesson', lesson_id, user_id)] = score
+        scores[('chapter', chapter_id, user_id)] += score
+        if organization_id:
+            scores[('organization', organization_id, user_id)] += score
+
+    buckets = Counter((scope, scope_id, score) for (scope, scope_id, user_id), score in scores.items())
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardScore.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(scope=scope, scope_id=scope_id, user_id=user_id, score=score)
+            for (scope, scope_id, user_id), score in scores.items()
+        ], batch_size=1000)
+        LeaderboardScore.objects.bulk_create([
+            LeaderboardScore(scope=scope, scope_id=scope_id, score=score, learners=learners)
+            for (scope, scope_id, score), learners in buckets.items()
+        ], batch_size=1000)
+    return len(scores)
+
+
+def _board(scope, scope_id):
+    return LeaderboardEntry.objects.filter(scope=scope, scope_id=scope_id)
+
+
+def _ranks(scope, scope_id, scores):
+    """Rank of each score, learners with equal scores share a rank.
+
+    Two queries on the score buckets: the learners above the highest
+    score, and the buckets between the lowest and highest one.
+    """
+    if not scores:
+        return {}
+    buckets = LeaderboardScore.objects.filter(scope=scope, scope_id=scope_id)
+    highest, lowest = max(scores), min(scores)
+    above = buckets.filter(score__gt=highest).aggregate(total=Sum('learners'))['total'] or 0
+    between = dict(buckets.filter(score__gte=lowest, score__lte=highest).values_list('score', 'learners'))
+    return {
+        score: 1 + above + sum(learners for other, learners in between.items() if other > score)
+        for score in set(scores)
+    }
+
+
+def _entry_data(entry, ranks):
+    return {
+        'rank': ranks[entry['score']],
+        'user': entry['user_id'],
+        'username': entry['user__username'],
+        'score': entry['score'],
+    }
+
+
+def leaderboard_size(scope, scope_id):
+    return LeaderboardScore.objects.filter(scope=scope, scope_id=scope_id).aggregate(
+        total=Sum('learners'))['total'] or 0
+
+
+def top_entries(scope, scope_id, limit=10):
+    """The best learners of a leaderboard, highest score first"""
+    entries = list(_board(scope, scope_id).order_by('-score', 'user_id').values(
+        'user_id', 'user__username', 'score')[:limit])
+    # Competition ranking: a learner is ranked after everyone with a higher score
+    ranks = {}
+    for index, entry in enumerate(entries):
+        ranks.setdefault(entry['score'], index + 1)
+    return [_entry_data(entry, ranks) for entry in entries]
+
+
+def learner_standing(scope, scope_id, user_id, around=2):
+    """Rank and score of a learner with the learners just above and below, or None.
+
+    Neighbours are found with index seeks on (scope, scope_id, score, user)
+    and ranks are summed over score buckets, so no query walks the learners
+    of the leaderboard.
+    """
+    fields = ('user_id', 'user__username', 'score')
+    board = _board(scope, scope_id)
+    me = board.filter(user_id=user_id).values(*fields).first()
+    if me is None:
+        return None
+    score = me['score']
+
+    # Learners with the same score are ordered by user id
+    above = list(board.filter(score=score, user_id__lt=user_id).order_by('-user_id').values(*fields)[:around])
+    if len(above) < around:
+        above += board.filter(score__gt=score).order_by('score', '-user_id').values(*fields)[:around - len(above)]
+    below = list(board.filter(score=score, user_id__gt=user_id).order_by('user_id').values(*fields)[:around])
+    if len(below) < around:
+        below += board.filter(score__lt=score).order_by('-score', 'user_id').values(*fields)[:around - len(below)]
+
+    ranks = _ranks(scope, scope_id, [entry['score'] for entry in above + [me] + below])
+    return {
+        **_entry_data(me, ranks),
+        'above': [_entry_data(entry, ranks) for entry in reversed(above)],
+        'below': [_entry_data(entry, ranks) for entry in below],
+    }
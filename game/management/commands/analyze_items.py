@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from game.item_analysis import run_item_analysis
+
+
+class Command(BaseCommand):
+    help = "Compute option shares, difficulty and discrimination of questions and quizzes from the answer log"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Recompute every lesson instead of those answered since the last run")
+
+    def handle(self, *args, **options):
+        run = run_item_analysis(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {run.items} items in {run.lessons} lessons, up to answer {run.last_event_id}"))
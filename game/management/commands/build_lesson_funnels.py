@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from game.funnel import refresh_lesson_funnels
+
+
+class Command(BaseCommand):
+    help = "Rebuild lesson drop-off funnels whose progress changed since they were computed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild the funnel of every lesson")
+
+    def handle(self, *args, **options):
+        count = refresh_lesson_funnels(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} lesson funnels"))
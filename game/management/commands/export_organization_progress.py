@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.models import Organization
+from game.export import FORMATS, export_lines, parse_cursor
+
+
+class Command(BaseCommand):
+    help = "Write every learner's progress in an organization as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', type=int, help="Id of the organization")
+        parser.add_argument('--export-format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write to instead of standard output")
+        parser.add_argument('--after', help="Cursor of the last row already exported, appends the rest to --output")
+
+    def handle(self, *args, **options):
+        if not Organization.objects.filter(id=options['organization']).exists():
+            raise CommandError(f"Organization {options['organization']} not found")
+        after = None
+        if options['after']:
+            try:
+                after = parse_cursor(options['after'])
+            except ValueError:
+                raise CommandError(f"Invalid cursor '{options['after']}'")
+
+        lines = export_lines(options['organization'], options['export_format'], after)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        rows = 0
+        with open(options['output'], 'a' if after else 'w', newline='', encoding='utf-8') as out:
+            for line in lines:
+                out.write(line)
+                rows += 1
+        self.stderr.write(self.style.SUCCESS(f"Wrote {rows} lines to {options['output']}"))
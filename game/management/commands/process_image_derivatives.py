@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from game.atlas import claim_next_atlas, process_frame_atlas, requeue_stale_atlases
+from game.images import claim_next_job, process_image_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Worker that makes resized WebP copies of uploaded game images and packs frame sprite atlases"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Process the jobs waiting now and exit")
+        parser.add_argument('--interval', type=float, default=2,
+                            help="Seconds to wait between polls of an empty queue")
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs() + requeue_stale_atlases()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale jobs"))
+
+        processed = 0
+        while True:
+            job = claim_next_job()
+            if job is not None:
+                job = process_image_job(job)
+                label = job.source
+            else:
+                # Resized copies go first, clients fall back to them until a frame has an atlas
+                job = claim_next_atlas()
+                if job is not None:
+                    job = process_frame_atlas(job)
+                    label = f"Atlas of frame {job.frame_id}"
+
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            processed += 1
+            if job.status == 'done':
+                self.stdout.write(f"{label}: done")
+            else:
+                self.stdout.write(self.style.ERROR(f"{label}: {job.status} ({job.error})"))
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} image jobs"))
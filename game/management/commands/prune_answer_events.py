@@ -0,0 +1,49 @@
+import gzip
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from game.answer_log import answer_period
+from game.models import AnswerEvent
+
+FIELDS = ['id', 'user_id', 'question_id', 'quiz_id', 'option_id', 'lesson_id',
+          'is_correct', 'latency_ms', 'answered_at']
+
+
+class Command(BaseCommand):
+    help = "Delete answer events of old months, optionally archiving each month to a gzipped JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=12,
+                            help="Number of months to keep, the current one included")
+        parser.add_argument('--archive', help="Directory to write answers-YYYYMM.jsonl.gz files to before deleting")
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError("--keep-months must be at least 1")
+        now = timezone.now()
+        months = now.year * 12 + now.month - 1 - (options['keep_months'] - 1)
+        oldest_kept = answer_period(now.replace(year=months // 12, month=months % 12 + 1, day=1))
+
+        archive = Path(options['archive']) if options['archive'] else None
+        if archive:
+            archive.mkdir(parents=True, exist_ok=True)
+
+        periods = AnswerEvent.objects.filter(period__lt=oldest_kept).values_list(
+            'period', flat=True).distinct().order_by('period')
+        for period in periods:
+            events = AnswerEvent.objects.filter(period=period)
+            if archive:
+                # Appended to, a month interrupted before its delete is written again, rows keep their id
+                path = archive / f'answers-{period}.jsonl.gz'
+                with gzip.open(path, 'at', encoding='utf-8') as out:
+                    for row in events.order_by('id').values_list(*FIELDS).iterator(chunk_size=2000):
+                        event = dict(zip(FIELDS, row))
+                        event['answered_at'] = event['answered_at'].isoformat()
+                        out.write(json.dumps(event) + '\n')
+            deleted, _ = events.delete()
+            self.stdout.write(f"{period}: removed {deleted} answer events")
+
+        self.stdout.write(self.style.SUCCESS(f"Kept answer events from {oldest_kept} on"))
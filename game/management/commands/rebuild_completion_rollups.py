@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from game.rollups import rebuild_completion_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute every learner's chapter, subject and class completion from user progress"
+
+    def handle(self, *args, **options):
+        rows = rebuild_completion_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt completion rollups ({rows} rows)"))
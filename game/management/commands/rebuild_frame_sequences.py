@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from course.models import Lesson
+from game.sequence import rebuild_frame_sequence
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored frame sequence of every lesson, or of one lesson"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lesson', help="Slug of a single lesson to rebuild")
+
+    def handle(self, *args, **options):
+        lessons = Lesson.objects.all()
+        if options['lesson']:
+            lessons = lessons.filter(slug=options['lesson'])
+            if not lessons.exists():
+                raise CommandError(f"Lesson '{options['lesson']}' not found")
+
+        broken = 0
+        for lesson_id in lessons.values_list('id', flat=True).iterator():
+            sequence = rebuild_frame_sequence(lesson_id)
+            if sequence and not sequence.is_consistent:
+                broken += 1
+                self.stdout.write(self.style.WARNING(
+                    f"Lesson {lesson_id}: cycles={sequence.cycle_frames} "
+                    f"orphans={sequence.orphan_frames} forks={sequence.fork_frames}"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt frame sequences ({broken} with a broken chain)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from game.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    help = "Recompute every lesson, chapter and organization leaderboard from user progress"
+
+    def handle(self, *args, **options):
+        entries = rebuild_leaderboards()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt leaderboards ({entries} entries)"))
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-17 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+        ('game', '0012_frame_order_alter_gameobject_frame'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrameSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frame_count', models.IntegerField(default=0)),
+                ('is_consistent', models.BooleanField(default=True, help_text='The chain is a single path without cycles, orphans or forks')),
+                ('matches_order', models.BooleanField(default=True, help_text='The chain visits frames in Frame.order')),
+                ('cycle_frames', models.JSONField(blank=True, default=list, help_text='Frames unreachable from any chain head')),
+                ('orphan_frames', models.JSONField(blank=True, default=list, help_text='Frames whose previous frame belongs to another lesson')),
+                ('fork_frames', models.JSONField(blank=True, default=list, help_text='Heads of extra chains after the first one')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='frame_sequence', to='course.lesson')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FrameSequenceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField(help_text='1-based position in the lesson')),
+                ('previous_frame_id', models.BigIntegerField(blank=True, null=True)),
+                ('next_frame_id', models.BigIntegerField(blank=True, null=True)),
+                ('frame', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sequence_entry', to='game.frame')),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='game.framesequence')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('sequence', 'position')},
+            },
+        ),
+    ]
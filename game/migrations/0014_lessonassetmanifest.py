@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-17 16:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+        ('game', '0013_framesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonAssetManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assets', models.JSONField(blank=True, default=list)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('total_size', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='asset_manifest', to='course.lesson')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-17 16:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0015_imagederivative_imagederivativejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrameSpriteAtlas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.FileField(blank=True, null=True, upload_to='game_atlases/')),
+                ('width', models.IntegerField(default=0)),
+                ('height', models.IntegerField(default=0)),
+                ('regions', models.JSONField(blank=True, default=dict, help_text='Sprite of each object id, with the image it was cut from')),
+                ('signature', models.CharField(blank=True, help_text='Hash of the object images the sheet was built from', max_length=40)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('frame', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sprite_atlas', to='game.frame')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+        ('game', '0016_framespriteatlas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgressEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(help_text='Id generated by the client', max_length=64)),
+                ('event_type', models.CharField(choices=[('frame_viewed', 'Frame viewed'), ('quiz_answered', 'Quiz answered'), ('lesson_resumed', 'Lesson resumed')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='course.lesson')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'event_id')},
+            },
+        ),
+    ]
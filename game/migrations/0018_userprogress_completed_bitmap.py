@@ -0,0 +1,125 @@
+# Generated by Django 5.1.7 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+# Copies of game.bitmap and game.sequence as they were when this migration
+# was written, so later changes to those modules cannot change what it does
+
+
+def from_positions(positions):
+    """Bitmap with bit n - 1 set for each position n"""
+    result = bytearray()
+    for position in positions:
+        index = position - 1
+        if index // 8 >= len(result):
+            result.extend(bytes(index // 8 - len(result) + 1))
+        result[index // 8] |= 1 << index % 8
+    return bytes(result)
+
+
+def count(bitmap):
+    return sum(bin(byte).count('1') for byte in bitmap)
+
+
+def resolve_frame_chain(frames):
+    """Frames of one lesson in playback order along their previous_frame links, and where the chain is broken"""
+    frames_by_order = sorted(frames, key=lambda f: (f.order, f.id))
+    frame_ids = {frame.id for frame in frames}
+    next_by_id = {}
+    heads = []
+    orphans = []
+    for frame in frames_by_order:
+        if frame.previous_frame_id in frame_ids:
+            next_by_id[frame.previous_frame_id] = frame
+        elif frame.previous_frame_id is None:
+            heads.append(frame)
+        else:
+            orphans.append(frame)
+
+    ordered = []
+    seen = set()
+    for head in heads + orphans:
+        frame = head
+        while frame is not None and frame.id not in seen:
+            seen.add(frame.id)
+            ordered.append(frame)
+            frame = next_by_id.get(frame.id)
+
+    cycles = [frame for frame in frames_by_order if frame.id not in seen]
+    ordered.extend(cycles)
+
+    issues = {
+        'cycle_frames': [frame.id for frame in cycles],
+        'orphan_frames': [frame.id for frame in orphans],
+        'fork_frames': [frame.id for frame in heads[1:]],
+    }
+    issues['is_consistent'] = not any(issues.values())
+    issues['matches_order'] = [f.id for f in ordered] == [f.id for f in frames_by_order]
+    return ordered, issues
+
+
+def fill_completed_bitmaps(apps, schema_editor):
+    """Turn completed_frames rows into bitmaps over each lesson's frame sequence"""
+    Frame = apps.get_model('game', 'Frame')
+    FrameSequence = apps.get_model('game', 'FrameSequence')
+    FrameSequenceEntry = apps.get_model('game', 'FrameSequenceEntry')
+    UserProgress = apps.get_model('game', 'UserProgress')
+    Completed = UserProgress.completed_frames.through
+
+    completed = {}
+    for progress_id, frame_id in Completed.objects.values_list('userprogress_id', 'frame_id').iterator():
+        completed.setdefault(progress_id, []).append(frame_id)
+    if not completed:
+        return
+
+    positions = {}
+    progresses = list(UserProgress.objects.filter(id__in=completed).only('id', 'lesson_id'))
+    for lesson_id in {progress.lesson_id for progress in progresses}:
+        sequence = FrameSequence.objects.filter(lesson_id=lesson_id).first()
+        if sequence is None:
+            ordered, issues = resolve_frame_chain(list(Frame.objects.filter(lesson_id=lesson_id)))
+            sequence = FrameSequence.objects.create(lesson_id=lesson_id, frame_count=len(ordered), **issues)
+            FrameSequenceEntry.objects.bulk_create([
+                FrameSequenceEntry(
+                    sequence=sequence,
+                    frame_id=frame.id,
+                    position=index + 1,
+                    previous_frame_id=ordered[index - 1].id if index > 0 else None,
+                    next_frame_id=ordered[index + 1].id if index + 1 < len(ordered) else None
+                )
+                for index, frame in enumerate(ordered)
+            ])
+        positions[lesson_id] = dict(sequence.entries.values_list('frame_id', 'position'))
+
+    for progress in progresses:
+        lesson_positions = positions[progress.lesson_id]
+        progress.completed_bitmap = from_positions(
+            lesson_positions[frame_id] for frame_id in completed[progress.id] if frame_id in lesson_positions)
+        progress.completed_count = count(progress.completed_bitmap)
+    UserProgress.objects.bulk_update(progresses, ['completed_bitmap', 'completed_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0017_progressevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprogress',
+            name='completed_bitmap',
+            field=models.BinaryField(blank=True, default=b'', help_text='Bit n - 1 is set when the frame at sequence position n is completed'),
+        ),
+        migrations.AddField(
+            model_name='userprogress',
+            name='completed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='userprogress',
+            name='completed_frames',
+            field=models.ManyToManyField(blank=True, help_text='Only kept up to date when GAME_PROGRESS_MIRROR_M2M is on', related_name='completed_by_users', to='game.frame'),
+        ),
+        migrations.RunPython(fill_completed_bitmaps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.7 on 2026-10-17 18:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0018_userprogress_completed_bitmap'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('lesson', 'Lesson'), ('chapter', 'Chapter'), ('organization', 'Organization')], max_length=20)),
+                ('scope_id', models.BigIntegerField(help_text='Id of the lesson, chapter or organization')),
+                ('score', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'leaderboard entries',
+                'indexes': [models.Index(fields=['scope', 'scope_id', 'score', 'user'], name='game_leader_scope_a49d8d_idx')],
+                'unique_together': {('scope', 'scope_id', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='LeaderboardScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('lesson', 'Lesson'), ('chapter', 'Chapter'), ('organization', 'Organization')], max_length=20)),
+                ('scope_id', models.BigIntegerField()),
+                ('score', models.IntegerField()),
+                ('learners', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('scope', 'scope_id', 'score')},
+            },
+        ),
+    ]
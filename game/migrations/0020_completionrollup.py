@@ -0,0 +1,32 @@
+# Generated by Django 5.1.7 on 2026-10-17 18:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0019_leaderboards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('chapter', 'Chapter'), ('subject', 'Subject'), ('class', 'Class')], max_length=20)),
+                ('scope_id', models.BigIntegerField(help_text='Id of the chapter, subject or class')),
+                ('completed_frames', models.IntegerField(default=0)),
+                ('total_frames', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completion_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'scope_id'], name='game_comple_scope_7bc3dd_idx')],
+                'unique_together': {('user', 'scope', 'scope_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-17 18:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0020_completionrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_id', models.BigIntegerField(blank=True, null=True)),
+                ('quiz_id', models.BigIntegerField(blank=True, null=True)),
+                ('option_id', models.BigIntegerField()),
+                ('lesson_id', models.BigIntegerField(blank=True, null=True)),
+                ('is_correct', models.BooleanField()),
+                ('latency_ms', models.IntegerField(blank=True, help_text='Time the learner took to answer, as reported by the client', null=True)),
+                ('answered_at', models.DateTimeField()),
+                ('period', models.IntegerField(help_text='Year and month of answered_at as YYYYMM, pruned as a whole')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period'], name='game_answer_period_5f30ef_idx'), models.Index(fields=['question_id', 'option_id'], name='game_answer_questio_c75865_idx'), models.Index(fields=['quiz_id', 'option_id'], name='game_answer_quiz_id_501d20_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2026-10-17 19:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0021_answerevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemAnalysisRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_event_id', models.BigIntegerField(default=0, help_text='Answers up to this event were included')),
+                ('lessons', models.IntegerField(default=0)),
+                ('items', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ItemStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('question', 'Question'), ('quiz', 'Quiz')], max_length=20)),
+                ('item_id', models.BigIntegerField()),
+                ('lesson_id', models.BigIntegerField(blank=True, null=True)),
+                ('learners', models.IntegerField(default=0)),
+                ('difficulty', models.FloatField(blank=True, help_text='Share of learners answering correctly, lower is harder', null=True)),
+                ('discrimination', models.FloatField(blank=True, help_text="Point-biserial correlation of correctness with the learner's score on the rest of the lesson", null=True)),
+                ('dead_distractors', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'item statistics',
+                'indexes': [models.Index(fields=['lesson_id'], name='game_itemst_lesson__3251ca_idx')],
+                'unique_together': {('kind', 'item_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='OptionStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('option_id', models.BigIntegerField()),
+                ('is_correct', models.BooleanField(default=False)),
+                ('learners', models.IntegerField(default=0)),
+                ('share', models.FloatField(default=0)),
+                ('is_dead_distractor', models.BooleanField(default=False, help_text='A wrong option almost nobody picks')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='options', to='game.itemstatistics')),
+            ],
+            options={
+                'verbose_name_plural': 'option statistics',
+                'ordering': ['option_id'],
+                'unique_together': {('item', 'option_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-17 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+        ('game', '0022_item_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonFunnel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('learners', models.IntegerField(default=0)),
+                ('finished', models.IntegerField(default=0, help_text='Learners who completed every frame')),
+                ('computed_at', models.DateTimeField()),
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='funnel', to='course.lesson')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LessonFunnelStep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('reached', models.IntegerField(default=0, help_text='Learners who got to this frame or further')),
+                ('stopped', models.IntegerField(default=0, help_text='Unfinished learners whose furthest frame is this one')),
+                ('abandoned', models.IntegerField(default=0, help_text='Stopped learners inactive for GAME_FUNNEL_ABANDON_DAYS or more')),
+                ('frame', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='funnel_steps', to='game.frame')),
+                ('funnel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='game.lessonfunnel')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('funnel', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-17 20:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course', '0012_alter_question_options_alter_questionoption_options_and_more'),
+        ('game', '0023_lessonfunnel'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_at', models.DateTimeField()),
+                ('interval_days', models.FloatField(default=0, help_text='Days between the last two reviews')),
+                ('ease', models.FloatField(default=2.5, help_text='Factor the interval grows by after a correct answer')),
+                ('streak', models.IntegerField(default=0, help_text='Correct answers since the last wrong one')),
+                ('lapses', models.IntegerField(default=0, help_text='Wrong answers in total')),
+                ('last_answered_at', models.DateTimeField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_items', to='course.question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_items', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'due_at'], name='game_review_user_id_fb1746_idx')],
+                'unique_together': {('user', 'question')},
+            },
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from course.models import Lesson
+from course.models import Lesson, Question
 from account.models import CustomUser
 
 
@@ -136,7 +136,11 @@ class UserProgress(models.Model):
     current_frame = models.ForeignKey(
         Frame, on_delete=models.SET_NULL, null=True, blank=True)
     completed_frames = models.ManyToManyField(
-        Frame, related_name='completed_by_users')
+        Frame, related_name='completed_by_users', blank=True,
+        help_text="Only kept up to date when GAME_PROGRESS_MIRROR_M2M is on")
+    completed_bitmap = models.BinaryField(
+        default=b'', blank=True, help_text="Bit n - 1 is set when the frame at sequence position n is completed")
+    completed_count = models.IntegerField(default=0)
     score = models.IntegerField(default=0)
     last_interaction = models.DateTimeField(auto_now=True)
 
@@ -145,3 +149,334 @@ class UserProgress(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s progress in {self.lesson.name}"
+
+
+class FrameSequence(models.Model):
+    """Materialized playback order of a lesson's frames along the previous_frame chain"""
+    lesson = models.OneToOneField(
+        Lesson, on_delete=models.CASCADE, related_name='frame_sequence')
+    frame_count = models.IntegerField(default=0)
+    is_consistent = models.BooleanField(
+        default=True, help_text="The chain is a single path without cycles, orphans or forks")
+    matches_order = models.BooleanField(
+        default=True, help_text="The chain visits frames in Frame.order")
+    cycle_frames = models.JSONField(
+        default=list, blank=True, help_text="Frames unreachable from any chain head")
+    orphan_frames = models.JSONField(
+        default=list, blank=True, help_text="Frames whose previous frame belongs to another lesson")
+    fork_frames = models.JSONField(
+        default=list, blank=True, help_text="Heads of extra chains after the first one")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Frame sequence of {self.lesson.name}"
+
+
+class FrameSequenceEntry(models.Model):
+    """Position of one frame in its lesson's sequence"""
+    sequence = models.ForeignKey(
+        FrameSequence, on_delete=models.CASCADE, related_name='entries')
+    frame = models.OneToOneField(
+        Frame, on_delete=models.CASCADE, related_name='sequence_entry')
+    position = models.IntegerField(help_text="1-based position in the lesson")
+    previous_frame_id = models.BigIntegerField(null=True, blank=True)
+    next_frame_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ['sequence', 'position']
+
+    def __str__(self):
+        return f"Frame {self.frame_id} at position {self.position}"
+
+
+class LessonAssetManifest(models.Model):
+    """Images used by a lesson's frames, in the order the player first needs them"""
+    lesson = models.OneToOneField(
+        Lesson, on_delete=models.CASCADE, related_name='asset_manifest')
+    assets = models.JSONField(default=list, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    total_size = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Asset manifest of {self.lesson.name}"
+
+
+class ImageDerivativeJob(models.Model):
+    """Uploaded image waiting for the worker to make its resized derivatives"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    source = models.CharField(
+        max_length=255, unique=True, help_text="Storage name of the uploaded image")
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.get_status_display()})"
+
+
+class ImageDerivative(models.Model):
+    """Resized, recompressed copy of an uploaded image at one target width"""
+    source = models.CharField(
+        max_length=255, db_index=True, help_text="Storage name of the uploaded image")
+    image = models.FileField(upload_to='game_derivatives/')
+    width = models.IntegerField()
+    height = models.IntegerField()
+    size = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['source', 'width']
+        unique_together = ['source', 'width']
+
+    def __str__(self):
+        return f"{self.source} at {self.width}px"
+
+
+class FrameSpriteAtlas(models.Model):
+    """Object images of a frame packed into one sprite sheet, made by the image worker"""
+    frame = models.OneToOneField(
+        Frame, on_delete=models.CASCADE, related_name='sprite_atlas')
+    image = models.FileField(upload_to='game_atlases/', blank=True, null=True)
+    width = models.IntegerField(default=0)
+    height = models.IntegerField(default=0)
+    regions = models.JSONField(
+        default=dict, blank=True, help_text="Sprite of each object id, with the image it was cut from")
+    signature = models.CharField(
+        max_length=40, blank=True, help_text="Hash of the object images the sheet was built from")
+    status = models.CharField(
+        max_length=20, choices=ImageDerivativeJob.STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sprite atlas of frame {self.frame_id}"
+
+
+class ProgressEvent(models.Model):
+    """Client event already applied to a learner's progress, kept so retried syncs are ignored"""
+    EVENT_TYPES = [
+        ('frame_viewed', 'Frame viewed'),
+        ('quiz_answered', 'Quiz answered'),
+        ('lesson_resumed', 'Lesson resumed'),
+    ]
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='progress_events')
+    event_id = models.CharField(max_length=64, help_text="Id generated by the client")
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    lesson = models.ForeignKey(
+        Lesson, on_delete=models.CASCADE, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['user', 'event_id']
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} {self.event_id} by {self.user.username}"
+
+
+class LeaderboardEntry(models.Model):
+    """Score of a learner on the leaderboard of a lesson, chapter or organization"""
+    SCOPES = [
+        ('lesson', 'Lesson'),
+        ('chapter', 'Chapter'),
+        ('organization', 'Organization'),
+    ]
+    scope = models.CharField(max_length=20, choices=SCOPES)
+    scope_id = models.BigIntegerField(help_text="Id of the lesson, chapter or organization")
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    score = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['scope', 'scope_id', 'user']
+        indexes = [models.Index(fields=['scope', 'scope_id', 'score', 'user'])]
+        verbose_name_plural = 'leaderboard entries'
+
+    def __str__(self):
+        return f"{self.user.username} on {self.scope} {self.scope_id}: {self.score}"
+
+
+class LeaderboardScore(models.Model):
+    """Number of learners with a score on one leaderboard, summed to find ranks"""
+    scope = models.CharField(max_length=20, choices=LeaderboardEntry.SCOPES)
+    scope_id = models.BigIntegerField()
+    score = models.IntegerField()
+    learners = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['scope', 'scope_id', 'score']
+
+    def __str__(self):
+        return f"{self.learners} learners with {self.score} on {self.scope} {self.scope_id}"
+
+
+class CompletionRollup(models.Model):
+    """Frames a learner completed in one chapter, subject or class, next to the frames it has"""
+    SCOPES = [
+        ('chapter', 'Chapter'),
+        ('subject', 'Subject'),
+        ('class', 'Class'),
+    ]
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='completion_rollups')
+    scope = models.CharField(max_length=20, choices=SCOPES)
+    scope_id = models.BigIntegerField(help_text="Id of the chapter, subject or class")
+    completed_frames = models.IntegerField(default=0)
+    total_frames = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'scope', 'scope_id']
+        indexes = [models.Index(fields=['scope', 'scope_id'])]
+
+    def __str__(self):
+        return f"{self.user.username} on {self.scope} {self.scope_id}: {self.completed_frames}/{self.total_frames}"
+
+
+class AnswerEvent(models.Model):
+    """One answer given by a learner, to a lesson question or a game quiz. Rows are only ever appended"""
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='answer_events')
+    question_id = models.BigIntegerField(null=True, blank=True)
+    quiz_id = models.BigIntegerField(null=True, blank=True)
+    option_id = models.BigIntegerField()
+    lesson_id = models.BigIntegerField(null=True, blank=True)
+    is_correct = models.BooleanField()
+    latency_ms = models.IntegerField(
+        null=True, blank=True, help_text="Time the learner took to answer, as reported by the client")
+    answered_at = models.DateTimeField()
+    period = models.IntegerField(help_text="Year and month of answered_at as YYYYMM, pruned as a whole")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['period']),
+            models.Index(fields=['question_id', 'option_id']),
+            models.Index(fields=['quiz_id', 'option_id']),
+        ]
+
+    def __str__(self):
+        item = f"question {self.question_id}" if self.question_id else f"quiz {self.quiz_id}"
+        return f"{self.user_id} answered {item} with option {self.option_id}"
+
+
+class ItemAnalysisRun(models.Model):
+    """One run of the item analysis, later runs only revisit lessons with newer answers"""
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_event_id = models.BigIntegerField(
+        default=0, help_text="Answers up to this event were included")
+    lessons = models.IntegerField(default=0)
+    items = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Item analysis up to answer {self.last_event_id}"
+
+
+class ItemStatistics(models.Model):
+    """Difficulty and discrimination of a lesson question or game quiz, from each learner's first answer"""
+    KINDS = [
+        ('question', 'Question'),
+        ('quiz', 'Quiz'),
+    ]
+    kind = models.CharField(max_length=20, choices=KINDS)
+    item_id = models.BigIntegerField()
+    lesson_id = models.BigIntegerField(null=True, blank=True)
+    learners = models.IntegerField(default=0)
+    difficulty = models.FloatField(
+        null=True, blank=True, help_text="Share of learners answering correctly, lower is harder")
+    discrimination = models.FloatField(
+        null=True, blank=True,
+        help_text="Point-biserial correlation of correctness with the learner's score on the rest of the lesson")
+    dead_distractors = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['kind', 'item_id']
+        indexes = [models.Index(fields=['lesson_id'])]
+        verbose_name_plural = 'item statistics'
+
+    def __str__(self):
+        return f"Statistics of {self.kind} {self.item_id}"
+
+
+class OptionStatistics(models.Model):
+    """How often learners chose one option of an item on their first answer"""
+    item = models.ForeignKey(
+        ItemStatistics, on_delete=models.CASCADE, related_name='options')
+    option_id = models.BigIntegerField()
+    is_correct = models.BooleanField(default=False)
+    learners = models.IntegerField(default=0)
+    share = models.FloatField(default=0)
+    is_dead_distractor = models.BooleanField(
+        default=False, help_text="A wrong option almost nobody picks")
+
+    class Meta:
+        unique_together = ['item', 'option_id']
+        ordering = ['option_id']
+        verbose_name_plural = 'option statistics'
+
+    def __str__(self):
+        return f"Option {self.option_id} of {self.item}"
+
+
+class LessonFunnel(models.Model):
+    """How far learners got in a lesson, computed from their progress"""
+    lesson = models.OneToOneField(
+        Lesson, on_delete=models.CASCADE, related_name='funnel')
+    learners = models.IntegerField(default=0)
+    finished = models.IntegerField(default=0, help_text="Learners who completed every frame")
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Funnel of {self.lesson.name}"
+
+
+class LessonFunnelStep(models.Model):
+    """Learners reaching one frame of a funnel and those going no further"""
+    funnel = models.ForeignKey(
+        LessonFunnel, on_delete=models.CASCADE, related_name='steps')
+    frame = models.ForeignKey(Frame, on_delete=models.CASCADE, related_name='funnel_steps')
+    position = models.IntegerField()
+    reached = models.IntegerField(default=0, help_text="Learners who got to this frame or further")
+    stopped = models.IntegerField(default=0, help_text="Unfinished learners whose furthest frame is this one")
+    abandoned = models.IntegerField(
+        default=0, help_text="Stopped learners inactive for GAME_FUNNEL_ABANDON_DAYS or more")
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ['funnel', 'position']
+
+    def __str__(self):
+        return f"Frame {self.frame_id} at position {self.position}: {self.reached} reached"
+
+
+class ReviewItem(models.Model):
+    """A lesson question a learner answered wrong, scheduled to be asked again"""
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='review_items')
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, related_name='review_items')
+    due_at = models.DateTimeField()
+    interval_days = models.FloatField(default=0, help_text="Days between the last two reviews")
+    ease = models.FloatField(default=2.5, help_text="Factor the interval grows by after a correct answer")
+    streak = models.IntegerField(default=0, help_text="Correct answers since the last wrong one")
+    lapses = models.IntegerField(default=0, help_text="Wrong answers in total")
+    last_answered_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'question']
+        indexes = [models.Index(fields=['user', 'due_at'])]
+
+    def __str__(self):
+        return f"Question {self.question_id} for {self.user.username} due {self.due_at}"
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from course.models import Lesson
+from .models import Frame, GameObject, Dialogue, QuizOption
+from .sequence import resolve_frame_chain
+
+
+def build_file_url(request, file):
+    """Absolute URL of an uploaded file, or None when nothing is stored"""
+    if file and hasattr(file, 'url'):
+        return request.build_absolute_uri(file.url)
+    return None
+
+
+def frames_with_content():
+    """Frames with backgrounds, objects, dialogues and quizzes loaded in a fixed number of queries"""
+    return Frame.objects.select_related('background', 'quiz', 'sprite_atlas').prefetch_related(
+        Prefetch(
+            'game_objects',
+            queryset=GameObject.objects.order_by('id').prefetch_related(
+                Prefetch('dialogues', queryset=Dialogue.objects.order_by('id')))
+        ),
+        Prefetch('quiz__options', queryset=QuizOption.objects.order_by('id')),
+    )
+
+
+def lesson_frames_queryset(lesson):
+    return frames_with_content().filter(lesson=lesson).order_by('order', 'id')
+
+
+def serialize_frame(frame, request, next_frame_id=None):
+    """Frame with its objects, dialogues and quiz, in the shape returned by the frame detail endpoint"""
+    # Regions cut from an image that was replaced since the sheet was packed are skipped
+    atlas = frame.sprite_atlas if hasattr(frame, 'sprite_atlas') else None
+    regions = atlas.regions if atlas is not None and atlas.image else {}
+
+    objects_data = []
+    for obj in frame.game_objects.all():
+        region = regions.get(str(obj.id))
+        sprite = None
+        if region and obj.image and region['source'] == obj.image.name:
+            sprite = {key: region[key] for key in ('x', 'y', 'width', 'height')}
+        objects_data.append({
+            'id': obj.id,
+            'name': obj.name,
+            'image': build_file_url(request, obj.image),
+            'sprite': sprite,
+            'position_x': obj.position_x,
+            'position_y': obj.position_y,
+            'animation': obj.animation,
+            'animation_speed': obj.animation_speed,
+            'animation_direction': obj.animation_direction,
+            'dialogues': [{
+                'id': dialogue.id,
+                'text': dialogue.text,
+                'height': dialogue.height,
+                'width': dialogue.width,
+                'position_x': dialogue.position_x,
+                'position_y': dialogue.position_y
+            } for dialogue in obj.dialogues.all()]
+        })
+
+    quiz_data = None
+    if hasattr(frame, 'quiz'):
+        quiz = frame.quiz
+        quiz_data = {
+            'id': quiz.id,
+            'question': quiz.question,
+            'options': [{
+                'id': option.id,
+                'text': option.text,
+                'is_correct': option.is_correct,
+                'explanation': option.explanation,
+                'height': option.height,
+                'width': option.width,
+                'position_x': option.position_x,
+                'position_y': option.position_y
+            } for option in quiz.options.all()],
+            'height': quiz.height,
+            'width': quiz.width,
+            'position_x': quiz.position_x,
+            'position_y': quiz.position_y
+        }
+
+    return {
+        'id': frame.id,
+        'lesson': frame.lesson_id,
+        'name': frame.name,
+        'frame_type': frame.frame_type,
+        'background': frame.background_id,
+        'color': frame.color,
+        'height': frame.height,
+        'width': frame.width,
+        'order': frame.order,
+        'previous_frame': frame.previous_frame_id,
+        'next_frame': next_frame_id,
+        'atlas': {
+            'image': build_file_url(request, atlas.image),
+            'width': atlas.width,
+            'height': atlas.height,
+        } if any(obj['sprite'] for obj in objects_data) else None,
+        'objects': objects_data,
+        'quiz': quiz_data
+    }
+
+
+def build_lesson_bundle(lesson, request, sequence='order'):
+    """Every frame of a lesson with the backgrounds it uses, for playback in a single response"""
+    frames = list(lesson_frames_queryset(lesson))
+    if sequence == 'chain':
+        # Chain problems are reported by the sequence endpoint, playback only needs the order
+        frames = resolve_frame_chain(frames)[0]
+
+    next_frame_ids = {
+        frame.previous_frame_id: frame.id for frame in frames if frame.previous_frame_id}
+
+    backgrounds = {}
+    for frame in frames:
+        background = frame.background
+        if background is not None and background.id not in backgrounds:
+            backgrounds[background.id] = {
+                'id': background.id,
+                'name': background.name,
+                'image': build_file_url(request, background.image),
+                'description': background.description,
+            }
+
+    return {
+        'lesson': {
+            'id': lesson.id,
+            'name': lesson.name,
+            'slug': lesson.slug,
+        },
+        'sequence': sequence,
+        'frame_count': len(frames),
+        'backgrounds': list(backgrounds.values()),
+        'frames': [serialize_frame(frame, request, next_frame_ids.get(frame.id)) for frame in frames],
+    }
+
+
+def _lesson_version_key(lesson_id):
+    return f'game:lesson:{lesson_id}:version'
+
+
+def _lesson_slug_key(slug):
+    return f'game:lesson-slug:{slug}'
+
+
+def lesson_content_version(lesson_id):
+    """Random token that changes every time the lesson's game content changes"""
+    key = _lesson_version_key(lesson_id)
+    version = cache.get(key)
+    if version is None:
+        # A lost version must never bring back content compiled before it was lost
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_lesson_content(lesson_id):
+    cache.set(_lesson_version_key(lesson_id), uuid.uuid4().hex, None)
+
+
+def invalidate_lesson_slug(slug):
+    if slug:
+        cache.delete(_lesson_slug_key(slug))
+
+
+def get_cached_lesson(slug):
+    """Lesson id, name and slug for a slug, or None when no lesson has it"""
+    key = _lesson_slug_key(slug)
+    lesson = cache.get(key)
+    if lesson is None:
+        lesson = Lesson.objects.filter(slug=slug).values('id', 'name', 'slug').first()
+        if lesson is None:
+            return None
+        cache.set(key, lesson, settings.GAME_CONTENT_CACHE_TIMEOUT)
+    return Lesson(**lesson)
+
+
+def get_compiled_lesson(lesson, request, sequence='order'):
+    """Playback bundle of a lesson and its content hash, compiled once per content version.
+
+    The version is read before compiling, so a bundle built while an edit
+    commits is stored under the old version and never served again.
+    """
+    version = lesson_content_version(lesson.id)
+    base_url = hashlib.sha1(request.build_absolute_uri('/').encode()).hexdigest()[:12]
+    key = f'game:lesson:{lesson.id}:{version}:{sequence}:{base_url}'
+
+    compiled = cache.get(key)
+    if compiled is None:
+        data = build_lesson_bundle(lesson, request, sequence)
+        encoded = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+        compiled = {
+            'hash': hashlib.sha256(encoded.encode()).hexdigest(),
+            'data': data,
+        }
+        cache.set(key, compiled, settings.GAME_CONTENT_CACHE_TIMEOUT)
+    return compiled
+
+
+def etag_matches(request, etag):
+    """Whether the request's If-None-Match header already names this ETag"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
@@ -0,0 +1,362 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import bitmap
+from .leaderboards import schedule_leaderboard_points, schedule_leaderboard_refresh
+from .models import UserProgress
+from .resume import invalidate_resume
+from .rollups import schedule_rollup_completions, schedule_rollup_refresh
+from .sequence import get_frame_positions, get_sequence_frame_ids
+
+logger = logging.getLogger(__name__)
+
+
+def new_change():
+    """Pending changes of one learner in one lesson"""
+    return {'current_frame': None, 'scored': [], 'completed': []}
+
+
+def mirror_completions(progress_frames):
+    """Copy completions to the completed_frames table, for readers of the old many-to-many.
+
+    progress_frames is a list of (progress id, frame id).
+    """
+    if not settings.GAME_PROGRESS_MIRROR_M2M or not progress_frames:
+        return
+    completed_model = UserProgress.completed_frames.through
+    completed_model.objects.bulk_create([
+        completed_model(userprogress_id=progress_id, frame_id=frame_id)
+        for progress_id, frame_id in progress_frames
+    ], ignore_conflicts=True)
+
+
+def completed_frame_ids(progress, frame_ids=None):
+    """Ids of the frames a progress row has completed, in sequence order.
+
+    frame_ids are the lesson's frame ids in sequence order, when the
+    caller already has them.
+    """
+    if frame_ids is None:
+        frame_ids = get_sequence_frame_ids(progress.lesson_id)
+    return [frame_ids[position - 1] for position in bitmap.positions(progress.completed_bitmap)
+            if position <= len(frame_ids)]
+
+
+PROGRESS_FIELDS = [
+    'id', 'user', 'lesson', 'current_frame', 'completed_frames',
+    'completed_count', 'percent_complete', 'score', 'last_interaction',
+]
+
+
+def progress_data(progress, frame_ids=None):
+    """Progress in the shape returned by the progress endpoints"""
+    if frame_ids is None:
+        frame_ids = get_sequence_frame_ids(progress.lesson_id)
+    frame_count = len(frame_ids)
+    return {
+        'id': progress.id,
+        'user': progress.user_id,
+        'lesson': progress.lesson_id,
+        'current_frame': progress.current_frame_id,
+        'completed_frames': completed_frame_ids(progress, frame_ids),
+        'completed_count': progress.completed_count,
+        'percent_complete': round(100 * progress.completed_count / frame_count, 1) if frame_count else 0,
+        'score': progress.score,
+        'last_interaction': progress.last_interaction,
+    }
+
+
+def parse_fields(value):
+    """Progress fields asked for in a comma separated fields parameter, None for all of them.
+
+    Raises ValueError naming the fields that do not exist.
+    """
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in PROGRESS_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def select_fields(data, fields):
+    return data if fields is None else {field: data[field] for field in fields}
+
+
+def set_completed_frames(progress, frame_ids, replace=False):
+    """Mark frames completed on a progress row, or make them the only completed frames.
+
+    Frames outside the lesson's sequence are ignored. The bitmap is not
+    saved, the many-to-many mirror is written at once.
+    """
+    positions = get_frame_positions(progress.lesson_id)
+    frame_ids = [frame_id for frame_id in {int(frame_id) for frame_id in frame_ids} if frame_id in positions]
+    done = b'' if replace else progress.completed_bitmap
+    progress.completed_bitmap = bitmap.add_positions(done, [positions[frame_id] for frame_id in frame_ids])
+    progress.completed_count = bitmap.count(progress.completed_bitmap)
+    if settings.GAME_PROGRESS_MIRROR_M2M:
+        if replace:
+            progress.completed_frames.set(frame_ids)
+        else:
+            progress.completed_frames.add(*frame_ids)
+
+
+# Concurrent answers make the conditional update of a row miss, it is read again
+MAX_APPLY_ATTEMPTS = 5
+
+
+def _apply_change(done, change, lesson_positions):
+    """Bitmap after a change, the frames it newly completes and those of them it scores"""
+    added = []
+    scored = set()
+    # A quiz frame scores once, the first time it is answered correctly
+    for frame_id in change['scored'] + change['completed']:
+        position = lesson_positions.get(frame_id)
+        if position is None or bitmap.has_position(done, position):
+            continue
+        if frame_id in change['scored']:
+            scored.add(frame_id)
+        done = bitmap.add_positions(done, [position])
+        added.append(frame_id)
+    return done, added, scored
+
+
+def apply_progress_changes(changes):
+    """Write coalesced progress changes in one transaction.
+
+    changes maps (user_id, lesson_id) to a change from new_change(). The
+    rows are read in one query and each is written with a conditional
+    update, as online scoring does. A scored frame adds a point only when
+    it was not completed before, the completed frames are just marked done. Frames outside the lesson's
+    sequence are skipped. Returns the progress rows and the frames that
+    were scored, both by (user_id, lesson_id).
+    """
+    user_ids = {user_id for user_id, lesson_id in changes}
+    lesson_ids = {lesson_id for user_id, lesson_id in changes}
+    positions = {lesson_id: get_frame_positions(lesson_id) for lesson_id in lesson_ids}
+    now = timezone.now()
+
+    with transaction.atomic():
+        progresses = {
+            (progress.user_id, progress.lesson_id): progress
+            for progress in UserProgress.objects.filter(user_id__in=user_ids, lesson_id__in=lesson_ids)
+            if (progress.user_id, progress.lesson_id) in changes
+        }
+        missing = [UserProgress(user_id=user_id, lesson_id=lesson_id, score=0)
+                   for user_id, lesson_id in changes if (user_id, lesson_id) not in progresses]
+        for progress in UserProgress.objects.bulk_create(missing):
+            progresses[(progress.user_id, progress.lesson_id)] = progress
+
+        scored = {}
+        completed = {}
+        new_completions = []
+        for key, change in changes.items():
+            progress = progresses[key]
+            for attempt in range(MAX_APPLY_ATTEMPTS):
+                stored = bitmap.to_bytes(progress.completed_bitmap)
+                done, added, scored[key] = _apply_change(stored, change, positions[key[1]])
+                fields = {'current_frame_id': change['current_frame']} if change['current_frame'] else {}
+                # Like online scoring, the row is only written while its bitmap is the one read,
+                # so a concurrent answer never loses its frame or has it scored twice
+                if UserProgress.objects.filter(id=progress.id, completed_bitmap=stored).update(
+                        completed_bitmap=done,
+                        completed_count=bitmap.count(done),
+                        score=F('score') + len(scored[key]),
+                        last_interaction=now,
+                        **fields):
+                    break
+                progress.refresh_from_db(fields=['completed_bitmap'])
+            else:
+                raise RuntimeError(f'Progress {progress.id} kept changing while it was written')
+            progress.completed_bitmap = done
+            progress.completed_count = bitmap.count(done)
+            progress.current_frame_id = change['current_frame'] or progress.current_frame_id
+            new_completions.extend((progress.id, frame_id) for frame_id in added)
+            completed[key] = len(added)
+
+        mirror_completions(new_completions)
+        # New rows get their first leaderboard entries and rollups from a full refresh,
+        # the others move by their points and completed frames
+        created_users = {progress.user_id for progress in missing}
+        schedule_leaderboard_refresh(created_users)
+        schedule_rollup_refresh(user_ids=created_users)
+        schedule_leaderboard_points({key: len(frames) for key, frames in scored.items() if key[0] not in created_users})
+        schedule_rollup_completions({key: count for key, count in completed.items() if key[0] not in created_users})
+        invalidate_resume(user_ids)
+
+    return progresses, scored
+
+
+class ProgressBuffer:
+    """Collects correct answers in memory and writes them in coalesced batches.
+
+    Used when GAME_PROGRESS_WRITE_BEHIND is on, so busy sessions take the
+    database write lock once per batch instead of once per answer. A batch
+    is written when GAME_PROGRESS_FLUSH_SIZE answers are waiting or
+    GAME_PROGRESS_FLUSH_INTERVAL seconds after the first one. The buffer
+    belongs to one process, other worker processes only see its answers
+    once they are written.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._changes = {}
+        self._flushing = {}
+        self._size = 0
+        self._timer = None
+
+    def add(self, user_id, lesson_id, frame_id):
+        with self._lock:
+            change = self._changes.setdefault((user_id, lesson_id), new_change())
+            change['scored'].append(frame_id)
+            change['current_frame'] = frame_id
+            self._size += 1
+            flush_now = self._size >= settings.GAME_PROGRESS_FLUSH_SIZE
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(settings.GAME_PROGRESS_FLUSH_INTERVAL, self._flush_in_thread)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def pending(self, user_id, lesson_id):
+        """Changes of a learner in a lesson that are not written yet, or None"""
+        key = (user_id, lesson_id)
+        with self._lock:
+            found = [changes[key] for changes in (self._flushing, self._changes) if key in changes]
+        if not found:
+            return None
+        merged = new_change()
+        for change in found:
+            merged['scored'].extend(change['scored'])
+            merged['completed'].extend(change['completed'])
+            merged['current_frame'] = change['current_frame'] or merged['current_frame']
+        return merged
+
+    def flush(self):
+        """Write everything waiting, putting it back if the write fails"""
+        # One batch at a time, so a frame is never scored by two batches at once
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                changes, self._changes, self._size = self._changes, {}, 0
+                # Reads keep seeing the batch until it is committed
+                self._flushing = changes
+            if not changes:
+                return
+            try:
+                apply_progress_changes(changes)
+            except Exception:
+                logger.exception("Writing %d buffered progress changes failed", len(changes))
+                with self._lock:
+                    for key, change in changes.items():
+                        waiting = self._changes.setdefault(key, new_change())
+                        waiting['scored'][:0] = change['scored']
+                        waiting['current_frame'] = waiting['current_frame'] or change['current_frame']
+                        self._size += len(change['scored'])
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            # Already logged, the changes wait for the next flush
+            pass
+        finally:
+            connections.close_all()
+
+
+progress_buffer = ProgressBuffer()
+atexit.register(progress_buffer.flush)
+
+
+def flush_progress_buffer():
+    """Write buffered answers before reading or overwriting progress directly"""
+    if settings.GAME_PROGRESS_WRITE_BEHIND:
+        progress_buffer.flush()
+
+
+def with_pending_progress(data):
+    """Serialized progress with the learner's unwritten answers from this process added"""
+    if not settings.GAME_PROGRESS_WRITE_BEHIND:
+        return data
+    change = progress_buffer.pending(data['user'], data['lesson'])
+    if change is None:
+        return data
+
+    completed = list(data['completed_frames'])
+    added = 0
+    for frame_id in change['scored']:
+        if frame_id not in completed:
+            completed.append(frame_id)
+            added += 1
+    completed_count = data['completed_count'] + added
+    frame_count = len(get_sequence_frame_ids(data['lesson']))
+    return {
+        **data,
+        'current_frame': change['current_frame'] or data['current_frame'],
+        'completed_frames': completed,
+        'completed_count': completed_count,
+        'percent_complete': round(100 * completed_count / frame_count, 1) if frame_count else 0,
+        'score': data['score'] + added,
+    }
+
+
+def with_pending_resume(lessons, user_id):
+    """Resume list of a learner with their unwritten answers from this process added.
+
+    Lessons the buffered answers finish leave the list.
+    """
+    if not settings.GAME_PROGRESS_WRITE_BEHIND:
+        return lessons
+    changes = {}
+    for lesson in lessons:
+        change = progress_buffer.pending(user_id, lesson['lesson']['id'])
+        if change is not None:
+            changes[lesson['lesson']['id']] = change
+    if not changes:
+        return lessons
+
+    # Buffered frames are counted against the stored completions, read together
+    # with the score so a batch committing meanwhile is counted once
+    stored = {
+        row['lesson_id']: row for row in UserProgress.objects.filter(
+            user_id=user_id, lesson_id__in=changes).values('lesson_id', 'completed_bitmap', 'score')
+    }
+    merged = []
+    for lesson in lessons:
+        change = changes.get(lesson['lesson']['id'])
+        row = stored.get(lesson['lesson']['id'])
+        if change is None or row is None:
+            merged.append(lesson)
+            continue
+        positions = get_frame_positions(lesson['lesson']['id'])
+        done = set(bitmap.positions(row['completed_bitmap']))
+        added = {positions[frame_id] for frame_id in change['scored'] if frame_id in positions} - done
+        completed_count = len(done) + len(added)
+        frame_count = lesson['frame_count']
+        if frame_count and completed_count >= frame_count:
+            continue
+        current_frame = change['current_frame'] or lesson['current_frame']
+        merged.append({
+            **lesson,
+            'current_frame': current_frame,
+            'current_position': positions.get(current_frame, lesson['current_position']),
+            'completed_count': completed_count,
+            'percent_complete': round(100 * completed_count / frame_count, 1) if frame_count else 0,
+            'score': row['score'] + len(added),
+        })
+    return merged
@@ -0,0 +1,69 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import UserProgress
+
+
+def _resume_key(user_id):
+    return f'game:user:{user_id}:resume'
+
+
+def invalidate_resume(user_ids):
+    """Drop the cached resume lists of learners once the current transaction commits"""
+    keys = [_resume_key(user_id) for user_id in set(user_ids) if user_id]
+    if keys:
+        transaction.on_commit(partial(cache.delete_many, keys))
+
+
+def resume_lessons(user_id):
+    """Lessons a learner started and has not finished, most recently played first.
+
+    One query joins the lesson, its place in the curriculum, its frame
+    count and the position of the current frame. The list is cached until
+    the learner's progress changes, curriculum renames show up within
+    GAME_RESUME_CACHE_TIMEOUT.
+    """
+    key = _resume_key(user_id)
+    lessons = cache.get(key)
+    if lessons is not None:
+        return lessons
+
+    rows = UserProgress.objects.filter(user_id=user_id).order_by('-last_interaction').values(
+        'lesson_id', 'lesson__name', 'lesson__slug',
+        'lesson__chapter_name_id', 'lesson__chapter_name__name',
+        'lesson__chapter_name__subject_name_id', 'lesson__chapter_name__subject_name__name',
+        'lesson__chapter_name__subject_name__class_name_id',
+        'lesson__chapter_name__subject_name__class_name__name',
+        'lesson__frame_sequence__frame_count',
+        'current_frame_id', 'current_frame__sequence_entry__position',
+        'completed_count', 'score', 'last_interaction',
+    )
+    lessons = []
+    for row in rows:
+        frame_count = row['lesson__frame_sequence__frame_count'] or 0
+        if frame_count and row['completed_count'] >= frame_count:
+            continue
+        lessons.append({
+            'lesson': {'id': row['lesson_id'], 'name': row['lesson__name'], 'slug': row['lesson__slug']},
+            'chapter': {'id': row['lesson__chapter_name_id'], 'name': row['lesson__chapter_name__name']},
+            'subject': {
+                'id': row['lesson__chapter_name__subject_name_id'],
+                'name': row['lesson__chapter_name__subject_name__name'],
+            },
+            'class': {
+                'id': row['lesson__chapter_name__subject_name__class_name_id'],
+                'name': row['lesson__chapter_name__subject_name__class_name__name'],
+            },
+            'current_frame': row['current_frame_id'],
+            'current_position': row['current_frame__sequence_entry__position'],
+            'frame_count': frame_count,
+            'completed_count': row['completed_count'],
+            'percent_complete': round(100 * row['completed_count'] / frame_count, 1) if frame_count else 0,
+            'score': row['score'],
+            'last_interaction': row['last_interaction'],
+        })
+    cache.set(key, lessons, settings.GAME_RESUME_CACHE_TIMEOUT)
+    return lessons
@@ -0,0 +1,91 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from course.models import Question
+from .models import ReviewItem
+
+MIN_EASE = 1.3
+# Days until the first and second review after a lapse, later ones grow by the ease
+FIRST_INTERVALS = [1, 3]
+
+
+def schedule_review(user_id, question_id, is_correct, answered_at=None):
+    """Reschedule a question after a learner answered it.
+
+    A wrong answer puts the question in the learner's queue, due again
+    after GAME_REVIEW_RELEARN_MINUTES. Each correct answer after that
+    pushes it further out, and once the interval reaches
+    GAME_REVIEW_GRADUATE_DAYS the question leaves the queue. Correct
+    answers to questions not in the queue change nothing.
+    """
+    now = answered_at or timezone.now()
+    item = ReviewItem.objects.filter(user_id=user_id, question_id=question_id).first()
+    if item is None:
+        if is_correct:
+            return None
+        try:
+            # Savepoint, a concurrent wrong answer may have added the item first
+            with transaction.atomic():
+                return ReviewItem.objects.create(
+                    user_id=user_id, question_id=question_id, lapses=1, last_answered_at=now,
+                    due_at=now + datetime.timedelta(minutes=settings.GAME_REVIEW_RELEARN_MINUTES))
+        except IntegrityError:
+            item = ReviewItem.objects.get(user_id=user_id, question_id=question_id)
+
+    if is_correct:
+        item.streak += 1
+        if item.streak <= len(FIRST_INTERVALS):
+            item.interval_days = FIRST_INTERVALS[item.streak - 1]
+        else:
+            item.interval_days = round(item.interval_days * item.ease, 1)
+        if item.interval_days >= settings.GAME_REVIEW_GRADUATE_DAYS:
+            item.delete()
+            return None
+        item.due_at = now + datetime.timedelta(days=item.interval_days)
+    else:
+        item.streak = 0
+        item.lapses += 1
+        item.interval_days = 0
+        item.ease = max(MIN_EASE, item.ease - 0.2)
+        item.due_at = now + datetime.timedelta(minutes=settings.GAME_REVIEW_RELEARN_MINUTES)
+    item.last_answered_at = now
+    item.save()
+    return item
+
+
+def due_reviews(user_id, limit=10):
+    """Questions due for review, most overdue first, with their options.
+
+    Reads the head of the learner's queue from the (user, due_at) index,
+    the learner's answer history is never scanned.
+    """
+    now = timezone.now()
+    items = list(ReviewItem.objects.filter(user_id=user_id, due_at__lte=now).order_by(
+        'due_at').values('question_id', 'due_at', 'streak', 'lapses')[:limit])
+    questions = Question.objects.filter(id__in=[item['question_id'] for item in items]).prefetch_related('options')
+    questions = {question.id: question for question in questions}
+
+    reviews = []
+    for item in items:
+        question = questions[item['question_id']]
+        reviews.append({
+            'question': {
+                'id': question.id,
+                'lesson': question.lesson_id,
+                'question_text': question.question_text,
+                # Correctness stays hidden, answers go through answer validation
+                'options': [{'id': option.id, 'option': option.option} for option in question.options.all()],
+            },
+            'due_at': item['due_at'],
+            'streak': item['streak'],
+            'lapses': item['lapses'],
+        })
+
+    next_due_at = None
+    if len(items) < limit:
+        next_due_at = ReviewItem.objects.filter(user_id=user_id, due_at__gt=now).order_by(
+            'due_at').values_list('due_at', flat=True).first()
+    return {'reviews': reviews, 'next_due_at': next_due_at}
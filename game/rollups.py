@@ -0,0 +1,195 @@
+import threading
+from collections import Counter
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from course.models import Chapter, Lesson, Subject
+from .models import CompletionRollup, FrameSequence, UserProgress
+
+# Path from a lesson up to the curriculum level of each rollup scope
+LESSON_PATHS = {
+    'chapter': 'chapter_name_id',
+    'subject': 'chapter_name__subject_name_id',
+    'class': 'chapter_name__subject_name__class_name_id',
+}
+SCOPES = list(LESSON_PATHS)
+
+_pending = threading.local()
+
+
+def _pending_refreshes():
+    if not hasattr(_pending, 'users'):
+        _pending.users = set()
+        _pending.totals = set()
+    return _pending
+
+
+def schedule_rollup_refresh(user_ids=(), totals=()):
+    """Refresh rollups once the current transaction commits.
+
+    user_ids are learners whose completed frames changed. totals are
+    (scope, scope_id) whose number of frames changed, a chapter or subject
+    also refreshes the levels above it.
+    """
+    pending = _pending_refreshes()
+    pending.users.update(user_id for user_id in user_ids if user_id)
+    pending.totals.update(key for key in totals if key[1])
+    transaction.on_commit(_run_rollup_refresh)
+
+
+def _run_rollup_refresh():
+    pending = _pending_refreshes()
+    user_ids, pending.users = pending.users, set()
+    totals, pending.totals = pending.totals, set()
+    # Totals first, new rows of the learners below then start from them
+    if totals:
+        refresh_rollup_totals(totals)
+    for user_id in user_ids:
+        refresh_learner_rollups(user_id)
+
+
+def scope_totals(keys):
+    """Frames in each (scope, scope_id), summed over the sequences of its lessons"""
+    totals = {key: 0 for key in keys}
+    for scope, path in LESSON_PATHS.items():
+        ids = {scope_id for key_scope, scope_id in keys if key_scope == scope}
+        if not ids:
+            continue
+        rows = FrameSequence.objects.filter(**{f'lesson__{path}__in': ids}).values(
+            f'lesson__{path}').annotate(total=Sum('frame_count')).values_list(f'lesson__{path}', 'total')
+        for scope_id, total in rows:
+            totals[(scope, scope_id)] = total or 0
+    return totals
+
+
+def refresh_rollup_totals(keys):
+    """Write new frame totals on every learner's rollup of the given scopes"""
+    keys = set(keys)
+    chapter_ids = [scope_id for scope, scope_id in keys if scope == 'chapter']
+    for subject_id, class_id in Chapter.objects.filter(id__in=chapter_ids).values_list(
+            'subject_name_id', 'subject_name__class_name_id'):
+        keys.update({('subject', subject_id), ('class', class_id)})
+    subject_ids = [scope_id for scope, scope_id in keys if scope == 'subject']
+    keys.update(('class', class_id) for class_id in Subject.objects.filter(
+        id__in=subject_ids).values_list('class_name_id', flat=True))
+
+    for (scope, scope_id), total in scope_totals(keys).items():
+        CompletionRollup.objects.filter(scope=scope, scope_id=scope_id).exclude(
+            total_frames=total).update(total_frames=total, updated_at=timezone.now())
+
+
+def schedule_rollup_completions(completions):
+    """Add newly completed frames to the rollups once the current transaction commits.
+
+    Like the leaderboard points, they are added in a transaction of their
+    own and dropped with a transaction that rolls back.
+    """
+    completions = {key: count for key, count in completions.items() if count}
+    if completions:
+        transaction.on_commit(partial(_run_rollup_completions, completions))
+
+
+def _run_rollup_completions(completions):
+    with transaction.atomic():
+        add_rollup_completions(completions)
+
+
+def add_rollup_completions(completions):
+    """Add newly completed frames to learners' chapter, subject and class rollups.
+
+    completions maps (user_id, lesson_id) to the number of frames just
+    completed. The learner's rollup rows are incremented in place. Call it
+    in a transaction, usually through schedule_rollup_completions. Learners
+    missing a rollup row get a full refresh after the commit.
+    """
+    completions = {key: count for key, count in completions.items() if count}
+    if not completions:
+        return
+    paths = {lesson_id: scope_ids for lesson_id, *scope_ids in Lesson.objects.filter(
+        id__in={lesson_id for _, lesson_id in completions}).values_list('id', *LESSON_PATHS.values())}
+    deltas = Counter()
+    for (user_id, lesson_id), count in completions.items():
+        for scope, scope_id in zip(SCOPES, paths.get(lesson_id, ())):
+            deltas[(user_id, scope, scope_id)] += count
+
+    groups = {}
+    for key, count in deltas.items():
+        groups.setdefault(count, []).append(key)
+    now = timezone.now()
+    for count, keys in groups.items():
+        condition = Q(pk__in=[])
+        for user_id, scope, scope_id in keys:
+            condition |= Q(user_id=user_id, scope=scope, scope_id=scope_id)
+        updated = CompletionRollup.objects.filter(condition).update(
+            completed_frames=F('completed_frames') + count, updated_at=now)
+        if updated < len(keys):
+            schedule_rollup_refresh(user_ids={user_id for user_id, _, _ in keys})
+
+
+def refresh_learner_rollups(user_id):
+    """Bring a learner's rollups in line with their progress rows"""
+    with transaction.atomic():
+        completed = Counter()
+        for *scope_ids, completed_count in UserProgress.objects.filter(user_id=user_id).values_list(
+                *[f'lesson__{path}' for path in LESSON_PATHS.values()], 'completed_count'):
+            for scope, scope_id in zip(SCOPES, scope_ids):
+                completed[(scope, scope_id)] += completed_count
+
+        rollups = {(rollup.scope, rollup.scope_id): rollup
+                   for rollup in CompletionRollup.objects.filter(user_id=user_id)}
+        CompletionRollup.objects.filter(
+            id__in=[rollup.id for key, rollup in rollups.items() if key not in completed]).delete()
+
+        now = timezone.now()
+        changed = []
+        for key, rollup in rollups.items():
+            if key in completed and rollup.completed_frames != completed[key]:
+                rollup.completed_frames = completed[key]
+                rollup.updated_at = now
+                changed.append(rollup)
+        CompletionRollup.objects.bulk_update(changed, ['completed_frames', 'updated_at'])
+
+        # Existing rows keep their totals, those follow frame changes on their own
+        totals = scope_totals([key for key in completed if key not in rollups])
+        CompletionRollup.objects.bulk_create([
+            CompletionRollup(user_id=user_id, scope=scope, scope_id=scope_id,
+                             completed_frames=completed[(scope, scope_id)], total_frames=total)
+            for (scope, scope_id), total in totals.items()
+        ])
+
+
+def rebuild_completion_rollups():
+    """Recompute every learner's rollups from UserProgress, returns the number of rows"""
+    completed = Counter()
+    rows = UserProgress.objects.values_list(
+        'user_id', *[f'lesson__{path}' for path in LESSON_PATHS.values()], 'completed_count')
+    for user_id, *scope_ids, completed_count in rows.iterator():
+        for scope, scope_id in zip(SCOPES, scope_ids):
+            completed[(user_id, scope, scope_id)] += completed_count
+
+    totals = scope_totals({(scope, scope_id) for user_id, scope, scope_id in completed})
+    with transaction.atomic():
+        CompletionRollup.objects.all().delete()
+        CompletionRollup.objects.bulk_create([
+            CompletionRollup(user_id=user_id, scope=scope, scope_id=scope_id,
+                             completed_frames=completed_frames, total_frames=totals[(scope, scope_id)])
+            for (user_id, scope, scope_id), completed_frames in completed.items()
+        ], batch_size=1000)
+    return len(completed)
+
+
+def completion_dashboard(user_id):
+    """A learner's completion of every chapter, subject and class they started, in one query"""
+    dashboard = {scope: [] for scope in SCOPES}
+    for rollup in CompletionRollup.objects.filter(user_id=user_id).order_by('scope', 'scope_id'):
+        dashboard[rollup.scope].append({
+            'id': rollup.scope_id,
+            'completed_frames': rollup.completed_frames,
+            'total_frames': rollup.total_frames,
+            'percent_complete': round(100 * rollup.completed_frames / rollup.total_frames, 1)
+            if rollup.total_frames else 0,
+        })
+    return dashboard
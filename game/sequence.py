@@ -0,0 +1,174 @@
+from django.core.cache import cache
+from django.db import transaction
+
+from course.models import Lesson
+from . import bitmap
+from .models import Frame, FrameSequence, FrameSequenceEntry, UserProgress
+from .resume import invalidate_resume
+from .rollups import schedule_rollup_refresh
+
+
+def resolve_frame_chain(frames):
+    """Walk the previous_frame links of one lesson's frames.
+
+    Returns the frames in playback order and a dict describing where the
+    chain is broken. Chains are played head first, the main chain before
+    any extra ones, and frames caught in a cycle go last in Frame.order.
+    """
+    frames_by_order = sorted(frames, key=lambda f: (f.order, f.id))
+    frame_ids = {frame.id for frame in frames}
+    next_by_id = {}
+    heads = []
+    orphans = []
+    for frame in frames_by_order:
+        if frame.previous_frame_id in frame_ids:
+            next_by_id[frame.previous_frame_id] = frame
+        elif frame.previous_frame_id is None:
+            heads.append(frame)
+        else:
+            orphans.append(frame)
+
+    ordered = []
+    seen = set()
+    for head in heads + orphans:
+        frame = head
+        while frame is not None and frame.id not in seen:
+            seen.add(frame.id)
+            ordered.append(frame)
+            frame = next_by_id.get(frame.id)
+
+    cycles = [frame for frame in frames_by_order if frame.id not in seen]
+    ordered.extend(cycles)
+
+    issues = {
+        'cycle_frames': [frame.id for frame in cycles],
+        'orphan_frames': [frame.id for frame in orphans],
+        'fork_frames': [frame.id for frame in heads[1:]],
+    }
+    issues['is_consistent'] = not any(issues.values())
+    issues['matches_order'] = [f.id for f in ordered] == [f.id for f in frames_by_order]
+    return ordered, issues
+
+
+def _frame_ids_key(lesson_id):
+    return f'game:lesson:{lesson_id}:frame-ids'
+
+
+def remap_completed_bitmaps(lesson_id, old_positions, new_positions):
+    """Move completion bits of a lesson's learners to the frames' new positions.
+
+    Bits of frames that left the lesson are dropped. Returns the learners
+    whose number of completed frames changed.
+    """
+    moved = {old: new_positions.get(frame_id) for frame_id, old in old_positions.items()}
+    progresses = []
+    changed_users = set()
+    for progress in UserProgress.objects.filter(lesson_id=lesson_id).exclude(
+            completed_bitmap=b'').only('id', 'user_id', 'completed_bitmap', 'completed_count').iterator(chunk_size=500):
+        progress.completed_bitmap = bitmap.from_positions(
+            moved[position] for position in bitmap.positions(progress.completed_bitmap)
+            if moved.get(position))
+        completed_count = bitmap.count(progress.completed_bitmap)
+        if completed_count != progress.completed_count:
+            changed_users.add(progress.user_id)
+        progress.completed_count = completed_count
+        progresses.append(progress)
+    UserProgress.objects.bulk_update(
+        progresses, ['completed_bitmap', 'completed_count'], batch_size=500)
+    return changed_users
+
+
+def rebuild_frame_sequence(lesson_id):
+    """Recompute the stored sequence of a lesson from its frames.
+
+    Completion bitmaps follow the frames when their positions change, and
+    completion rollups follow the number of frames.
+    """
+    chapter_id = Lesson.objects.filter(id=lesson_id).values_list('chapter_name_id', flat=True).first()
+    if chapter_id is None:
+        return None
+
+    frames = list(Frame.objects.filter(lesson_id=lesson_id).only(
+        'id', 'previous_frame', 'order'))
+    ordered, issues = resolve_frame_chain(frames)
+    new_positions = {frame.id: index + 1 for index, frame in enumerate(ordered)}
+
+    with transaction.atomic():
+        # Entries of deleted frames are already gone, the stored count still includes them
+        old_frame_count = FrameSequence.objects.filter(lesson_id=lesson_id).values_list(
+            'frame_count', flat=True).first()
+        old_positions = dict(FrameSequenceEntry.objects.filter(
+            sequence__lesson_id=lesson_id).values_list('frame_id', 'position'))
+        sequence, created = FrameSequence.objects.update_or_create(
+            lesson_id=lesson_id,
+            defaults={'frame_count': len(ordered), **issues}
+        )
+        if old_frame_count != len(ordered):
+            schedule_rollup_refresh(totals=[('chapter', chapter_id)])
+        if not created:
+            # A deleted last frame leaves the other positions alone but not its completion bits
+            if old_positions != new_positions or old_frame_count != len(ordered):
+                changed_users = remap_completed_bitmaps(lesson_id, old_positions, new_positions)
+                schedule_rollup_refresh(user_ids=changed_users)
+                invalidate_resume(changed_users)
+            sequence.entries.all().delete()
+        FrameSequenceEntry.objects.bulk_create([
+            FrameSequenceEntry(
+                sequence=sequence,
+                frame_id=frame.id,
+                position=index + 1,
+                previous_frame_id=ordered[index - 1].id if index > 0 else None,
+                next_frame_id=ordered[index + 1].id if index + 1 < len(ordered) else None
+            )
+            for index, frame in enumerate(ordered)
+        ])
+    cache.set(_frame_ids_key(lesson_id), [frame.id for frame in ordered], None)
+    return sequence
+
+
+def get_frame_sequence(lesson_id):
+    """Stored sequence of a lesson, built on first use"""
+    try:
+        return FrameSequence.objects.get(lesson_id=lesson_id)
+    except FrameSequence.DoesNotExist:
+        return rebuild_frame_sequence(lesson_id)
+
+
+def get_sequence_frame_ids(lesson_id):
+    """Frame ids of a lesson in sequence order, cached until the sequence is rebuilt"""
+    frame_ids = cache.get(_frame_ids_key(lesson_id))
+    if frame_ids is None:
+        sequence = get_frame_sequence(lesson_id)
+        frame_ids = list(sequence.entries.values_list('frame_id', flat=True)) if sequence else []
+        cache.set(_frame_ids_key(lesson_id), frame_ids, None)
+    return frame_ids
+
+
+def get_sequence_frame_ids_many(lesson_ids):
+    """Frame ids in sequence order of several lessons, by lesson id.
+
+    Lessons not in the cache are loaded together in one query, only a
+    lesson that never had its sequence built costs a rebuild.
+    """
+    keys = {_frame_ids_key(lesson_id): lesson_id for lesson_id in set(lesson_ids)}
+    frame_ids = {keys[key]: ids for key, ids in cache.get_many(list(keys)).items()}
+    missing = [lesson_id for lesson_id in keys.values() if lesson_id not in frame_ids]
+    if not missing:
+        return frame_ids
+
+    loaded = {lesson_id: [] for lesson_id in FrameSequence.objects.filter(
+        lesson_id__in=missing).values_list('lesson_id', flat=True)}
+    for lesson_id, frame_id in FrameSequenceEntry.objects.filter(sequence__lesson_id__in=missing).order_by(
+            'sequence_id', 'position').values_list('sequence__lesson_id', 'frame_id'):
+        loaded[lesson_id].append(frame_id)
+    cache.set_many({_frame_ids_key(lesson_id): ids for lesson_id, ids in loaded.items()}, None)
+    frame_ids.update(loaded)
+    for lesson_id in missing:
+        if lesson_id not in frame_ids:
+            frame_ids[lesson_id] = get_sequence_frame_ids(lesson_id)
+    return frame_ids
+
+
+def get_frame_positions(lesson_id):
+    """Sequence position of each frame of a lesson, by frame id"""
+    return {frame_id: index + 1 for index, frame_id in enumerate(get_sequence_frame_ids(lesson_id))}
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Background, Frame, GameObject, Dialogue, Quiz, QuizOption, UserProgress
+from .progress import progress_data
 
 
 class BackgroundSerializer(serializers.ModelSerializer):
@@ -53,8 +54,17 @@ class FrameSerializer(serializers.ModelSerializer):
 
 
 class UserProgressSerializer(serializers.ModelSerializer):
+    completed_frames = serializers.SerializerMethodField()
+    percent_complete = serializers.SerializerMethodField()
+
     class Meta:
         model = UserProgress
-        fields = ['id', 'user', 'lesson', 'current_frame',
-                  'completed_frames', 'score', 'last_interaction']
-        read_only_fields = ['last_interaction']
+        fields = ['id', 'user', 'lesson', 'current_frame', 'completed_frames',
+                  'completed_count', 'percent_complete', 'score', 'last_interaction']
+        read_only_fields = ['completed_count', 'last_interaction']
+
+    def get_completed_frames(self, obj):
+        return progress_data(obj)['completed_frames']
+
+    def get_percent_complete(self, obj):
+        return progress_data(obj)['percent_complete']
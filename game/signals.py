@@ -0,0 +1,239 @@
+import threading
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from account.models import CustomUser
+from course.models import Chapter, Lesson, Subject
+from .models import Background, Frame, GameObject, Dialogue, Quiz, QuizOption, UserProgress
+from .assets import rebuild_asset_manifest
+from .atlas import queue_frame_atlases
+from .leaderboards import remove_learner, schedule_leaderboard_refresh
+from .resume import invalidate_resume
+from .rollups import schedule_rollup_refresh
+from .playback import invalidate_lesson_content, invalidate_lesson_slug
+from .sequence import rebuild_frame_sequence
+
+_pending = threading.local()
+
+
+def _pending_refreshes():
+    if not hasattr(_pending, 'lessons'):
+        _pending.lessons = {}
+    return _pending.lessons
+
+
+def schedule_lesson_refresh(lesson_id, sequence=False, assets=False):
+    """Refresh derived game data of a lesson once the current transaction commits.
+
+    Several changes to the same lesson inside one transaction are
+    collapsed into a single refresh.
+    """
+    if not lesson_id:
+        return
+    kinds = _pending_refreshes().setdefault(lesson_id, set())
+    kinds.add('content')
+    if sequence:
+        kinds.add('sequence')
+    if sequence or assets:
+        kinds.add('assets')
+    transaction.on_commit(partial(_run_lesson_refresh, lesson_id))
+
+
+def _run_lesson_refresh(lesson_id):
+    kinds = _pending_refreshes().pop(lesson_id, None)
+    if kinds is None:
+        return
+    if 'sequence' in kinds:
+        rebuild_frame_sequence(lesson_id)
+    # Asset order follows the sequence, so it is rebuilt after it
+    if 'assets' in kinds:
+        rebuild_asset_manifest(lesson_id)
+        queue_frame_atlases(lesson_id)
+    invalidate_lesson_content(lesson_id)
+
+
+def schedule_lessons_refresh(lesson_ids, assets=False):
+    for lesson_id in set(lesson_ids):
+        schedule_lesson_refresh(lesson_id, assets=assets)
+
+
+# Frames
+
+@receiver(pre_save, sender=Frame)
+def frame_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    # A frame moved to another lesson leaves a gap in the old one
+    old_lesson_id = Frame.objects.filter(pk=instance.pk).values_list(
+        'lesson_id', flat=True).first()
+    if old_lesson_id != instance.lesson_id:
+        schedule_lesson_refresh(old_lesson_id, sequence=True)
+
+
+@receiver(post_save, sender=Frame)
+def frame_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_lesson_refresh(instance.lesson_id, sequence=True)
+
+
+@receiver(pre_delete, sender=Frame)
+def frame_pre_delete(sender, instance, **kwargs):
+    # The next frame loses its previous_frame link, possibly in another lesson
+    for lesson_id in Frame.objects.filter(previous_frame=instance).values_list('lesson_id', flat=True):
+        schedule_lesson_refresh(lesson_id, sequence=True)
+
+
+@receiver(post_delete, sender=Frame)
+def frame_deleted(sender, instance, **kwargs):
+    schedule_lesson_refresh(instance.lesson_id, sequence=True)
+
+
+# Objects, dialogues and quizzes belong to a frame
+
+@receiver(pre_save, sender=GameObject)
+@receiver(pre_save, sender=Dialogue)
+@receiver(pre_save, sender=Quiz)
+def frame_content_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    # Content moved to another frame may leave another lesson
+    schedule_lessons_refresh(
+        sender.objects.filter(pk=instance.pk).values_list('frame__lesson_id', flat=True),
+        assets=sender is GameObject)
+
+
+@receiver(post_save, sender=GameObject)
+@receiver(post_save, sender=Dialogue)
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=GameObject)
+@receiver(post_delete, sender=Dialogue)
+@receiver(post_delete, sender=Quiz)
+def frame_content_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_lessons_refresh(
+        Frame.objects.filter(id=instance.frame_id).values_list('lesson_id', flat=True),
+        assets=sender is GameObject)
+
+
+# Quiz options are shared through Quiz.options
+
+@receiver(post_save, sender=QuizOption)
+@receiver(pre_delete, sender=QuizOption)
+def quiz_option_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_lessons_refresh(
+        Frame.objects.filter(quiz__options=instance).values_list('lesson_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Quiz.options.through)
+def quiz_options_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # instance is a QuizOption, pk_set holds quizzes
+        frames = Frame.objects.filter(quiz__options=instance) if action == 'pre_clear' \
+            else Frame.objects.filter(quiz__in=pk_set or [])
+    else:
+        frames = Frame.objects.filter(quiz=instance)
+    schedule_lessons_refresh(frames.values_list('lesson_id', flat=True))
+
+
+# Backgrounds are shared between frames
+
+@receiver(post_save, sender=Background)
+@receiver(pre_delete, sender=Background)
+def background_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_lessons_refresh(
+        Frame.objects.filter(background=instance).values_list('lesson_id', flat=True),
+        assets=True)
+
+
+# Lessons carry the name and slug of the bundle
+
+@receiver(pre_save, sender=Lesson)
+def lesson_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    old_slug, old_chapter_id = Lesson.objects.filter(pk=instance.pk).values_list(
+        'slug', 'chapter_name_id').first() or (None, None)
+    transaction.on_commit(partial(invalidate_lesson_slug, old_slug))
+    # The lesson's scores and frames move to another chapter
+    if old_chapter_id is not None and old_chapter_id != instance.chapter_name_id:
+        user_ids = list(UserProgress.objects.filter(lesson_id=instance.pk).values_list('user_id', flat=True))
+        schedule_leaderboard_refresh(user_ids)
+        schedule_rollup_refresh(
+            user_ids=user_ids, totals=[('chapter', old_chapter_id), ('chapter', instance.chapter_name_id)])
+
+
+@receiver(post_save, sender=Lesson)
+def lesson_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_lesson_refresh(instance.id)
+
+
+@receiver(post_delete, sender=Lesson)
+def lesson_deleted(sender, instance, **kwargs):
+    transaction.on_commit(partial(invalidate_lesson_slug, instance.slug))
+    schedule_lesson_refresh(instance.id)
+    schedule_rollup_refresh(totals=[('chapter', instance.chapter_name_id)])
+
+
+# Chapters and subjects moving up the curriculum take their rollups along
+
+@receiver(pre_save, sender=Chapter)
+def chapter_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    old_subject_id, old_class_id = Chapter.objects.filter(pk=instance.pk).values_list(
+        'subject_name_id', 'subject_name__class_name_id').first() or (None, None)
+    if old_subject_id is not None and old_subject_id != instance.subject_name_id:
+        schedule_rollup_refresh(
+            user_ids=UserProgress.objects.filter(lesson__chapter_name_id=instance.pk).values_list(
+                'user_id', flat=True).distinct(),
+            totals=[('chapter', instance.pk), ('subject', old_subject_id), ('class', old_class_id)])
+
+
+@receiver(pre_save, sender=Subject)
+def subject_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    old_class_id = Subject.objects.filter(pk=instance.pk).values_list('class_name_id', flat=True).first()
+    if old_class_id is not None and old_class_id != instance.class_name_id:
+        schedule_rollup_refresh(
+            user_ids=UserProgress.objects.filter(lesson__chapter_name__subject_name_id=instance.pk).values_list(
+                'user_id', flat=True).distinct(),
+            totals=[('subject', instance.pk), ('class', old_class_id)])
+
+
+# Leaderboards, rollups and resume lists follow progress, leaderboards also the learner's organization
+
+@receiver(post_save, sender=UserProgress)
+@receiver(post_delete, sender=UserProgress)
+def progress_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_leaderboard_refresh([instance.user_id])
+        schedule_rollup_refresh(user_ids=[instance.user_id])
+        invalidate_resume([instance.user_id])
+
+
+@receiver(pre_save, sender=CustomUser)
+def user_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    old_organization_id = CustomUser.objects.filter(pk=instance.pk).values_list(
+        'organization_id', flat=True).first()
+    if old_organization_id != instance.organization_id:
+        schedule_leaderboard_refresh([instance.pk])
+
+
+@receiver(pre_delete, sender=CustomUser)
+def user_pre_delete(sender, instance, **kwargs):
+    # Entries go with the user, their score buckets have to be emptied first
+    remove_learner(instance.pk)
@@ -0,0 +1,300 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .images import queue_image_derivatives
+from .models import Background, Frame, GameObject, Dialogue, Quiz, QuizOption
+from .signals import schedule_lesson_refresh
+
+FRAME_TYPES = [choice[0] for choice in Frame.FRAME_TYPES]
+
+FRAME_FIELDS = {'color': None, 'height': 100, 'width': 100, 'order': 0}
+OBJECT_FIELDS = {'position_x': 0, 'position_y': 0, 'animation': None,
+                 'animation_speed': 1, 'animation_direction': None}
+LAYOUT_FIELDS = {'height': 100, 'width': 100, 'position_x': 0, 'position_y': 0}
+DECIMAL_FIELDS = {'height', 'width', 'position_x', 'position_y', 'animation_speed'}
+
+
+class StoryboardError(Exception):
+    """Raised with the list of per-item errors when a storyboard cannot be imported"""
+
+    def __init__(self, errors):
+        super().__init__('Storyboard has errors')
+        self.errors = errors
+
+
+def _copy_fields(data, defaults, path, errors):
+    values = {}
+    for field, default in defaults.items():
+        value = data.get(field, default)
+        if field in DECIMAL_FIELDS and value is not None:
+            try:
+                value = Decimal(str(value))
+            except InvalidOperation:
+                errors.append({'path': f'{path}.{field}', 'error': 'Must be a number'})
+                continue
+        elif field == 'order':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                errors.append({'path': f'{path}.{field}', 'error': 'Must be an integer'})
+                continue
+        values[field] = value
+    return values
+
+
+def _list_field(data, field, path, errors):
+    """Items of a nested list field, an error and no items when it is not a list"""
+    items = data.get(field) or []
+    if not isinstance(items, list):
+        errors.append({'path': f'{path}.{field}', 'error': 'Must be a list'})
+        return []
+    return items
+
+
+def validate_storyboard(lesson, frames_data, files, replace=False):
+    """Check a whole storyboard and resolve its references without writing anything.
+
+    Returns the frames as plain dicts ready for bulk insertion, or raises
+    StoryboardError listing every problem found with its path.
+    """
+    errors = []
+    if not isinstance(frames_data, list) or not frames_data:
+        raise StoryboardError([{'path': 'frames', 'error': 'At least one frame is required'}])
+
+    refs = {}
+    for index, frame_data in enumerate(frames_data):
+        if not isinstance(frame_data, dict):
+            errors.append({'path': f'frames[{index}]', 'error': 'Frame must be an object'})
+            continue
+        ref = frame_data.get('ref')
+        if ref is not None:
+            if ref in refs:
+                errors.append({'path': f'frames[{index}].ref', 'error': f"Duplicate ref '{ref}'"})
+            refs[ref] = index
+    if errors:
+        raise StoryboardError(errors)
+
+    # Existing rows referenced by the storyboard, one query per model
+    background_ids = {f['background'] for f in frames_data if f.get('background')}
+    existing_backgrounds = set(Background.objects.filter(
+        id__in=background_ids).values_list('id', flat=True))
+    previous_ids = {f['previous_frame'] for f in frames_data if f.get('previous_frame')}
+    existing_previous = dict(Frame.objects.filter(
+        id__in=previous_ids).values_list('id', 'lesson_id'))
+    taken_previous = set(Frame.objects.filter(
+        previous_frame_id__in=previous_ids).values_list('previous_frame_id', flat=True))
+
+    resolved = []
+    linked = set()
+    for index, frame_data in enumerate(frames_data):
+        path = f'frames[{index}]'
+        frame_type = frame_data.get('frame_type', 'background')
+        if frame_type not in FRAME_TYPES:
+            errors.append({'path': f'{path}.frame_type',
+                           'error': f"Must be one of: {', '.join(FRAME_TYPES)}"})
+
+        background_id = frame_data.get('background')
+        if background_id and background_id not in existing_backgrounds:
+            errors.append({'path': f'{path}.background', 'error': 'Background not found'})
+
+        # A frame follows either an existing frame or another frame of the storyboard
+        previous_id = frame_data.get('previous_frame')
+        previous_ref = frame_data.get('previous_ref')
+        if previous_id and previous_ref is not None:
+            errors.append({'path': path, 'error': 'Give previous_frame or previous_ref, not both'})
+        elif previous_id:
+            if previous_id not in existing_previous:
+                errors.append({'path': f'{path}.previous_frame', 'error': 'Previous frame not found'})
+            elif replace and existing_previous[previous_id] == lesson.id:
+                errors.append({'path': f'{path}.previous_frame',
+                               'error': 'Previous frame is removed by replace'})
+            elif previous_id in taken_previous or ('id', previous_id) in linked:
+                errors.append({'path': f'{path}.previous_frame',
+                               'error': 'Previous frame already has a next frame'})
+            linked.add(('id', previous_id))
+        elif previous_ref is not None:
+            if previous_ref not in refs:
+                errors.append({'path': f'{path}.previous_ref', 'error': f"Unknown ref '{previous_ref}'"})
+            elif refs[previous_ref] == index:
+                errors.append({'path': f'{path}.previous_ref', 'error': 'A frame cannot follow itself'})
+            elif ('ref', previous_ref) in linked:
+                errors.append({'path': f'{path}.previous_ref',
+                               'error': 'Previous frame already has a next frame'})
+            linked.add(('ref', previous_ref))
+
+        frame = {
+            'name': frame_data.get('name', ''),
+            'frame_type': frame_type,
+            'background_id': background_id or None,
+            'previous_frame_id': previous_id or None,
+            'previous_index': refs.get(previous_ref),
+            **_copy_fields(frame_data, FRAME_FIELDS, path, errors),
+            'objects': [],
+            'quiz': None,
+        }
+
+        for obj_index, object_data in enumerate(_list_field(frame_data, 'objects', path, errors)):
+            obj_path = f'{path}.objects[{obj_index}]'
+            if not isinstance(object_data, dict):
+                errors.append({'path': obj_path, 'error': 'Object must be an object'})
+                continue
+            name = object_data.get('name')
+            if not name:
+                errors.append({'path': f'{obj_path}.name', 'error': 'Name is required'})
+                continue
+
+            # Images are multipart files named by the object, as in frame create
+            image_key = object_data.get('image') or f'object_image_{name}'
+            image = files.get(image_key)
+            if object_data.get('image') and image is None:
+                errors.append({'path': f'{obj_path}.image', 'error': f"File '{image_key}' not uploaded"})
+
+            dialogues = []
+            for dialogue_index, dialogue_data in enumerate(_list_field(object_data, 'dialogues', obj_path, errors)):
+                dialogue_path = f'{obj_path}.dialogues[{dialogue_index}]'
+                if isinstance(dialogue_data, str):
+                    dialogue_data = {'text': dialogue_data}
+                elif not isinstance(dialogue_data, dict):
+                    errors.append({'path': dialogue_path, 'error': 'Dialogue must be text or an object'})
+                    continue
+                if not dialogue_data.get('text'):
+                    errors.append({'path': f'{dialogue_path}.text', 'error': 'Text is required'})
+                    continue
+                dialogues.append({
+                    'text': dialogue_data['text'],
+                    **_copy_fields(dialogue_data, LAYOUT_FIELDS, dialogue_path, errors),
+                })
+
+            frame['objects'].append({
+                'name': name,
+                'image': image,
+                **_copy_fields(object_data, OBJECT_FIELDS, obj_path, errors),
+                'dialogues': dialogues,
+            })
+
+        quiz_data = frame_data.get('quiz')
+        if quiz_data:
+            quiz_path = f'{path}.quiz'
+            if frame_type != 'quiz':
+                errors.append({'path': quiz_path, 'error': "Only quiz frames can have a quiz"})
+            elif not isinstance(quiz_data, dict):
+                errors.append({'path': quiz_path, 'error': 'Quiz must be an object'})
+            elif not quiz_data.get('question'):
+                errors.append({'path': f'{quiz_path}.question', 'error': 'Question is required'})
+            else:
+                options = []
+                for option_index, option_data in enumerate(_list_field(quiz_data, 'options', quiz_path, errors)):
+                    option_path = f'{quiz_path}.options[{option_index}]'
+                    if not isinstance(option_data, dict):
+                        errors.append({'path': option_path, 'error': 'Option must be an object'})
+                        continue
+                    if not option_data.get('text'):
+                        errors.append({'path': f'{option_path}.text', 'error': 'Text is required'})
+                        continue
+                    options.append({
+                        'text': option_data['text'],
+                        'is_correct': bool(option_data.get('is_correct', False)),
+                        'explanation': option_data.get('explanation', ''),
+                        **_copy_fields(option_data, LAYOUT_FIELDS, option_path, errors),
+                    })
+                frame['quiz'] = {
+                    'question': quiz_data['question'],
+                    **_copy_fields(quiz_data, LAYOUT_FIELDS, quiz_path, errors),
+                    'options': options,
+                }
+
+        resolved.append(frame)
+
+    if errors:
+        raise StoryboardError(errors)
+    return resolved
+
+
+def import_storyboard(lesson, frames_data, files, replace=False):
+    """Write a validated storyboard into a lesson in one transaction with bulk inserts.
+
+    Returns the created frames in payload order with their objects and quiz.
+    """
+    resolved = validate_storyboard(lesson, frames_data, files, replace)
+
+    with transaction.atomic():
+        if replace:
+            Frame.objects.filter(lesson=lesson).delete()
+
+        frames = Frame.objects.bulk_create([
+            Frame(
+                lesson=lesson,
+                name=frame['name'],
+                frame_type=frame['frame_type'],
+                background_id=frame['background_id'],
+                previous_frame_id=frame['previous_frame_id'],
+                color=frame['color'],
+                height=frame['height'],
+                width=frame['width'],
+                order=frame['order'],
+            )
+            for frame in resolved
+        ])
+
+        # Links inside the storyboard need the ids of the frames just inserted
+        linked_frames = []
+        for frame, data in zip(frames, resolved):
+            if data['previous_index'] is not None:
+                frame.previous_frame_id = frames[data['previous_index']].id
+                linked_frames.append(frame)
+        if linked_frames:
+            Frame.objects.bulk_update(linked_frames, ['previous_frame'])
+
+        objects = []
+        for frame, data in zip(frames, resolved):
+            for object_data in data['objects']:
+                objects.append(GameObject(
+                    frame=frame,
+                    name=object_data['name'],
+                    image=object_data['image'],
+                    **{field: object_data[field] for field in OBJECT_FIELDS},
+                ))
+        objects = GameObject.objects.bulk_create(objects)
+        for obj in objects:
+            queue_image_derivatives(obj.image)
+
+        dialogues = []
+        object_iter = iter(objects)
+        for frame, data in zip(frames, resolved):
+            for object_data in data['objects']:
+                obj = next(object_iter)
+                for dialogue_data in object_data['dialogues']:
+                    dialogues.append(Dialogue(frame=frame, game_object=obj, **dialogue_data))
+        Dialogue.objects.bulk_create(dialogues)
+
+        quiz_frames = [(frame, data['quiz']) for frame, data in zip(frames, resolved) if data['quiz']]
+        quizzes = Quiz.objects.bulk_create([
+            Quiz(frame=frame, **{key: value for key, value in quiz_data.items() if key != 'options'})
+            for frame, quiz_data in quiz_frames
+        ])
+        options = QuizOption.objects.bulk_create([
+            QuizOption(**option_data)
+            for frame, quiz_data in quiz_frames for option_data in quiz_data['options']
+        ])
+        option_iter = iter(options)
+        Quiz.options.through.objects.bulk_create([
+            Quiz.options.through(quiz_id=quiz.id, quizoption_id=next(option_iter).id)
+            for quiz, (frame, quiz_data) in zip(quizzes, quiz_frames) for _ in quiz_data['options']
+        ])
+
+        # Bulk writes send no signals, refresh the lesson once for the whole import
+        schedule_lesson_refresh(lesson.id, sequence=True)
+
+    quiz_by_frame = {quiz.frame_id: quiz.id for quiz in quizzes}
+    object_iter = iter(objects)
+    created = []
+    for frame, data in zip(frames, resolved):
+        created.append({
+            'id': frame.id,
+            'ref': frames_data[len(created)].get('ref'),
+            'previous_frame': frame.previous_frame_id,
+            'objects': [next(object_iter).id for _ in data['objects']],
+            'quiz': quiz_by_frame.get(frame.id),
+        })
+    return created
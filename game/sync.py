@@ -0,0 +1,190 @@
+from django.db import IntegrityError, transaction
+
+from course.models import Lesson
+from .answer_log import parse_latency, record_answer
+from .answers import get_answer_key
+from .models import Frame, ProgressEvent, UserProgress
+from .progress import apply_progress_changes, flush_progress_buffer, new_change, progress_data
+
+EVENT_TYPES = [choice[0] for choice in ProgressEvent.EVENT_TYPES]
+MAX_EVENTS = 500
+# A sync racing another one with the same events plans its batch again
+MAX_SYNC_ATTEMPTS = 3
+
+
+class SyncError(Exception):
+    """Raised with the list of per-event errors when a sync batch is malformed"""
+
+    def __init__(self, errors):
+        super().__init__('Sync batch has errors')
+        self.errors = errors
+
+
+def _int_field(data, field, path, errors, required=True):
+    value = data.get(field)
+    if value is None:
+        if required:
+            errors.append({'path': f'{path}.{field}', 'error': 'This field is required'})
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        errors.append({'path': f'{path}.{field}', 'error': 'Must be an integer'})
+        return None
+
+
+def validate_events(events_data):
+    """Check the shape of a batch and return its events as plain dicts, in order"""
+    if not isinstance(events_data, list):
+        raise SyncError([{'path': 'events', 'error': 'Events must be a list'}])
+    if len(events_data) > MAX_EVENTS:
+        raise SyncError([{'path': 'events', 'error': f'At most {MAX_EVENTS} events per sync'}])
+
+    errors = []
+    events = []
+    for index, data in enumerate(events_data):
+        path = f'events[{index}]'
+        if not isinstance(data, dict):
+            errors.append({'path': path, 'error': 'Event must be an object'})
+            continue
+
+        event_id = data.get('id')
+        if not isinstance(event_id, str) or not event_id or len(event_id) > 64:
+            errors.append({'path': f'{path}.id', 'error': 'Must be a string of 1 to 64 characters'})
+        event_type = data.get('type')
+        if event_type not in EVENT_TYPES:
+            errors.append({'path': f'{path}.type', 'error': f"Must be one of: {', '.join(EVENT_TYPES)}"})
+            continue
+
+        event = {'id': event_id, 'type': event_type}
+        if event_type == 'frame_viewed':
+            event['frame'] = _int_field(data, 'frame', path, errors)
+        elif event_type == 'quiz_answered':
+            event['quiz'] = _int_field(data, 'quiz', path, errors)
+            event['option'] = _int_field(data, 'option', path, errors)
+            event['latency_ms'] = parse_latency(data.get('latency_ms'))
+        else:
+            event['lesson'] = _int_field(data, 'lesson', path, errors)
+            event['frame'] = _int_field(data, 'frame', path, errors, required=False)
+        events.append(event)
+
+    if errors:
+        raise SyncError(errors)
+    return events
+
+
+def _plan_events(user, events, seen, frames, answer_keys, lessons):
+    """Outcome of each event and the changes of those not seen yet"""
+    results = []
+    changes = {}
+    scored_results = []
+    new_events = []
+    answered = []
+    for event in events:
+        result = {'id': event['id'], 'status': 'applied'}
+        results.append(result)
+        if event['id'] in seen:
+            result['status'] = 'duplicate'
+            continue
+        seen.add(event['id'])
+
+        lesson_id = frame_id = None
+        completes = scores = False
+        if event['type'] == 'quiz_answered':
+            answers = answer_keys[event['quiz']]
+            option = answers['options'].get(event['option']) if answers else None
+            if option is None:
+                result.update(status='ignored', error='Quiz or option not found')
+                continue
+            lesson_id, frame_id = answers['lesson'], answers['frame']
+            completes = scores = option['is_correct']
+            result.update(is_correct=option['is_correct'], scored=False)
+        else:
+            if event.get('frame') is not None:
+                if event['frame'] not in frames:
+                    result.update(status='ignored', error='Frame not found')
+                    continue
+                frame_id = event['frame']
+                lesson_id, frame_type = frames[frame_id]
+                completes = event['type'] == 'frame_viewed' and frame_type != 'quiz'
+            if event['type'] == 'lesson_resumed':
+                if event['lesson'] not in lessons or (frame_id and lesson_id != event['lesson']):
+                    result.update(status='ignored', error='Lesson not found or frame not in lesson')
+                    continue
+                lesson_id = event['lesson']
+
+        if lesson_id is None:
+            result.update(status='ignored', error='Frame is not part of a lesson')
+            continue
+
+        change = changes.setdefault((user.id, lesson_id), new_change())
+        if frame_id:
+            change['current_frame'] = frame_id
+        if completes:
+            change['completed'].append(frame_id)
+        if scores:
+            change['scored'].append(frame_id)
+            scored_results.append(((user.id, lesson_id), frame_id, result))
+        new_events.append(ProgressEvent(
+            user=user, event_id=event['id'], event_type=event['type'], lesson_id=lesson_id))
+        if event['type'] == 'quiz_answered':
+            answered.append(event)
+    return results, changes, scored_results, new_events, answered
+
+
+def sync_progress(user, events_data):
+    """Apply a batch of client events to a learner's progress in one transaction.
+
+    Events already applied, in this batch or an earlier sync, are skipped,
+    so clients can resend a batch until it is acknowledged. Viewing a frame
+    completes it, except quiz frames which are completed by a correct
+    answer. Returns the outcome of each event and the merged progress of
+    every lesson the batch touched.
+    """
+    events = validate_events(events_data)
+
+    # Everything the batch refers to is loaded up front, one query per model
+    frame_ids = {event['frame'] for event in events if event.get('frame')}
+    frames = {frame_id: (lesson_id, frame_type) for frame_id, lesson_id, frame_type in
+              Frame.objects.filter(id__in=frame_ids).values_list('id', 'lesson_id', 'frame_type')}
+    answer_keys = {quiz_id: get_answer_key(quiz_id) for quiz_id in
+                   {event['quiz'] for event in events if event['type'] == 'quiz_answered'}}
+    lesson_ids = {event['lesson'] for event in events if event['type'] == 'lesson_resumed'}
+    lessons = set(Lesson.objects.filter(id__in=lesson_ids).values_list('id', flat=True))
+
+    # Answers still buffered by the write-behind mode must not be scored twice
+    flush_progress_buffer()
+    for attempt in range(MAX_SYNC_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                seen = set(ProgressEvent.objects.filter(
+                    user=user, event_id__in=[event['id'] for event in events]).values_list('event_id', flat=True))
+                results, changes, scored_results, new_events, answered = _plan_events(
+                    user, events, seen, frames, answer_keys, lessons)
+                # The events are claimed before anything is applied. A concurrent sync of the
+                # same events makes the insert fail, and this one plans again with them seen
+                ProgressEvent.objects.bulk_create(new_events)
+                progresses, scored = apply_progress_changes(changes)
+            break
+        except IntegrityError:
+            if attempt + 1 == MAX_SYNC_ATTEMPTS:
+                raise
+
+    # Synced answers go to the answer log like answers validated online
+    for event in answered:
+        answers = answer_keys[event['quiz']]
+        record_answer(
+            user.id, event['option'], answers['options'][event['option']]['is_correct'],
+            quiz_id=event['quiz'], lesson_id=answers['lesson'], latency_ms=event['latency_ms'])
+
+    # Only the first correct answer to a quiz frame in the batch scores
+    for key, frame_id, result in scored_results:
+        result['scored'] = frame_id in scored[key]
+        scored[key].discard(frame_id)
+
+    # Scores were updated in the database, read back the merged rows
+    merged = UserProgress.objects.filter(id__in=[progress.id for progress in progresses.values()])
+    return {
+        'events': results,
+        'progress': [progress_data(progress) for progress in merged],
+    }
@@ -1,3 +1,1275 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from account.models import CustomUser, Organization
+from course.models import Chapter, Class, Lesson, Question, QuestionOption, Subject
+from .answer_log import AnswerLog, answer_log, answer_period
+from . import progress as progress_module, sync
+from .answers import score_correct_answer
+from .assets import get_asset_manifest
+from .atlas import PADDING, pack_sprites
+from .images import MAX_ATTEMPTS, claim_next_job, derivative_widths, process_image_job, queue_image_derivatives
+from .item_analysis import run_item_analysis
+from .leaderboards import rebuild_leaderboards
+from .models import (
+    AnswerEvent, Background, CompletionRollup, Dialogue, Frame, FrameSequence, FrameSpriteAtlas, GameObject,
+    ImageDerivative, ImageDerivativeJob, ItemStatistics, LeaderboardEntry, LeaderboardScore, ProgressEvent, Quiz,
+    QuizOption, ReviewItem, UserProgress,
+)
+from .progress import completed_frame_ids, progress_buffer
+from .reviews import MIN_EASE, schedule_review
+from .rollups import rebuild_completion_rollups
+from .sequence import get_sequence_frame_ids
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GAME_ANSWER_LOG_BACKGROUND_FLUSH=False)
+class GameTestCase(TestCase):
+    """A learner of an organization and a chapter with one lesson, on a private cache.
+
+    The answer log is written in tearDown, while the test database still exists.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(
+            name='School', email='school@example.com', phone_number='1', address='Street 1')
+        self.learner = self.create_user('learner')
+        self.class_obj = Class.objects.create(name='Class 8')
+        self.subject = Subject.objects.create(class_name=self.class_obj, name='Science')
+        self.chapter = Chapter.objects.create(subject_name=self.subject, name='Light')
+        self.lesson = self.create_lesson('Reflection')
+        self.client = APIClient()
+
+    def tearDown(self):
+        answer_log.flush()
+
+    def create_user(self, username, **fields):
+        fields.setdefault('organization', self.organization)
+        return CustomUser.objects.create_user(
+            username=username, email=f'{username}@example.com', password='secret', user_type='learner', **fields)
+
+    def create_lesson(self, name, chapter=None):
+        return Lesson.objects.create(chapter_name=chapter or self.chapter, name=name)
+
+    def create_frames(self, lesson, count, frame_type='quiz'):
+        """A chain of frames, each quiz frame with a correct and a wrong option"""
+        frames = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(count):
+                frame = Frame.objects.create(
+                    lesson=lesson, name=f'Frame {index + 1}', frame_type=frame_type, order=index + 1,
+                    previous_frame=frames[-1] if frames else None)
+                if frame_type == 'quiz':
+                    quiz = Quiz.objects.create(frame=frame, question=f'Question {index + 1}')
+                    quiz.options.add(
+                        QuizOption.objects.create(text='Right', is_correct=True),
+                        QuizOption.objects.create(text='Wrong', is_correct=False))
+                frames.append(frame)
+        return frames
+
+    def correct_option(self, frame):
+        return frame.quiz.options.get(is_correct=True)
+
+    def answer(self, user, frame, correct=True):
+        """Validate an answer to a frame's quiz as the user, running the deferred work"""
+        option = frame.quiz.options.get(is_correct=correct)
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/validate-quiz-answer/', {'quiz_id': frame.quiz.id, 'option_id': option.id},
+                                    format='json')
+
+
+class LessonFunnelViewTests(GameTestCase):
+    def test_funnel_counts_learners_per_frame(self):
+        frames = self.create_frames(self.lesson, 3)
+        self.answer(self.learner, frames[0])
+        self.answer(self.create_user('other'), frames[0])
+        self.answer(self.create_user('third'), frames[1])
+
+        self.client.force_authenticate(self.create_user('staff', is_staff=True))
+        response = self.client.get(f'/api/lessons/{self.lesson.slug}/game/funnel/')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['learners'], 3)
+        self.assertEqual([step['reached'] for step in response.data['steps']], [3, 1, 0])
+        self.assertEqual([step['stopped'] for step in response.data['steps']], [2, 1, 0])
+
+    def test_unknown_lesson_is_not_found(self):
+        self.client.force_authenticate(self.create_user('staff', is_staff=True))
+        response = self.client.get('/api/lessons/missing/game/funnel/')
+        self.assertEqual(response.status_code, 404)
+
+
+class OrganizationProgressExportTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        frames = self.create_frames(self.lesson, 2)
+        self.answer(self.learner, frames[0])
+        self.create_user('idle')
+        self.client.force_authenticate(self.create_user('staff', is_staff=True, organization=None))
+
+    def export(self, **params):
+        response = self.client.get(f'/api/organizations/{self.organization.id}/progress-export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        lines = self.export(export_format='csv').splitlines()
+        self.assertTrue(lines[0].startswith('cursor,user_id,username'))
+        # The learner with progress and the one without
+        self.assertEqual(len(lines), 3)
+        self.assertIn(',learner,', lines[1])
+
+    def test_json_lines_export(self):
+        rows = [json.loads(line) for line in self.export(export_format='jsonl').splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['learner', 'idle'])
+        self.assertEqual((rows[0]['completed_frames'], rows[0]['total_frames']), (1, 2))
+
+    def test_export_resumes_after_a_cursor(self):
+        first = json.loads(self.export(export_format='jsonl').splitlines()[0])
+        rows = self.export(export_format='jsonl', after=first['cursor']).splitlines()
+        self.assertEqual([json.loads(row)['username'] for row in rows], ['idle'])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(
+            f'/api/organizations/{self.organization.id}/progress-export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_writes_json_lines(self):
+        out = StringIO()
+        call_command('export_organization_progress', self.organization.id, export_format='jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+@override_settings(GAME_PROGRESS_WRITE_BEHIND=True, GAME_PROGRESS_FLUSH_SIZE=100, GAME_PROGRESS_FLUSH_INTERVAL=3600)
+class ProgressBufferTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 3)
+
+    def tearDown(self):
+        # Nothing may be left for the timer or the exit flush
+        progress_buffer.flush()
+        super().tearDown()
+
+    def stored_score(self):
+        return UserProgress.objects.get(user=self.learner, lesson=self.lesson).score
+
+    def test_reads_include_answers_before_the_flush(self):
+        self.assertTrue(self.answer(self.learner, self.frames[0]).data['scored'])
+        self.assertEqual(self.stored_score(), 0)
+
+        self.client.force_authenticate(self.learner)
+        listed = self.client.get('/api/progress/').data['results']
+        self.assertEqual([(row['lesson'], row['score']) for row in listed], [(self.lesson.id, 1)])
+        self.assertEqual(listed[0]['completed_frames'], [self.frames[0].id])
+
+        detail = self.client.get(f"/api/progress/{listed[0]['id']}/")
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(detail.data['score'], 1)
+
+        resume = self.client.get('/api/progress/resume/').data
+        self.assertEqual([(row['lesson']['id'], row['completed_count']) for row in resume], [(self.lesson.id, 1)])
+
+    def test_resume_counts_a_batch_being_written_once(self):
+        self.answer(self.learner, self.frames[0])
+        progress_buffer.flush()
+        self.answer(self.learner, self.frames[1])
+
+        # Read while the batch with the second frame is written but not yet out of the buffer
+        resumes = []
+        apply_progress_changes = progress_module.apply_progress_changes
+
+        def apply_and_read(changes):
+            apply_progress_changes(changes)
+            resumes.append(self.client.get('/api/progress/resume/').data)
+
+        with mock.patch('game.progress.apply_progress_changes', side_effect=apply_and_read):
+            with self.captureOnCommitCallbacks(execute=True):
+                progress_buffer.flush()
+        self.assertEqual([(row['lesson']['id'], row['completed_count'], row['score']) for row in resumes[0]],
+                         [(self.lesson.id, 2, 2)])
+
+    def test_repeat_answer_is_not_scored_twice_before_the_flush(self):
+        self.answer(self.learner, self.frames[0])
+        self.assertFalse(self.answer(self.learner, self.frames[0]).data['scored'])
+        progress_buffer.flush()
+        self.assertEqual(self.stored_score(), 1)
+
+    @override_settings(GAME_PROGRESS_FLUSH_SIZE=2)
+    def test_flushes_when_the_size_is_reached(self):
+        self.answer(self.learner, self.frames[0])
+        self.assertEqual(self.stored_score(), 0)
+        self.answer(self.learner, self.frames[1])
+        self.assertEqual(self.stored_score(), 2)
+        self.assertIsNone(progress_buffer.pending(self.learner.id, self.lesson.id))
+
+    def test_failed_flush_puts_the_answers_back(self):
+        self.answer(self.learner, self.frames[0])
+        with mock.patch('game.progress.apply_progress_changes', side_effect=RuntimeError('database is locked')):
+            with self.assertRaises(RuntimeError):
+                progress_buffer.flush()
+        self.assertEqual(progress_buffer.pending(self.learner.id, self.lesson.id)['scored'], [self.frames[0].id])
+
+        progress_buffer.flush()
+        self.assertEqual(self.stored_score(), 1)
+        self.assertIsNone(progress_buffer.pending(self.learner.id, self.lesson.id))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GAME_PROGRESS_WRITE_BEHIND=True,
+                   GAME_PROGRESS_FLUSH_SIZE=100, GAME_PROGRESS_FLUSH_INTERVAL=0.1)
+class ProgressBufferTimerTests(TransactionTestCase):
+    def test_flushes_after_the_interval(self):
+        cache.clear()
+        learner = CustomUser.objects.create_user(username='learner', password='secret', user_type='learner')
+        chapter = Chapter.objects.create(
+            subject_name=Subject.objects.create(class_name=Class.objects.create(name='Class 8'), name='Science'),
+            name='Light')
+        lesson = Lesson.objects.create(chapter_name=chapter, name='Reflection')
+        frame = Frame.objects.create(lesson=lesson, frame_type='quiz')
+        progress = UserProgress.objects.create(user=learner, lesson=lesson)
+
+        # The timer writes from its own thread. Reading while it writes would hit a
+        # table lock of the shared in-memory test database, so wait for it to finish
+        flushed = threading.Event()
+        flush_in_thread = progress_buffer._flush_in_thread
+
+        def flush_and_signal():
+            flush_in_thread()
+            flushed.set()
+
+        with mock.patch.object(progress_buffer, '_flush_in_thread', flush_and_signal):
+            progress_buffer.add(learner.id, lesson.id, frame.id)
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(UserProgress.objects.get(id=progress.id).score, 1)
+
+
+class LeaderboardTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 4)
+        self.other = self.create_user('other')
+        self.third = self.create_user('third')
+
+    def snapshot(self):
+        return (
+            sorted(LeaderboardEntry.objects.values_list('scope', 'scope_id', 'user_id', 'score')),
+            sorted(LeaderboardScore.objects.values_list('scope', 'scope_id', 'score', 'learners')),
+        )
+
+    def test_answers_keep_entries_and_buckets_in_line_with_a_rebuild(self):
+        for user, answered in ((self.learner, 3), (self.other, 1), (self.third, 1)):
+            for frame in self.frames[:answered]:
+                self.answer(user, frame)
+        self.answer(self.third, self.frames[1], correct=False)
+        # A repeat answer adds nothing
+        self.answer(self.learner, self.frames[0])
+
+        incremental = self.snapshot()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertIn(('lesson', self.lesson.id, self.learner.id, 3), incremental[0])
+
+    @override_settings(GAME_PROGRESS_WRITE_BEHIND=True, GAME_PROGRESS_FLUSH_SIZE=100, GAME_PROGRESS_FLUSH_INTERVAL=3600)
+    def test_buffered_answers_move_the_boards_when_flushed(self):
+        self.answer(self.learner, self.frames[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            progress_buffer.flush()
+        for frame in self.frames[1:3]:
+            self.answer(self.learner, frame)
+        self.answer(self.other, self.frames[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            progress_buffer.flush()
+
+        incremental = self.snapshot()
+        rebuild_leaderboards()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertIn(('chapter', self.chapter.id, self.learner.id, 3), incremental[0])
+
+    def test_ranks_share_equal_scores(self):
+        self.answer(self.learner, self.frames[0])
+        self.answer(self.learner, self.frames[1])
+        self.answer(self.other, self.frames[0])
+        self.answer(self.third, self.frames[0])
+
+        self.client.force_authenticate(self.third)
+        response = self.client.get(f'/api/leaderboards/chapter/{self.chapter.id}/')
+        self.assertEqual(response.data['learners'], 3)
+        self.assertEqual([(entry['rank'], entry['score']) for entry in response.data['top']], [(1, 2), (2, 1), (2, 1)])
+        self.assertEqual((response.data['me']['rank'], response.data['me']['score']), (2, 1))
+
+    def test_organization_board_is_for_members(self):
+        self.client.force_authenticate(self.create_user('outsider', organization=None))
+        response = self.client.get(f'/api/leaderboards/organization/{self.organization.id}/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_scored_answer_does_not_recount_the_learner(self):
+        for frame in self.frames[:2]:
+            self.answer(self.learner, frame)
+        self.answer(self.other, self.frames[0])
+
+        self.client.force_authenticate(self.learner)
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/validate-quiz-answer/', {
+                    'quiz_id': self.frames[2].quiz.id, 'option_id': self.correct_option(self.frames[2]).id
+                }, format='json')
+        # One update per table and direction, not one per scope, and no reads of other progress rows
+        leaderboard_queries = [query['sql'] for query in queries.captured_queries if 'leaderboard' in query['sql']]
+        self.assertLessEqual(len(leaderboard_queries), 7, leaderboard_queries)
+        self.assertEqual(LeaderboardEntry.objects.get(scope='chapter', user=self.learner).score, 3)
+
+
+class ScoringTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 2)
+        self.answer(self.learner, self.frames[0])
+
+    def test_scoring_is_a_read_and_an_update(self):
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(2):
+            self.assertTrue(score_correct_answer(self.learner, self.lesson.id, self.frames[1].id))
+        # Leaderboards and rollups move once the scoring commits
+        self.assertEqual(LeaderboardEntry.objects.get(scope='lesson', user=self.learner).score, 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(LeaderboardEntry.objects.get(scope='lesson', user=self.learner).score, 2)
+        self.assertEqual(CompletionRollup.objects.get(user=self.learner, scope='chapter').completed_frames, 2)
+
+    def test_first_answer_creates_the_row_scored(self):
+        other = self.create_user('other')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(score_correct_answer(other, self.lesson.id, self.frames[1].id))
+        progress = UserProgress.objects.get(user=other, lesson=self.lesson)
+        self.assertEqual((progress.score, completed_frame_ids(progress)), (1, [self.frames[1].id]))
+        self.assertEqual(LeaderboardEntry.objects.get(scope='lesson', user=other).score, 1)
+
+
+class CompletionRollupTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 3)
+        self.second_lesson = self.create_lesson('Refraction')
+        self.second_frames = self.create_frames(self.second_lesson, 2)
+
+    def snapshot(self):
+        return sorted(CompletionRollup.objects.values_list('user_id', 'scope', 'scope_id', 'completed_frames', 'total_frames'))
+
+    def test_answers_keep_rollups_in_line_with_a_rebuild(self):
+        self.answer(self.learner, self.frames[0])
+        self.answer(self.learner, self.frames[1])
+        self.answer(self.learner, self.second_frames[0])
+        self.answer(self.create_user('other'), self.second_frames[1])
+
+        incremental = self.snapshot()
+        rebuild_completion_rollups()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertIn((self.learner.id, 'chapter', self.chapter.id, 3, 5), incremental)
+
+    def test_dashboard_reports_each_level(self):
+        self.answer(self.learner, self.frames[0])
+        self.client.force_authenticate(self.learner)
+        dashboard = self.client.get('/api/progress/rollups/').data
+        for scope, scope_id in (('chapter', self.chapter.id), ('subject', self.subject.id), ('class', self.class_obj.id)):
+            self.assertEqual(dashboard[scope], [
+                {'id': scope_id, 'completed_frames': 1, 'total_frames': 5, 'percent_complete': 20.0}])
+
+    def test_scored_answer_increments_the_rollups_in_one_update(self):
+        self.answer(self.learner, self.frames[0])
+        with CaptureQueriesContext(connection) as queries:
+            self.answer(self.learner, self.frames[1])
+        rollup_queries = [query['sql'] for query in queries.captured_queries if 'completionrollup' in query['sql']]
+        self.assertEqual(len(rollup_queries), 1, rollup_queries)
+        self.assertTrue(rollup_queries[0].startswith('UPDATE'))
+        self.assertEqual(CompletionRollup.objects.get(user=self.learner, scope='class').completed_frames, 2)
+
+
+class FrameSequenceTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 4)
+
+    def progress(self):
+        return UserProgress.objects.get(user=self.learner, lesson=self.lesson)
+
+    def delete_frame(self, frame):
+        with self.captureOnCommitCallbacks(execute=True):
+            frame.delete()
+
+    def test_sequence_follows_the_previous_frame_links(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # Frame 4 moves between frames 1 and 2
+            self.frames[1].previous_frame = None
+            self.frames[1].save()
+            self.frames[3].previous_frame = self.frames[0]
+            self.frames[3].save()
+            self.frames[1].previous_frame = self.frames[3]
+            self.frames[1].save()
+        self.assertEqual(get_sequence_frame_ids(self.lesson.id),
+                         [self.frames[0].id, self.frames[3].id, self.frames[1].id, self.frames[2].id])
+        sequence = FrameSequence.objects.get(lesson=self.lesson)
+        self.assertTrue(sequence.is_consistent)
+        self.assertFalse(sequence.matches_order)
+
+    def test_completions_follow_moved_frames(self):
+        self.answer(self.learner, self.frames[3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.frames[3].previous_frame = None
+            self.frames[3].order = 0
+            self.frames[3].save()
+            self.frames[0].previous_frame = self.frames[3]
+            self.frames[0].save()
+        self.assertEqual(get_sequence_frame_ids(self.lesson.id)[0], self.frames[3].id)
+        self.assertEqual(completed_frame_ids(self.progress()), [self.frames[3].id])
+
+    def test_deleting_a_frame_updates_completions_and_totals(self):
+        self.answer(self.learner, self.frames[1])
+        self.answer(self.learner, self.frames[2])
+        self.delete_frame(self.frames[1])
+
+        self.assertEqual(FrameSequence.objects.get(lesson=self.lesson).frame_count, 3)
+        progress = self.progress()
+        self.assertEqual(progress.completed_count, 1)
+        self.assertEqual(completed_frame_ids(progress), [self.frames[2].id])
+        self.assertEqual(CompletionRollup.objects.get(user=self.learner, scope='chapter').total_frames, 3)
+        self.assertEqual(CompletionRollup.objects.get(user=self.learner, scope='chapter').completed_frames, 1)
+
+    def test_deleting_the_last_frame_drops_its_completion(self):
+        self.answer(self.learner, self.frames[3])
+        self.delete_frame(self.frames[3])
+
+        self.assertEqual(self.progress().completed_count, 0)
+        self.assertEqual(CompletionRollup.objects.get(user=self.learner, scope='class').total_frames, 3)
+        # A frame added at the end is not completed already
+        self.create_frames(self.lesson, 1)
+        self.assertEqual(completed_frame_ids(self.progress()), [])
+
+
+class UserProgressAdminTests(GameTestCase):
+    def test_change_form_shows_completions_from_the_bitmap(self):
+        frames = self.create_frames(self.lesson, 3)
+        self.answer(self.learner, frames[1])
+        progress = UserProgress.objects.get(user=self.learner, lesson=self.lesson)
+        admin_user = self.create_user('admin', is_staff=True, is_superuser=True)
+
+        self.client.force_login(admin_user)
+        response = self.client.get(f'/admin/game/userprogress/{progress.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('completed_frames', response.context['adminform'].form.fields)
+        self.assertEqual(admin.site._registry[UserProgress].get_completed_frames(progress), str(frames[1].id))
+
+
+class LessonPlaybackTests(GameTestCase):
+    def create_scene(self, frame):
+        """A background and an object with a dialogue on the frame"""
+        frame.background = Background.objects.create(name=f'Background {frame.id}')
+        frame.save()
+        game_object = GameObject.objects.create(frame=frame, name='Newton')
+        Dialogue.objects.create(frame=frame, game_object=game_object, text='Hello')
+
+    def create_lesson_with_frames(self, name, count):
+        lesson = self.create_lesson(name)
+        for frame in self.create_frames(lesson, count):
+            self.create_scene(frame)
+        return lesson
+
+    def test_bundle_queries_do_not_grow_with_the_lesson(self):
+        self.client.force_authenticate(self.learner)
+        for count in (2, 20):
+            lesson = self.create_lesson_with_frames(f'Lesson of {count}', count)
+            for sequence in ('order', 'chain'):
+                cache.clear()
+                # The lesson, its frames, then their objects, dialogues and quiz options
+                with self.subTest(frames=count, sequence=sequence), self.assertNumQueries(5):
+                    response = self.client.get(f'/api/lessons/{lesson.slug}/game/', {'sequence': sequence})
+                self.assertEqual(response.status_code, 200)
+                bundle = response.data
+                self.assertEqual(bundle['frame_count'], count)
+                self.assertEqual(len(bundle['backgrounds']), count)
+                self.assertEqual(bundle['frames'][0]['objects'][0]['dialogues'][0]['text'], 'Hello')
+
+    def get_bundle(self, **headers):
+        self.client.force_authenticate(self.learner)
+        return self.client.get(f'/api/lessons/{self.lesson.slug}/game/', headers=headers)
+
+    def test_unchanged_bundle_is_not_modified(self):
+        self.create_frames(self.lesson, 2)
+        response = self.get_bundle()
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        for header in (etag, f'W/{etag}', f'"other", {etag}'):
+            with self.subTest(header=header):
+                response = self.get_bundle(if_none_match=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get_bundle(if_none_match='"other"').status_code, 200)
+
+    def test_edits_reach_the_next_bundle(self):
+        frame = self.create_frames(self.lesson, 2)[0]
+        quiz = frame.quiz
+        option = self.correct_option(frame)
+
+        def rename_frame():
+            frame.name = 'Renamed frame'
+            frame.save()
+
+        def edit_question():
+            quiz.question = 'Edited question'
+            quiz.save()
+
+        def edit_option():
+            option.text = 'Edited option'
+            option.save()
+
+        def remove_option():
+            quiz.options.remove(option)
+
+        edits = [
+            (rename_frame, lambda data: data['frames'][0]['name'] == 'Renamed frame'),
+            (edit_question, lambda data: data['frames'][0]['quiz']['question'] == 'Edited question'),
+            (edit_option, lambda data: data['frames'][0]['quiz']['options'][0]['text'] == 'Edited option'),
+            (remove_option, lambda data: len(data['frames'][0]['quiz']['options']) == 1),
+        ]
+        etag = self.get_bundle()['ETag']
+        for edit, shows_edit in edits:
+            with self.subTest(edit=edit.__name__):
+                with self.captureOnCommitCallbacks(execute=True):
+                    edit()
+                response = self.get_bundle(if_none_match=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(shows_edit(response.data))
+                etag = response['ETag']
+
+
+def image_file(size, color='red', name='image.png'):
+    """A PNG upload of the given (width, height)"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+class MediaTestCase(GameTestCase):
+    """Uploads go to a temporary media root, removed after the tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def create_object(self, frame, size, color='red'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return GameObject.objects.create(frame=frame, name=color, image=image_file(size, color))
+
+
+class AssetManifestTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 2, frame_type='scene')
+        self.background = Background.objects.create(name='Sky', image=image_file((40, 30), 'blue'))
+        with self.captureOnCommitCallbacks(execute=True):
+            for frame in self.frames:
+                frame.background = self.background
+                frame.save()
+
+    def test_assets_follow_the_sequence_with_backgrounds_first(self):
+        tree = self.create_object(self.frames[1], (10, 20), 'green')
+        apple = self.create_object(self.frames[0], (5, 5), 'red')
+
+        manifest = get_asset_manifest(self.lesson.id)
+        self.assertEqual([asset['path'] for asset in manifest.assets],
+                         [self.background.image.name, apple.image.name, tree.image.name])
+        sky = manifest.assets[0]
+        self.assertEqual((sky['kind'], sky['width'], sky['height']), ('background', 40, 30))
+        self.assertEqual((sky['first_position'], sky['frame_count']), (1, 2))
+        self.assertEqual(manifest.total_size, sum(asset['size'] for asset in manifest.assets))
+
+    def test_unchanged_files_are_not_read_again(self):
+        self.create_object(self.frames[0], (5, 5))
+        with mock.patch('game.assets._digest_file') as digest_file:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.frames[0].name = 'Renamed'
+                self.frames[0].save()
+        digest_file.assert_not_called()
+        self.assertEqual(len(get_asset_manifest(self.lesson.id).assets), 2)
+
+    def test_replaced_image_changes_the_manifest_hash(self):
+        apple = self.create_object(self.frames[0], (5, 5))
+        content_hash = get_asset_manifest(self.lesson.id).content_hash
+        with self.captureOnCommitCallbacks(execute=True):
+            apple.image = image_file((8, 8), 'yellow')
+            apple.save()
+        manifest = get_asset_manifest(self.lesson.id)
+        self.assertNotEqual(manifest.content_hash, content_hash)
+        self.assertEqual(manifest.assets[1]['path'], apple.image.name)
+
+    def test_unchanged_manifest_is_not_modified(self):
+        self.client.force_authenticate(self.learner)
+        url = f'/api/lessons/{self.lesson.slug}/game/assets/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['assets'][0]['url'].startswith('http://testserver/media/'))
+        self.assertEqual(self.client.get(url, headers={'if_none_match': response['ETag']}).status_code, 304)
+
+
+@override_settings(GAME_IMAGE_WIDTHS=[320, 640, 1024])
+class ImageDerivativeTests(MediaTestCase):
+    def run_worker(self):
+        call_command('process_image_derivatives', '--once', stdout=StringIO())
+
+    def test_widths_never_upscale(self):
+        self.assertEqual(derivative_widths(2000), [320, 640, 1024])
+        self.assertEqual(derivative_widths(1024), [320, 640, 1024])
+        self.assertEqual(derivative_widths(700), [320, 640, 700])
+        self.assertEqual(derivative_widths(100), [100])
+
+    def test_upload_is_queued_and_the_worker_makes_webp_copies(self):
+        self.client.force_authenticate(self.learner)
+        response = self.client.post('/api/backgrounds/', {'name': 'Sky', 'image': image_file((700, 350))},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 201)
+        source = Background.objects.get(id=response.data['id']).image.name
+        self.assertEqual(ImageDerivativeJob.objects.get(source=source).status, 'pending')
+
+        self.run_worker()
+        self.assertEqual(ImageDerivativeJob.objects.get(source=source).status, 'done')
+        derivatives = ImageDerivative.objects.filter(source=source).order_by('width')
+        self.assertEqual([(d.width, d.height) for d in derivatives], [(320, 160), (640, 320), (700, 350)])
+        with derivatives[0].image.open('rb') as fh, Image.open(fh) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+
+    def test_requeued_image_replaces_its_derivatives(self):
+        background = Background.objects.create(name='Dawn', image=image_file((700, 350), name='dawn.png'))
+        queue_image_derivatives(background.image)
+        self.run_worker()
+        old_ids = set(ImageDerivative.objects.values_list('id', flat=True))
+
+        queue_image_derivatives(background.image)
+        self.run_worker()
+        new_ids = set(ImageDerivative.objects.values_list('id', flat=True))
+        self.assertEqual(len(new_ids), 3)
+        self.assertFalse(old_ids & new_ids)
+        # The old files were deleted, so the new copies took their names
+        stem = os.path.splitext(os.path.basename(background.image.name))[0]
+        directories, files = background.image.storage.listdir('game_derivatives')
+        self.assertEqual(len([name for name in files if name.startswith(f'{stem}_')]), 3)
+
+    def test_failing_job_is_retried_then_given_up(self):
+        queue_image_derivatives(image_file((10, 10), name='missing.png'))
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            job = process_image_job(claim_next_job())
+            self.assertEqual(job.attempts, attempt)
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNone(claim_next_job())
+
+    def test_object_image_picks_the_smallest_wide_enough_copy(self):
+        frame = self.create_frames(self.lesson, 1, frame_type='scene')[0]
+        obj = self.create_object(frame, (1200, 600))
+        self.client.force_authenticate(self.learner)
+        url = f'/api/objects/{obj.id}/image/'
+
+        # Until the worker ran the original is served
+        response = self.client.get(url, {'width': 300, 'dpr': 2})
+        self.assertEqual((response.data['status'], response.data['width']), (None, None))
+
+        queue_image_derivatives(obj.image)
+        self.run_worker()
+        response = self.client.get(url, {'width': 300, 'dpr': 2})
+        self.assertEqual((response.data['status'], response.data['width']), ('done', 640))
+        self.assertEqual(len(response.data['variants']), 3)
+        self.assertEqual(self.client.get(url, {'width': 2000}).data['width'], 1024)
+        self.assertEqual(self.client.get(url, {'width': -1}).status_code, 400)
+
+
+class SpriteAtlasTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frame = self.create_frames(self.lesson, 1, frame_type='scene')[0]
+
+    def run_worker(self):
+        call_command('process_image_derivatives', '--once', stdout=StringIO())
+
+    def test_packed_boxes_stay_apart_and_on_the_sheet(self):
+        sizes = [(30, 10), (50, 40), (20, 40), (60, 5), (10, 10), (45, 25)]
+        positions, (sheet_width, sheet_height) = pack_sprites(sizes, 100)
+        self.assertLessEqual(sheet_width, 100)
+        boxes = [(x, y, x + width, y + height) for (x, y), (width, height) in zip(positions, sizes)]
+        for box in boxes:
+            self.assertTrue(box[2] <= sheet_width and box[3] <= sheet_height)
+        for index, a in enumerate(boxes):
+            for b in boxes[index + 1:]:
+                apart = a[2] + PADDING <= b[0] or b[2] + PADDING <= a[0] or \
+                    a[3] + PADDING <= b[1] or b[3] + PADDING <= a[1]
+                self.assertTrue(apart, (a, b))
+
+    def test_box_wider_than_the_limit_widens_the_sheet(self):
+        positions, size = pack_sprites([(300, 10), (10, 10)], 100)
+        self.assertEqual(positions, [(0, 0), (0, 10 + PADDING)])
+        self.assertEqual(size, (300, 20 + PADDING))
+
+    def test_frame_needs_two_object_images(self):
+        self.create_object(self.frame, (10, 10))
+        self.assertFalse(FrameSpriteAtlas.objects.exists())
+        self.create_object(self.frame, (20, 10), 'blue')
+        self.assertEqual(FrameSpriteAtlas.objects.get(frame=self.frame).status, 'pending')
+
+    def test_worker_packs_the_sheet_and_the_bundle_uses_it(self):
+        red = self.create_object(self.frame, (10, 10))
+        blue = self.create_object(self.frame, (20, 30), 'blue')
+        self.run_worker()
+
+        atlas = FrameSpriteAtlas.objects.get(frame=self.frame)
+        self.assertEqual(atlas.status, 'done')
+        self.assertEqual({key: (region['width'], region['height']) for key, region in atlas.regions.items()},
+                         {str(red.id): (10, 10), str(blue.id): (20, 30)})
+
+        self.client.force_authenticate(self.learner)
+        frame = self.client.get(f'/api/lessons/{self.lesson.slug}/game/').data['frames'][0]
+        self.assertEqual((frame['atlas']['width'], frame['atlas']['height']), (atlas.width, atlas.height))
+        sprites = {obj['id']: obj['sprite'] for obj in frame['objects']}
+        self.assertEqual(sprites[blue.id], {key: atlas.regions[str(blue.id)][key]
+                                            for key in ('x', 'y', 'width', 'height')})
+
+    def test_same_size_replacement_is_pasted_in_place(self):
+        red = self.create_object(self.frame, (10, 10))
+        self.create_object(self.frame, (20, 30), 'blue')
+        self.run_worker()
+        regions = FrameSpriteAtlas.objects.get(frame=self.frame).regions
+
+        with self.captureOnCommitCallbacks(execute=True):
+            red.image = image_file((10, 10), 'green')
+            red.save()
+        self.assertEqual(FrameSpriteAtlas.objects.get(frame=self.frame).status, 'pending')
+        with mock.patch('game.atlas.pack_sprites') as pack:
+            self.run_worker()
+        pack.assert_not_called()
+
+        atlas = FrameSpriteAtlas.objects.get(frame=self.frame)
+        region = atlas.regions[str(red.id)]
+        self.assertEqual((region['x'], region['y']), (regions[str(red.id)]['x'], regions[str(red.id)]['y']))
+        self.assertEqual(region['source'], red.image.name)
+        with atlas.image.open('rb') as fh, Image.open(fh) as sheet:
+            self.assertEqual(sheet.convert('RGB').getpixel((region['x'] + 5, region['y'] + 5)), (0, 128, 0))
+
+    def test_frame_left_with_one_image_loses_its_atlas(self):
+        self.create_object(self.frame, (10, 10))
+        blue = self.create_object(self.frame, (20, 30), 'blue')
+        self.run_worker()
+        with self.captureOnCommitCallbacks(execute=True):
+            blue.delete()
+        self.assertFalse(FrameSpriteAtlas.objects.exists())
+
+
+class ItemAnalysisTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 3)
+        self.learners = [self.learner] + [self.create_user(f'learner{n}') for n in range(2, 5)]
+
+    def record(self, user, frame, correct):
+        answered_at = timezone.now()
+        AnswerEvent.objects.create(
+            user=user, quiz_id=frame.quiz.id, lesson_id=self.lesson.id,
+            option_id=frame.quiz.options.get(is_correct=correct).id, is_correct=correct,
+            answered_at=answered_at, period=answer_period(answered_at))
+
+    def record_all(self, rows):
+        """One row of correctness per learner, one column per frame"""
+        for user, row in zip(self.learners, rows):
+            for frame, correct in zip(self.frames, row):
+                self.record(user, frame, correct)
+
+    def statistics(self, frame):
+        return ItemStatistics.objects.get(kind='quiz', item_id=frame.quiz.id)
+
+    def test_difficulty_and_discrimination_use_first_answers(self):
+        rows = [(1, 1, 1), (1, 1, 0), (1, 0, 0), (0, 0, 0)]
+        self.record_all(rows)
+        # A retry until correct is not counted
+        self.record(self.learners[3], self.frames[0], True)
+        run = run_item_analysis()
+        self.assertEqual((run.lessons, run.items), (1, 3))
+
+        item = self.statistics(self.frames[0])
+        self.assertEqual((item.learners, item.difficulty), (4, 0.75))
+        # Each learner's correctness against their score on the other two frames
+        rest = [(sum(row) - row[0]) / 2 for row in rows]
+        self.assertAlmostEqual(item.discrimination, statistics.correlation(rest, [row[0] for row in rows]))
+        self.assertEqual({(o.is_correct, o.learners, o.share) for o in item.options.all()},
+                         {(True, 3, 0.75), (False, 1, 0.25)})
+
+    def test_item_everyone_gets_right_has_no_discrimination(self):
+        self.record_all([(1, 1, 0), (1, 0, 1), (1, 0, 0)])
+        run_item_analysis()
+        item = self.statistics(self.frames[0])
+        self.assertEqual(item.difficulty, 1.0)
+        self.assertIsNone(item.discrimination)
+
+    def test_small_samples_have_no_discrimination(self):
+        # One learner, then a second one who answered a single frame
+        self.record_all([(1, 0, 1)])
+        self.record(self.learners[1], self.frames[0], False)
+        run_item_analysis()
+        item = self.statistics(self.frames[0])
+        self.assertEqual((item.learners, item.difficulty), (2, 0.5))
+        self.assertIsNone(item.discrimination)
+
+    def test_distractors_are_only_judged_with_enough_learners(self):
+        self.record_all([(1, 1, 1)] * 4)
+        run_item_analysis()
+        self.assertEqual(self.statistics(self.frames[0]).dead_distractors, 0)
+
+        with override_settings(GAME_ITEM_ANALYSIS_MIN_LEARNERS=4):
+            run_item_analysis(full=True)
+        item = self.statistics(self.frames[0])
+        self.assertEqual(item.dead_distractors, 1)
+        self.assertEqual([o.is_dead_distractor for o in item.options.filter(is_correct=False)], [True])
+
+    def test_later_runs_only_revisit_lessons_with_new_answers(self):
+        self.record_all([(1, 1, 1), (0, 1, 0)])
+        run_item_analysis()
+        self.assertEqual(run_item_analysis().lessons, 0)
+        self.assertEqual(self.statistics(self.frames[0]).learners, 2)
+
+        self.record(self.learners[2], self.frames[0], True)
+        run = run_item_analysis()
+        self.assertEqual((run.lessons, run.items), (1, 3))
+        self.assertEqual(self.statistics(self.frames[0]).learners, 3)
+
+
+class ResumeListTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 3)
+        self.other_lesson = self.create_lesson('Refraction')
+        self.other_frames = self.create_frames(self.other_lesson, 2)
+
+    def resume(self, user=None):
+        self.client.force_authenticate(user or self.learner)
+        return self.client.get('/api/progress/resume/').data
+
+    def test_unfinished_lessons_most_recently_played_first(self):
+        self.answer(self.learner, self.frames[1])
+        self.answer(self.learner, self.other_frames[0])
+
+        resume = self.resume()
+        self.assertEqual([row['lesson']['id'] for row in resume], [self.other_lesson.id, self.lesson.id])
+        row = resume[1]
+        self.assertEqual((row['chapter']['name'], row['subject']['name'], row['class']['name']),
+                         ('Light', 'Science', 'Class 8'))
+        self.assertEqual((row['current_frame'], row['current_position']), (self.frames[1].id, 2))
+        self.assertEqual((row['frame_count'], row['completed_count'], row['percent_complete']), (3, 1, 33.3))
+
+        # A finished lesson leaves the list
+        self.answer(self.learner, self.other_frames[1])
+        self.assertEqual([row['lesson']['id'] for row in self.resume()], [self.lesson.id])
+        self.assertEqual(self.resume(self.create_user('newcomer')), [])
+
+    def test_list_is_cached_until_the_learners_progress_changes(self):
+        self.answer(self.learner, self.frames[0])
+        self.resume()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resume()[0]['completed_count'], 1)
+
+        # Another learner's answers keep it cached
+        self.answer(self.create_user('other'), self.frames[1])
+        with self.assertNumQueries(0):
+            self.resume()
+
+        self.answer(self.learner, self.frames[1])
+        self.assertEqual(self.resume()[0]['completed_count'], 2)
+
+
+@override_settings(GAME_REVIEW_RELEARN_MINUTES=10, GAME_REVIEW_GRADUATE_DAYS=90)
+class ReviewScheduleTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.questions = [self.create_question(n) for n in range(3)]
+        self.start = timezone.now()
+
+    def create_question(self, n):
+        question = Question.objects.create(lesson=self.lesson, question_text=f'Question {n}')
+        QuestionOption.objects.create(question=question, option='Right', is_correct=True)
+        QuestionOption.objects.create(question=question, option='Wrong', is_correct=False)
+        return question
+
+    def review(self, is_correct, days=0, question=None):
+        answered_at = self.start + datetime.timedelta(days=days)
+        return schedule_review(self.learner.id, (question or self.questions[0]).id, is_correct, answered_at)
+
+    def test_correct_answer_outside_the_queue_changes_nothing(self):
+        self.assertIsNone(self.review(True))
+        self.assertFalse(ReviewItem.objects.exists())
+
+    def test_intervals_grow_until_the_question_graduates(self):
+        item = self.review(False)
+        self.assertEqual((item.lapses, item.due_at), (1, self.start + datetime.timedelta(minutes=10)))
+
+        days = 0
+        for interval in (1, 3, 7.5, 18.8, 47.0):
+            item = self.review(True, days)
+            self.assertEqual(item.interval_days, interval)
+            self.assertEqual(item.due_at, self.start + datetime.timedelta(days=days + interval))
+            days += interval
+        # 47 days times the ease reaches the graduation interval
+        self.assertIsNone(self.review(True, days))
+        self.assertFalse(ReviewItem.objects.exists())
+
+    def test_lapse_starts_over_with_a_lower_ease(self):
+        self.review(False)
+        self.review(True, 1)
+        self.review(True, 2)
+        item = self.review(False, 5)
+        self.assertEqual((item.streak, item.lapses, item.interval_days), (0, 2, 0))
+        self.assertAlmostEqual(item.ease, 2.3)
+        self.assertEqual(item.due_at, self.start + datetime.timedelta(days=5, minutes=10))
+        self.assertEqual(self.review(True, 6).interval_days, 1)
+
+        for lapse in range(10):
+            item = self.review(False, 7)
+        self.assertEqual(item.ease, MIN_EASE)
+
+    def test_queue_lists_due_questions_most_overdue_first(self):
+        self.start = timezone.now() - datetime.timedelta(hours=1)
+        self.review(False, question=self.questions[1])
+        self.start -= datetime.timedelta(minutes=5)
+        self.review(False, question=self.questions[0])
+        # Answered right once, due again tomorrow
+        self.review(False, question=self.questions[2])
+        self.review(True, question=self.questions[2])
+
+        self.client.force_authenticate(self.learner)
+        data = self.client.get('/api/reviews/').data
+        self.assertEqual([review['question']['id'] for review in data['reviews']],
+                         [self.questions[0].id, self.questions[1].id])
+        self.assertEqual(data['reviews'][0]['question']['options'][0].keys(), {'id', 'option'})
+        self.assertEqual(data['next_due_at'], ReviewItem.objects.get(question=self.questions[2]).due_at)
+
+        self.assertEqual(len(self.client.get('/api/reviews/', {'limit': 1}).data['reviews']), 1)
+        self.assertEqual(self.client.get('/api/reviews/', {'limit': 'many'}).status_code, 400)
+
+
+class ListPaginationTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 4)
+        self.client.force_authenticate(self.learner)
+
+    def list_ids(self, url, max_pages=20):
+        ids = []
+        pages = 0
+        while url:
+            pages += 1
+            self.assertLessEqual(pages, max_pages, 'Pages never end')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_frames_sharing_an_order_page_through_once(self):
+        Frame.objects.filter(lesson=self.lesson).update(order=1)
+        # A cursor on a non-unique column repeats rows past the offset cutoff
+        with mock.patch('sikchhu.pagination.KeysetPagination.offset_cutoff', 1):
+            self.assertEqual(self.list_ids('/api/frames/?page_size=1'), [frame.id for frame in self.frames])
+
+    def test_lists_stay_bare_until_the_client_asks_for_pages(self):
+        response = self.client.get('/api/frames/')
+        self.assertEqual([frame['id'] for frame in response.data], [frame.id for frame in self.frames])
+        with override_settings(API_PAGINATE_ALL_LISTS=True):
+            self.assertEqual(set(self.client.get('/api/frames/').data), {'next', 'previous', 'results'})
+        # The progress list was paged from the start
+        self.assertEqual(set(self.client.get('/api/progress/').data), {'next', 'previous', 'results'})
+
+    def test_quizzes_page_in_id_order(self):
+        quiz_ids = list(Quiz.objects.order_by('id').values_list('id', flat=True))
+        self.assertEqual(self.list_ids('/api/quizzes/?page_size=3'), quiz_ids)
+
+
+class ProgressListTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lessons = [self.lesson] + [self.create_lesson(f'Lesson {n}') for n in range(2, 6)]
+        for lesson in self.lessons:
+            frames = self.create_frames(lesson, 2)
+            self.answer(self.learner, frames[0])
+        self.answer(self.create_user('other'), frames[1])
+        self.client.force_authenticate(self.learner)
+
+    def test_fields_picks_the_keys_of_each_row(self):
+        response = self.client.get('/api/progress/', {'fields': 'lesson, score,completed_count'})
+        self.assertEqual(response.status_code, 200)
+        rows = response.data['results']
+        self.assertEqual([row['lesson'] for row in rows], [lesson.id for lesson in reversed(self.lessons)])
+        self.assertEqual(rows[0], {'lesson': self.lessons[-1].id, 'score': 1, 'completed_count': 1})
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/progress/', {'fields': 'id,secret,completed'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Unknown fields: secret, completed')
+
+    def test_page_queries_do_not_grow_with_the_page(self):
+        queries = []
+        for page_size in (1, 5):
+            # Lesson frame orders are read from the database too
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/progress/', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+
+class AnswerLogTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = AnswerLog()
+
+    def event(self, option_id):
+        answered_at = timezone.now()
+        return AnswerEvent(user_id=self.learner.id, option_id=option_id, is_correct=True,
+                           answered_at=answered_at, period=answer_period(answered_at))
+
+    def test_answers_wait_for_an_explicit_flush_without_background_flush(self):
+        self.log.add(self.event(1))
+        self.assertIsNone(self.log._timer)
+        self.assertFalse(AnswerEvent.objects.exists())
+        self.log.flush()
+        self.assertEqual(AnswerEvent.objects.count(), 1)
+
+    @override_settings(GAME_ANSWER_LOG_BACKGROUND_FLUSH=True, GAME_ANSWER_LOG_FLUSH_INTERVAL=3600)
+    def test_background_flush_starts_a_timer(self):
+        self.log.add(self.event(1))
+        self.assertIsNotNone(self.log._timer)
+        self.log.flush()
+        self.assertIsNone(self.log._timer)
+        self.assertEqual(AnswerEvent.objects.count(), 1)
+
+    def test_bad_event_is_dropped_without_holding_back_the_others(self):
+        for option_id in (1, None, 3):
+            self.log.add(self.event(option_id))
+        with self.assertLogs('game.answer_log', 'ERROR'):
+            self.log.flush()
+        self.assertEqual(sorted(AnswerEvent.objects.values_list('option_id', flat=True)), [1, 3])
+        self.log.add(self.event(4))
+        self.log.flush()
+        self.assertEqual(AnswerEvent.objects.count(), 3)
+
+    def test_events_are_kept_when_the_database_is_unavailable(self):
+        self.log.add(self.event(1))
+        with mock.patch.object(AnswerEvent.objects, 'bulk_create', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('game.answer_log', 'ERROR'), self.assertRaises(OperationalError):
+            self.log.flush()
+        self.assertFalse(AnswerEvent.objects.exists())
+        self.log.flush()
+        self.assertEqual(AnswerEvent.objects.count(), 1)
+
+
+class StoryboardImportTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.learner)
+
+    def import_frames(self, frames):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/lessons/{self.lesson.slug}/game/storyboard/', {'frames': frames},
+                                    format='json')
+
+    def test_malformed_nested_items_are_reported_by_path(self):
+        response = self.import_frames([
+            {'frame_type': 'background', 'objects': [
+                'Mirror', {'name': 'Lamp', 'dialogues': ['Hello', 7]}, {'name': 'Door', 'dialogues': 'Hi'}]},
+            {'frame_type': 'quiz', 'quiz': 'Which way?'},
+            {'frame_type': 'quiz', 'quiz': {'question': 'Which way?', 'options': [{'text': 'Back'}, 'Through']}},
+            {'frame_type': 'quiz', 'quiz': {'question': 'Which way?', 'options': {'text': 'Back'}}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['path'] for error in response.data['errors']], [
+            'frames[0].objects[0]',
+            'frames[0].objects[1].dialogues[1]',
+            'frames[0].objects[2].dialogues',
+            'frames[1].quiz',
+            'frames[2].quiz.options[1]',
+            'frames[3].quiz.options',
+        ])
+        self.assertFalse(Frame.objects.filter(lesson=self.lesson).exists())
+
+    def test_valid_storyboard_is_imported(self):
+        response = self.import_frames([
+            {'ref': 'intro', 'frame_type': 'background', 'objects': [{'name': 'Lamp', 'dialogues': ['Hello']}]},
+            {'previous_ref': 'intro', 'frame_type': 'quiz',
+             'quiz': {'question': 'Which way?', 'options': [{'text': 'Back', 'is_correct': True}, {'text': 'Through'}]}},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_sequence_frame_ids(self.lesson.id), [frame['id'] for frame in response.data['frames']])
+
+
+class ProgressSyncTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 2)
+        self.intro = self.create_frames(self.create_lesson('Refraction'), 1, frame_type='background')[0]
+        self.client.force_authenticate(self.learner)
+
+    def sync(self, events):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/progress/sync/', {'events': events}, format='json')
+
+    def answered(self, event_id, frame, correct=True):
+        return {'id': event_id, 'type': 'quiz_answered', 'quiz': frame.quiz.id,
+                'option': frame.quiz.options.get(is_correct=correct).id}
+
+    def progress(self, lesson):
+        return UserProgress.objects.get(user=self.learner, lesson=lesson)
+
+    def test_resent_and_repeated_events_apply_once(self):
+        events = [self.answered('a1', self.frames[0]), self.answered('a1', self.frames[0]),
+                  {'id': 'v1', 'type': 'frame_viewed', 'frame': self.intro.id}]
+        response = self.sync(events)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event['status'] for event in response.data['events']], ['applied', 'duplicate', 'applied'])
+
+        resent = self.sync(events)
+        self.assertEqual([event['status'] for event in resent.data['events']], ['duplicate'] * 3)
+        self.assertEqual(self.progress(self.lesson).score, 1)
+        self.assertEqual(completed_frame_ids(self.progress(self.intro.lesson)), [self.intro.id])
+
+    def test_a_quiz_frame_scores_once_across_online_answers_and_syncs(self):
+        self.answer(self.learner, self.frames[0])
+        self.client.force_authenticate(self.learner)
+        response = self.sync([
+            self.answered('a1', self.frames[0]),
+            self.answered('a2', self.frames[1], correct=False),
+            self.answered('a3', self.frames[1]),
+            self.answered('a4', self.frames[1]),
+            {'id': 'v1', 'type': 'frame_viewed', 'frame': self.frames[0].id},
+        ])
+        self.assertEqual([event.get('scored') for event in response.data['events']], [False, False, True, False, None])
+        [progress] = response.data['progress']
+        self.assertEqual(progress['score'], 2)
+        self.assertEqual(progress['completed_frames'], [frame.id for frame in self.frames])
+        self.assertEqual(progress['current_frame'], self.frames[0].id)
+        self.assertEqual(LeaderboardEntry.objects.get(
+            scope='lesson', scope_id=self.lesson.id, user=self.learner).score, 2)
+
+    def test_events_applied_by_a_concurrent_sync_are_not_applied_again(self):
+        # Another request synced the same answer, this one read its events before that committed
+        self.sync([self.answered('a1', self.frames[0])])
+        plan_events = sync._plan_events
+        stale_reads = []
+
+        def read_before_the_other_sync(user, events, seen, *args):
+            if not stale_reads:
+                stale_reads.append(set(seen))
+                seen = set()
+            return plan_events(user, events, seen, *args)
+
+        with mock.patch('game.sync._plan_events', read_before_the_other_sync), \
+                mock.patch('game.sync.record_answer') as record_answer:
+            response = self.sync([self.answered('a1', self.frames[0]), self.answered('a2', self.frames[1])])
+        self.assertEqual(stale_reads, [{'a1'}])
+        self.assertEqual([event['status'] for event in response.data['events']], ['duplicate', 'applied'])
+        self.assertEqual(self.progress(self.lesson).score, 2)
+        self.assertEqual(record_answer.call_count, 1)
+
+    def test_a_concurrent_online_answer_keeps_its_frame_and_is_not_scored_again(self):
+        apply_change = progress_module._apply_change
+        answered_online = []
+
+        def online_answer_first(done, change, lesson_positions):
+            if not answered_online:
+                # The learner answers online between the sync's read of the row and its write
+                answered_online.append(score_correct_answer(self.learner, self.lesson.id, self.frames[0].id))
+            return apply_change(done, change, lesson_positions)
+
+        UserProgress.objects.create(user=self.learner, lesson=self.lesson)
+        with mock.patch('game.progress._apply_change', online_answer_first):
+            response = self.sync([self.answered('a1', self.frames[0]), self.answered('a2', self.frames[1])])
+        self.assertEqual(answered_online, [True])
+        self.assertEqual([event['scored'] for event in response.data['events']], [False, True])
+        progress = self.progress(self.lesson)
+        self.assertEqual((progress.score, completed_frame_ids(progress)), (2, [frame.id for frame in self.frames]))
+
+    def test_viewing_a_quiz_frame_does_not_complete_it(self):
+        self.sync([{'id': 'v1', 'type': 'frame_viewed', 'frame': self.frames[0].id}])
+        self.assertEqual(completed_frame_ids(self.progress(self.lesson)), [])
+
+    def test_malformed_batch_is_rejected_by_path(self):
+        response = self.sync([{'id': 'a1', 'type': 'quiz_answered', 'quiz': 'x'}, 'v1'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['path'] for error in response.data['errors']],
+                         ['events[0].quiz', 'events[0].option', 'events[1]'])
+        self.assertFalse(UserProgress.objects.exists())
+
+
+class FrameSequenceIndexTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.frames = self.create_frames(self.lesson, 4)
+        self.client.force_authenticate(self.learner)
+
+    def sequence(self):
+        response = self.client.get(f'/api/lessons/{self.lesson.slug}/game/sequence/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_frame_at_a_position_links_its_neighbours(self):
+        response = self.client.get(f'/api/lessons/{self.lesson.slug}/game/frames/2/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['id'], response.data['previous_frame'], response.data['position'], response.data['frame_count']),
+            (self.frames[1].id, self.frames[0].id, 2, 4))
+        self.assertEqual(self.client.get(f'/api/lessons/{self.lesson.slug}/game/frames/5/').status_code, 404)
+
+    def test_broken_chains_are_reported(self):
+        other = self.create_frames(self.create_lesson('Refraction'), 1)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            fork = Frame.objects.create(lesson=self.lesson, name='Fork', frame_type='background', order=5)
+            orphan = Frame.objects.create(lesson=self.lesson, name='Orphan', frame_type='background', order=6,
+                                          previous_frame=other)
+        sequence = self.sequence()
+        self.assertFalse(sequence['is_consistent'])
+        self.assertEqual((sequence['fork_frames'], sequence['orphan_frames'], sequence['cycle_frames']),
+                         ([fork.id], [orphan.id], []))
+        self.assertEqual([entry['frame'] for entry in sequence['frames']][-2:], [fork.id, orphan.id])
+
+    def test_deleting_through_the_api_relinks_the_sequence(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/frames/{self.frames[1].id}/').status_code, 204)
+        sequence = self.sequence()
+        self.assertEqual(sequence['frame_count'], 3)
+        self.assertEqual([(entry['previous_frame'], entry['frame'], entry['next_frame']) for entry in sequence['frames']], [
+            (None, self.frames[0].id, self.frames[2].id),
+            (self.frames[0].id, self.frames[2].id, self.frames[3].id),
+            (self.frames[2].id, self.frames[3].id, None),
+        ])
@@ -7,17 +7,35 @@ urlpatterns = [
          name='background-list-create'),
     path('backgrounds/<int:pk>/',
          views.BackgroundRetrieveUpdateDestroyView.as_view(), name='background-detail'),
+    path('backgrounds/<int:pk>/image/',
+         views.BackgroundImageView.as_view(), name='background-image'),
 
     # Frame routes
     path('frames/', views.FrameListCreateView.as_view(), name='frame-list-create'),
     path('frames/<int:pk>/',
          views.FrameRetrieveUpdateDestroyView.as_view(), name='frame-detail'),
 
+    # Lesson playback routes
+    path('lessons/<slug:slug>/game/',
+         views.LessonGameView.as_view(), name='lesson-game'),
+    path('lessons/<slug:slug>/game/assets/',
+         views.LessonAssetManifestView.as_view(), name='lesson-game-assets'),
+    path('lessons/<slug:slug>/game/sequence/',
+         views.LessonFrameSequenceView.as_view(), name='lesson-game-sequence'),
+    path('lessons/<slug:slug>/game/frames/<int:position>/',
+         views.LessonFramePositionView.as_view(), name='lesson-game-frame'),
+    path('lessons/<slug:slug>/game/funnel/',
+         views.LessonFunnelView.as_view(), name='lesson-game-funnel'),
+    path('lessons/<slug:slug>/game/storyboard/',
+         views.LessonStoryboardImportView.as_view(), name='lesson-game-storyboard'),
+
     # GameObject routes
     path('objects/', views.GameObjectListCreateView.as_view(),
          name='gameobject-list-create'),
     path('objects/<int:pk>/', views.GameObjectRetrieveUpdateDestroyView.as_view(),
          name='gameobject-detail'),
+    path('objects/<int:pk>/image/', views.GameObjectImageView.as_view(),
+         name='gameobject-image'),
 
     # Dialogue routes
     path('dialogues/', views.DialogueListCreateView.as_view(),
@@ -37,10 +55,28 @@ urlpatterns = [
          views.QuizRetrieveUpdateDestroyView.as_view(), name='quiz-detail'),
     path('validate-quiz-answer/', views.ValidateQuizAnswerView.as_view(),
          name='validate-quiz-answer'),
+    path('item-analysis/', views.ItemAnalysisView.as_view(),
+         name='item-analysis'),
+    path('reviews/', views.ReviewQueueView.as_view(),
+         name='review-queue'),
 
     # UserProgress routes
     path('progress/', views.UserProgressListCreateView.as_view(),
          name='progress-list-create'),
+    path('progress/sync/', views.ProgressSyncView.as_view(),
+         name='progress-sync'),
+    path('progress/rollups/', views.ProgressRollupView.as_view(),
+         name='progress-rollups'),
+    path('progress/resume/', views.ProgressResumeView.as_view(),
+         name='progress-resume'),
     path('progress/<int:pk>/',
          views.UserProgressRetrieveUpdateDestroyView.as_view(), name='progress-detail'),
+
+    # Organization routes
+    path('organizations/<int:pk>/progress-export/',
+         views.OrganizationProgressExportView.as_view(), name='organization-progress-export'),
+
+    # Leaderboard routes
+    path('leaderboards/<str:scope>/<int:scope_id>/',
+         views.LeaderboardView.as_view(), name='leaderboard'),
 ]
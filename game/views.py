@@ -1,19 +1,42 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import status, generics, views
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
-from .models import Background, Frame, GameObject, Dialogue, Quiz, QuizOption, UserProgress
+from .models import Background, Frame, GameObject, Dialogue, Quiz, QuizOption, UserProgress, FrameSequenceEntry, ItemStatistics, LessonFunnel
 from .serializers import (
     BackgroundSerializer, FrameSerializer, GameObjectSerializer,
     DialogueSerializer, QuizSerializer, QuizOptionSerializer, UserProgressSerializer
 )
+from .playback import etag_matches, frames_with_content, get_cached_lesson, get_compiled_lesson, serialize_frame
+from .answers import get_answer_key, score_correct_answer
+from .answer_log import parse_latency, record_answer
+from .assets import get_asset_manifest
+from .export import FORMATS, export_lines, parse_cursor
+from .funnel import build_lesson_funnel, funnel_data
+from .images import describe_image, queue_image_derivatives, viewport_width
+from .item_analysis import item_statistics_data
+from .leaderboards import SCOPES, leaderboard_size, learner_standing, top_entries
+from .resume import resume_lessons
+from .reviews import due_reviews
+from .rollups import completion_dashboard
+from .progress import (
+    flush_progress_buffer, parse_fields, progress_data, select_fields, set_completed_frames, with_pending_progress,
+    with_pending_resume
+)
+from .sequence import get_frame_sequence, get_sequence_frame_ids_many
+from .storyboard import StoryboardError, import_storyboard
+from .sync import SyncError, sync_progress
+from course.models import Lesson
+from sikchhu.pagination import PagedKeysetPagination
 import json
 
 
 class BackgroundListCreateView(generics.ListCreateAPIView):
     queryset = Background.objects.all()
     serializer_class = BackgroundSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -31,6 +54,7 @@ class BackgroundListCreateView(generics.ListCreateAPIView):
                 image=image,
                 description=description
             )
+            queue_image_derivatives(background.image)
 
             # Build the image URL if it exists
             image_url = None
@@ -94,6 +118,8 @@ class BackgroundRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
                 background.image = None
 
             background.save()
+            if image is not None:
+                queue_image_derivatives(background.image)
 
             # Build the image URL if it exists
             image_url = None
@@ -122,8 +148,37 @@ class BackgroundRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class BackgroundImageView(views.APIView):
+    """Resized copies of a background's image and the best one for the client's viewport"""
+
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            try:
+                background = Background.objects.get(pk=pk)
+            except Background.DoesNotExist:
+                return Response({'error': 'Background not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if not background.image:
+                return Response({'error': 'No image uploaded'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Clients send their viewport width in CSS pixels and their pixel ratio
+            try:
+                width = viewport_width(request.query_params)
+            except ValueError:
+                return Response(
+                    {'error': 'Width and dpr must be positive numbers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response(describe_image(request, background.image, width))
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class FrameListCreateView(generics.ListCreateAPIView):
     serializer_class = FrameSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -223,6 +278,7 @@ class FrameListCreateView(generics.ListCreateAPIView):
                         name=name,
                         image=image
                     )
+                    queue_image_derivatives(obj.image)
 
                     image_url = None
                     if obj.image and hasattr(obj.image, 'url'):
@@ -322,88 +378,28 @@ class FrameListCreateView(generics.ListCreateAPIView):
 
 
 class FrameRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Frame.objects.all()
+    queryset = frames_with_content()
     serializer_class = FrameSerializer
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def retrieve(self, request, *args, **kwargs):
         try:
             frame = self.get_object()
-
-            # Get game objects with their dialogues
-            objects_data = []
-            for obj in frame.game_objects.all():
-                image_url = None
-                if obj.image and hasattr(obj.image, 'url'):
-                    image_url = request.build_absolute_uri(obj.image.url)
-
-                # Get dialogues for this object
-                obj_dialogues = []
-                for dialogue in obj.dialogues.all():
-                    obj_dialogues.append({
-                        'id': dialogue.id,
-                        'text': dialogue.text,
-                        'height': dialogue.height,
-                        'width': dialogue.width,
-                        'position_x': dialogue.position_x,
-                        'position_y': dialogue.position_y
-                    })
-
-                objects_data.append({
-                    'id': obj.id,
-                    'name': obj.name,
-                    'image': image_url,
-                    'position_x': obj.position_x,
-                    'position_y': obj.position_y,
-                    'animation': obj.animation,
-                    'animation_speed': obj.animation_speed,
-                    'animation_direction': obj.animation_direction,
-                    'dialogues': obj_dialogues
-                })
-
-            # Get quiz data if exists
-            quiz_data = None
-            if hasattr(frame, 'quiz'):
-                quiz = frame.quiz
-                options_data = []
-                for option in quiz.options.all():
-                    options_data.append({
-                        'id': option.id,
-                        'text': option.text,
-                        'is_correct': option.is_correct,
-                        'explanation': option.explanation,
-                        'height': option.height,
-                        'width': option.width,
-                        'position_x': option.position_x,
-                        'position_y': option.position_y
-                    })
-
-                quiz_data = {
-                    'id': quiz.id,
-                    'question': quiz.question,
-                    'options': options_data,
-                    'height': quiz.height,
-                    'width': quiz.width,
-                    'position_x': quiz.position_x,
-                    'position_y': quiz.position_y
-                }
+            next_frame = frame.get_next_frame()
 
             # Build the response
-            response_data = {
-                'id': frame.id,
-                'lesson': frame.lesson.id if frame.lesson else None,
-                'name': frame.name,
-                'frame_type': frame.frame_type,
-                'background': frame.background.id if frame.background else None,
-                'color': frame.color,
-                'height': frame.height,
-                'width': frame.width,
-                'order': frame.order,
-                'previous_frame': frame.previous_frame.id if frame.previous_frame else None,
-                'next_frame': frame.get_next_frame().id if frame.get_next_frame() else None,
-                'objects': objects_data,
-                'quiz': quiz_data
-            }
+            response_data = serialize_frame(
+                frame, request, next_frame.id if next_frame else None)
+
+            # Add the frame's place in the lesson sequence
+            response_data['position'] = None
+            response_data['frame_count'] = None
+            if frame.lesson_id:
+                sequence = get_frame_sequence(frame.lesson_id)
+                entry = sequence.entries.filter(frame=frame).first()
+                if entry:
+                    response_data['position'] = entry.position
+                response_data['frame_count'] = sequence.frame_count
 
             return Response(response_data)
 
@@ -486,9 +482,203 @@ class FrameRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class LessonGameView(views.APIView):
+    """All frames of a lesson with their backgrounds, objects, dialogues and quizzes"""
+
+    def get(self, request, slug, *args, **kwargs):
+        try:
+            lesson = get_cached_lesson(slug)
+            if lesson is None:
+                return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Frames follow Frame.order unless the previous_frame chain is requested
+            sequence = request.query_params.get('sequence', 'order')
+            if sequence not in ('order', 'chain'):
+                return Response(
+                    {'error': "Sequence must be 'order' or 'chain'"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            compiled = get_compiled_lesson(lesson, request, sequence)
+            etag = f'"{compiled["hash"]}"'
+
+            # Clients revalidate every time and get 304 while the content is unchanged
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response(compiled['data'])
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LessonAssetManifestView(views.APIView):
+    """Images of a lesson with their sizes and content hashes, in the order to preload them"""
+
+    def get(self, request, slug, *args, **kwargs):
+        try:
+            lesson = get_cached_lesson(slug)
+            if lesson is None:
+                return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            manifest = get_asset_manifest(lesson.id)
+            etag = f'"{manifest.content_hash}"'
+
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = Response({
+                    'lesson': lesson.id,
+                    'hash': manifest.content_hash,
+                    'total_size': manifest.total_size,
+                    'updated_at': manifest.updated_at,
+                    'assets': [
+                        {**asset, 'url': request.build_absolute_uri(asset['url'])}
+                        for asset in manifest.assets
+                    ]
+                })
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LessonFrameSequenceView(views.APIView):
+    """Stored playback order of a lesson's frames and the health of its previous_frame chain"""
+
+    def get(self, request, slug, *args, **kwargs):
+        try:
+            try:
+                lesson = Lesson.objects.get(slug=slug)
+            except Lesson.DoesNotExist:
+                return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            sequence = get_frame_sequence(lesson.id)
+
+            return Response({
+                'lesson': lesson.id,
+                'frame_count': sequence.frame_count,
+                'is_consistent': sequence.is_consistent,
+                'matches_order': sequence.matches_order,
+                'cycle_frames': sequence.cycle_frames,
+                'orphan_frames': sequence.orphan_frames,
+                'fork_frames': sequence.fork_frames,
+                'updated_at': sequence.updated_at,
+                'frames': [{
+                    'position': entry.position,
+                    'frame': entry.frame_id,
+                    'previous_frame': entry.previous_frame_id,
+                    'next_frame': entry.next_frame_id
+                } for entry in sequence.entries.all()]
+            })
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LessonFramePositionView(views.APIView):
+    """Jump to the frame at a given 1-based position of a lesson"""
+
+    def get(self, request, slug, position, *args, **kwargs):
+        try:
+            try:
+                lesson = Lesson.objects.get(slug=slug)
+            except Lesson.DoesNotExist:
+                return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            sequence = get_frame_sequence(lesson.id)
+            try:
+                entry = sequence.entries.get(position=position)
+            except FrameSequenceEntry.DoesNotExist:
+                return Response({'error': 'Frame not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            frame = frames_with_content().get(id=entry.frame_id)
+            response_data = serialize_frame(frame, request, entry.next_frame_id)
+            response_data['previous_frame'] = entry.previous_frame_id
+            response_data['position'] = entry.position
+            response_data['frame_count'] = sequence.frame_count
+
+            return Response(response_data)
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LessonFunnelView(views.APIView):
+    """Learners reaching each frame of a lesson and where they stop, built on first use"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, slug, *args, **kwargs):
+        try:
+            lesson = get_cached_lesson(slug)
+            if lesson is None:
+                return Response(
+                    {"error": "Lesson not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            funnel = LessonFunnel.objects.filter(lesson_id=lesson.id).first()
+            if funnel is None or request.query_params.get('refresh') in ('1', 'true'):
+                funnel = build_lesson_funnel(lesson.id)
+            return Response(funnel_data(funnel))
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LessonStoryboardImportView(views.APIView):
+    """Create all frames of a lesson, with objects, dialogues and quizzes, in one transaction"""
+    parser_classes = (JSONParser, FormParser, MultiPartParser)
+
+    def post(self, request, slug, *args, **kwargs):
+        try:
+            try:
+                lesson = Lesson.objects.get(slug=slug)
+            except Lesson.DoesNotExist:
+                return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Parse frames data, sent as JSON or as a string in form data
+            frames_data = request.data.get('frames')
+            if isinstance(frames_data, str):
+                try:
+                    frames_data = json.loads(frames_data)
+                except json.JSONDecodeError:
+                    return Response(
+                        {"error": "Invalid frames format"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+            replace = request.data.get('replace', False)
+            if isinstance(replace, str):
+                replace = replace.lower() in ('1', 'true', 'yes')
+
+            try:
+                created_frames = import_storyboard(
+                    lesson, frames_data, request.FILES, replace=replace)
+            except StoryboardError as e:
+                return Response(
+                    {'error': str(e), 'errors': e.errors},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response({
+                'lesson': lesson.id,
+                'frames': created_frames
+            }, status=status.HTTP_201_CREATED)
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class GameObjectListCreateView(generics.ListCreateAPIView):
     queryset = GameObject.objects.all()
     serializer_class = GameObjectSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -524,6 +714,7 @@ class GameObjectListCreateView(generics.ListCreateAPIView):
                 animation_speed=animation_speed,
                 animation_direction=animation_direction
             )
+            queue_image_derivatives(obj.image)
 
             # Build image URL if it exists
             image_url = None
@@ -625,6 +816,8 @@ class GameObjectRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
                 obj.animation_direction = animation_direction
 
             obj.save()
+            if image is not None:
+                queue_image_derivatives(obj.image)
 
             # Build image URL if it exists
             image_url = None
@@ -658,9 +851,38 @@ class GameObjectRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class GameObjectImageView(views.APIView):
+    """Resized copies of an object's image and the best one for the client's viewport"""
+
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            try:
+                obj = GameObject.objects.get(pk=pk)
+            except GameObject.DoesNotExist:
+                return Response({'error': 'Game object not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if not obj.image:
+                return Response({'error': 'No image uploaded'}, status=status.HTTP_404_NOT_FOUND)
+
+            # Clients send their viewport width in CSS pixels and their pixel ratio
+            try:
+                width = viewport_width(request.query_params)
+            except ValueError:
+                return Response(
+                    {'error': 'Width and dpr must be positive numbers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response(describe_image(request, obj.image, width))
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class DialogueListCreateView(generics.ListCreateAPIView):
     queryset = Dialogue.objects.all()
     serializer_class = DialogueSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -828,6 +1050,7 @@ class DialogueRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 class QuizOptionListCreateView(generics.ListCreateAPIView):
     queryset = QuizOption.objects.all()
     serializer_class = QuizOptionSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -918,6 +1141,7 @@ class QuizOptionRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
 class QuizListCreateView(generics.ListCreateAPIView):
     queryset = Quiz.objects.all()
     serializer_class = QuizSerializer
+    ordering = ['id']
     parser_classes = (JSONParser, FormParser, MultiPartParser)
 
     def create(self, request, *args, **kwargs):
@@ -1089,25 +1313,31 @@ class ValidateQuizAnswerView(views.APIView):
                     {"error": "Option ID is required"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-
-            # Check if quiz exists
             try:
-                quiz = Quiz.objects.get(id=quiz_id)
-            except Quiz.DoesNotExist:
+                quiz_id = int(quiz_id)
+                option_id = int(option_id)
+            except (TypeError, ValueError):
+                return Response(
+                    {"error": "Quiz ID and option ID must be integers"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Check if quiz exists, its answer key is cached with the lesson content
+            answers = get_answer_key(quiz_id)
+            if answers is None:
                 return Response(
                     {"error": "Quiz not found"},
                     status=status.HTTP_404_NOT_FOUND
                 )
 
             # Check if option exists and belongs to the quiz
-            try:
-                option = QuizOption.objects.get(id=option_id)
-                if not quiz.options.filter(id=option_id).exists():
+            option = answers['options'].get(option_id)
+            if option is None:
+                if QuizOption.objects.filter(id=option_id).exists():
                     return Response(
                         {"error": "This option doesn't belong to the specified quiz"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-            except QuizOption.DoesNotExist:
                 return Response(
                     {"error": "Option not found"},
                     status=status.HTTP_404_NOT_FOUND
@@ -1115,30 +1345,19 @@ class ValidateQuizAnswerView(views.APIView):
 
             # Build response based on option correctness
             response_data = {
-                'is_correct': option.is_correct,
-                'explanation': option.explanation
+                'is_correct': option['is_correct'],
+                'explanation': option['explanation'],
+                'scored': False
             }
 
-            # Update user progress if user is authenticated and option is correct
-            if option.is_correct:
-                user = request.user
-                frame = quiz.frame
-                lesson = frame.lesson
-
-                if lesson:
-                    # Get or create user progress for this lesson
-                    user_progress, created = UserProgress.objects.get_or_create(
-                        user=user,
-                        lesson=lesson,
-                        defaults={'current_frame': frame, 'score': 0}
-                    )
+            # A correct answer completes the frame and scores it once
+            if option['is_correct'] and answers['lesson']:
+                response_data['scored'] = score_correct_answer(
+                    request.user, answers['lesson'], answers['frame'])
 
-                    # Add this frame to completed frames
-                    user_progress.completed_frames.add(frame)
-
-                    # Update score
-                    user_progress.score += 1
-                    user_progress.save()
+            record_answer(
+                request.user.id, option_id, option['is_correct'], quiz_id=quiz_id,
+                lesson_id=answers['lesson'], latency_ms=parse_latency(request.data.get('latency_ms')))
 
             return Response(response_data)
 
@@ -1149,14 +1368,36 @@ class ValidateQuizAnswerView(views.APIView):
 class UserProgressListCreateView(generics.ListCreateAPIView):
     queryset = UserProgress.objects.all()
     serializer_class = UserProgressSerializer
+    # Newest first
+    ordering = ['-id']
     permission_classes = [IsAuthenticated]
+    pagination_class = PagedKeysetPagination
 
     def get_queryset(self):
         # Users should only see their own progress
         return UserProgress.objects.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        try:
+            try:
+                fields = parse_fields(request.query_params.get('fields'))
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            page = self.paginate_queryset(self.get_queryset())
+            # Frame orders of every lesson on the page come from the cache or one query
+            frame_ids = get_sequence_frame_ids_many(progress.lesson_id for progress in page)
+            # Include answers still waiting in the write-behind buffer
+            return self.get_paginated_response([
+                select_fields(with_pending_progress(progress_data(progress, frame_ids[progress.lesson_id])), fields)
+                for progress in page
+            ])
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     def create(self, request, *args, **kwargs):
         try:
+            flush_progress_buffer()
             user = request.user
             lesson_id = request.data.get('lesson')
             current_frame_id = request.data.get('current_frame')
@@ -1193,28 +1434,17 @@ class UserProgressListCreateView(generics.ListCreateAPIView):
                 if current_frame:
                     user_progress.current_frame = current_frame
                 user_progress.score = score
-                user_progress.save()
 
             # Add completed frames if provided
             if completed_frame_ids:
-                completed_frames = Frame.objects.filter(
-                    id__in=completed_frame_ids)
-                user_progress.completed_frames.add(*completed_frames)
-
-            # Prepare response data
-            completed_frames_data = []
-            for frame in user_progress.completed_frames.all():
-                completed_frames_data.append(frame.id)
+                set_completed_frames(user_progress, completed_frame_ids)
+            if completed_frame_ids or not created:
+                user_progress.save()
 
-            return Response({
-                'id': user_progress.id,
-                'user': user_progress.user.id,
-                'lesson': user_progress.lesson.id,
-                'current_frame': user_progress.current_frame.id if user_progress.current_frame else None,
-                'completed_frames': completed_frames_data,
-                'score': user_progress.score,
-                'last_interaction': user_progress.last_interaction
-            }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+            return Response(
+                progress_data(user_progress),
+                status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+            )
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1233,26 +1463,14 @@ class UserProgressRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVie
         try:
             user_progress = self.get_object()
 
-            # Prepare completed frames data
-            completed_frames_data = []
-            for frame in user_progress.completed_frames.all():
-                completed_frames_data.append(frame.id)
-
-            # Return the progress data
-            return Response({
-                'id': user_progress.id,
-                'user': user_progress.user.id,
-                'lesson': user_progress.lesson.id,
-                'current_frame': user_progress.current_frame.id if user_progress.current_frame else None,
-                'completed_frames': completed_frames_data,
-                'score': user_progress.score,
-                'last_interaction': user_progress.last_interaction
-            })
+            # Return the progress data, with answers still waiting in the write-behind buffer
+            return Response(with_pending_progress(progress_data(user_progress)))
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     def update(self, request, *args, **kwargs):
         try:
+            flush_progress_buffer()
             user_progress = self.get_object()
 
             # Get data from request
@@ -1266,7 +1484,10 @@ class UserProgressRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVie
                 from course.models import Lesson
                 try:
                     lesson = Lesson.objects.get(id=lesson_id)
-                    user_progress.lesson = lesson
+                    if lesson.id != user_progress.lesson_id:
+                        # Completion bits are positions in the old lesson's sequence
+                        user_progress.lesson = lesson
+                        set_completed_frames(user_progress, [], replace=True)
                 except Lesson.DoesNotExist:
                     return Response({'error': 'Lesson not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -1280,15 +1501,11 @@ class UserProgressRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVie
             if score is not None:
                 user_progress.score = score
 
-            user_progress.save()
-
-            # Update completed frames if provided
+            # Replace completed frames if provided
             if completed_frame_ids is not None:
-                user_progress.completed_frames.clear()
-                if completed_frame_ids:
-                    completed_frames = Frame.objects.filter(
-                        id__in=completed_frame_ids)
-                    user_progress.completed_frames.add(*completed_frames)
+                set_completed_frames(user_progress, completed_frame_ids or [], replace=True)
+
+            user_progress.save()
 
             # Return updated progress data
             return self.retrieve(request, *args, **kwargs)
@@ -1298,8 +1515,188 @@ class UserProgressRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIVie
 
     def destroy(self, request, *args, **kwargs):
         try:
+            flush_progress_buffer()
             user_progress = self.get_object()
             user_progress.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ProgressResumeView(views.APIView):
+    """Lessons the learner can continue, most recently played first"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            # Include answers still waiting in the write-behind buffer
+            return Response(with_pending_resume(resume_lessons(request.user.id), request.user.id))
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ReviewQueueView(views.APIView):
+    """Questions the learner answered wrong that are due to be asked again"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            try:
+                limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+            except ValueError:
+                return Response(
+                    {"error": "Limit must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(due_reviews(request.user.id, limit))
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ProgressRollupView(views.APIView):
+    """Share of frames the learner completed in each chapter, subject and class they started"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            return Response(completion_dashboard(request.user.id))
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ProgressSyncView(views.APIView):
+    """Apply an ordered batch of offline progress events, ignoring events already synced"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            events_data = request.data.get('events')
+            if isinstance(events_data, str):
+                try:
+                    events_data = json.loads(events_data)
+                except json.JSONDecodeError:
+                    return Response(
+                        {"error": "Invalid events format"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+            try:
+                result = sync_progress(request.user, events_data)
+            except SyncError as e:
+                return Response(
+                    {'error': str(e), 'errors': e.errors},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response(result)
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class LeaderboardView(views.APIView):
+    """Top learners of a lesson, chapter or organization and where the requesting learner stands"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, scope, scope_id, *args, **kwargs):
+        try:
+            if scope not in SCOPES:
+                return Response(
+                    {"error": f"Scope must be one of: {', '.join(SCOPES)}"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            # Organization leaderboards are only shown to their members
+            if scope == 'organization' and not request.user.is_staff \
+                    and request.user.organization_id != scope_id:
+                return Response(
+                    {"error": "Not a member of this organization"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            try:
+                limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+                around = min(max(int(request.query_params.get('around', 2)), 0), 25)
+            except ValueError:
+                return Response(
+                    {"error": "Limit and around must be integers"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            return Response({
+                'scope': scope,
+                'scope_id': scope_id,
+                'learners': leaderboard_size(scope, scope_id),
+                'top': top_entries(scope, scope_id, limit),
+                'me': learner_standing(scope, scope_id, request.user.id, around),
+            })
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ItemAnalysisView(views.APIView):
+    """Stored item analysis of questions and quizzes, filtered by kind, item, lesson or flagged distractors"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            items = ItemStatistics.objects.prefetch_related('options').order_by('kind', 'item_id')
+            kind = request.query_params.get('kind')
+            if kind:
+                items = items.filter(kind=kind)
+            try:
+                if request.query_params.get('item'):
+                    items = items.filter(item_id=int(request.query_params['item']))
+                if request.query_params.get('lesson'):
+                    items = items.filter(lesson_id=int(request.query_params['lesson']))
+            except ValueError:
+                return Response(
+                    {"error": "Item and lesson must be integers"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if request.query_params.get('flagged') in ('1', 'true'):
+                items = items.filter(dead_distractors__gt=0)
+
+            return Response([item_statistics_data(item) for item in items])
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class OrganizationProgressExportView(views.APIView):
+    """Stream every learner's progress in an organization as CSV or JSON lines"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            # Staff, or the organization's own admins
+            user = request.user
+            if not user.is_staff and not (user.organization_id == pk and user.user_type in ('admin', 'org_user')):
+                return Response(
+                    {"error": "Only admins of this organization can export its progress"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            # Not ?format=, DRF reads that one to pick a renderer
+            export_format = request.query_params.get('export_format', 'csv')
+            if export_format not in FORMATS:
+                return Response(
+                    {"error": f"export_format must be one of: {', '.join(FORMATS)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            after = None
+            if request.query_params.get('after'):
+                try:
+                    after = parse_cursor(request.query_params['after'])
+                except ValueError:
+                    return Response(
+                        {"error": "Invalid cursor, pass the cursor column of the last row received"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+            content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+            response = StreamingHttpResponse(export_lines(pk, export_format, after), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="organization-{pk}-progress.{export_format}"'
+            return response
+
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """One indexed range scan per page however deep the client pages.
+
+    Pages follow the view's own ordering attribute, which must start with a
+    unique indexed column, and fall back to the id otherwise. The cursor is
+    an opaque token of the last row on the page, so pages stay stable while
+    rows are added or removed. Clients pick a page size up to
+    API_MAX_PAGE_SIZE with ?page_size=, the default is PAGE_SIZE.
+
+    Lists that used to return a bare list keep doing so until the client
+    asks for pages with ?cursor= or ?page_size=, or API_PAGINATE_ALL_LISTS
+    is turned on.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    opt_in = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        asked = self.cursor_query_param in request.query_params or self.page_size_query_param in request.query_params
+        if self.opt_in and not (asked or settings.API_PAGINATE_ALL_LISTS):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # An OrderingFilter on the view still wins, it falls back to the same attribute
+        self.ordering = getattr(view, 'ordering', None) or self.ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class PagedKeysetPagination(KeysetPagination):
+    """Keyset pages for lists that were paged from the start"""
+    opt_in = False
@@ -101,6 +101,78 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared between worker processes so an edit invalidates cached game
+# content everywhere at once
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+# Seconds a compiled lesson stays cached, edits invalidate it immediately
+GAME_CONTENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds the class to lesson catalog tree stays cached, edits of the
+# classes, subjects, chapters, lessons, videos and questions in it
+# invalidate it immediately
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds a lesson with its videos, materials and questions stays cached for
+# the lesson detail view, any course edit invalidates it immediately and 0
+# turns the cache off
+LESSON_DETAIL_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Widths in pixels of the WebP copies made of game backgrounds and objects,
+# by the process_image_derivatives worker
+GAME_IMAGE_WIDTHS = [320, 640, 1024, 1600]
+GAME_IMAGE_QUALITY = 80
+
+# Widest sprite sheet the worker packs a frame's object images into
+GAME_ATLAS_MAX_WIDTH = 2048
+
+# Write-behind mode for quiz scoring: correct answers are collected in
+# memory and written in batches, flushed after the interval in seconds or
+# once the size is reached
+GAME_PROGRESS_WRITE_BEHIND = False
+GAME_PROGRESS_FLUSH_INTERVAL = 2
+GAME_PROGRESS_FLUSH_SIZE = 200
+
+# Completed frames are stored as a bitmap on UserProgress, this also keeps
+# the old completed_frames table up to date for code still reading it
+GAME_PROGRESS_MIRROR_M2M = False
+
+# Seconds a learner's continue learning list stays cached, their own
+# progress writes invalidate it immediately
+GAME_RESUME_CACHE_TIMEOUT = 60 * 5
+
+# Answers are appended to the answer log in batches, written after the
+# interval in seconds or once the size is reached. At most MAX_PENDING
+# answers are kept while the database cannot be written
+GAME_ANSWER_LOG_FLUSH_INTERVAL = 5
+GAME_ANSWER_LOG_FLUSH_SIZE = 500
+GAME_ANSWER_LOG_MAX_PENDING = 50000
+# With this off the log is only written on flush(), with no timer, writer
+# thread or flush at exit
+GAME_ANSWER_LOG_BACKGROUND_FLUSH = True
+
+# Item analysis flags a wrong option chosen by less than this share of
+# learners, once at least MIN_LEARNERS answered the item
+GAME_ITEM_ANALYSIS_MIN_LEARNERS = 30
+GAME_ITEM_ANALYSIS_DISTRACTOR_SHARE = 0.02
+
+# Learners who stopped in a lesson count as having abandoned it after
+# this many days without progress
+GAME_FUNNEL_ABANDON_DAYS = 7
+
+# Questions answered wrong come back for review after RELEARN_MINUTES,
+# then at growing intervals until these reach GRADUATE_DAYS
+GAME_REVIEW_RELEARN_MINUTES = 10
+GAME_REVIEW_GRADUATE_DAYS = 90
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -194,9 +266,19 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-
+    # List endpoints page through a cursor in their view's ordering, see API_PAGINATE_ALL_LISTS
+    'DEFAULT_PAGINATION_CLASS': 'sikchhu.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Largest page size clients may ask list endpoints for with ?page_size=
+API_MAX_PAGE_SIZE = 200
+
+# Paged list responses are {next, previous, results} rather than a bare list.
+# While this is off, lists that returned a bare list only page for clients
+# sending ?cursor= or ?page_size=, turn it on once every client does
+API_PAGINATE_ALL_LISTS = False
+
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=10),